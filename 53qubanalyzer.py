@@ -3,21 +3,22 @@
 
 import numpy as np
 
-fo=open('53qub10000.txt','r')
-bigstr=fo.read() # Here I'm opening the file and reading it.
-fo.close()
-new=bigstr.replace('\'','')
-new=new.replace('[','')
-new=new.replace(']','')
-new=new.replace(' ','')
-new=new.split(',') # In these lines I'm treating the data
-tot=len(new)
-
-cl1s= [new[i] for i in range(int(tot/4))]
-cl2s= [new[i+int(tot/4)] for i in range(int(tot/4))]
-cl3s= [new[i+2*int(tot/4)] for i in range(int(tot/4))]
-cl4s= [new[i+3*int(tot/4)] for i in range(int(tot/4))] # In these lines I split up everything into clique data.
-alldata=[cl1s,cl2s,cl3s,cl4s] # A list of all the values
+def load_data(path='53qub10000.txt'): # Reads the file only when asked to, not on import
+    fo=open(path,'r')
+    bigstr=fo.read() # Here I'm opening the file and reading it.
+    fo.close()
+    new=bigstr.replace('\'','')
+    new=new.replace('[','')
+    new=new.replace(']','')
+    new=new.replace(' ','')
+    new=new.split(',') # In these lines I'm treating the data
+    tot=len(new)
+
+    cl1s= [new[i] for i in range(int(tot/4))]
+    cl2s= [new[i+int(tot/4)] for i in range(int(tot/4))]
+    cl3s= [new[i+2*int(tot/4)] for i in range(int(tot/4))]
+    cl4s= [new[i+3*int(tot/4)] for i in range(int(tot/4))] # In these lines I split up everything into clique data.
+    return([cl1s,cl2s,cl3s,cl4s]) # A list of all the values
 
 
 ### ---- NEED TO DEFINE FUNCTIONS FOR COEFFICIENTS
@@ -100,10 +101,12 @@ def distrfinder(V,W,nua,nub,inp_data): # Finds the distribution of single-shot e
     return(h_distr)
 
     
-dis=distrfinder(np.sqrt(3),np.sqrt(2),0,0,alldata)
-var=np.std(dis)/np.sqrt(len(dis))
-mn=sum(dis)/len(dis)
-print("The mean is %f +/- %f " % (mn,var))
+if __name__=='__main__':
+    alldata=load_data()
+    dis=distrfinder(np.sqrt(3),np.sqrt(2),0,0,alldata)
+    var=np.std(dis)/np.sqrt(len(dis))
+    mn=sum(dis)/len(dis)
+    print("The mean is %f +/- %f " % (mn,var))
 
 
 ## That's pretty close if not right on.
\ No newline at end of file
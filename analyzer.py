@@ -2,6 +2,9 @@
 # This will be based on the 53qubanalyzer.py file
 import numpy as np
 import random as ra
+import os
+import re
+from instrument import instrumented
 
 
 def kd(i,j): # Kronecker Delta
@@ -93,11 +96,133 @@ def oeater4(V,W,nua,nub,st): # Works!
             base+=(xzjc(j+1,M,V,W,nua,nub)*(-1)**int(st[j]))+(zxjc(j+1,M,V,W,nua,nub)*(-1)**int(st[j+1]))
     return(base)
 
-def distrfinder(V,W,nua,nub,inp_data_filename): # Finds the distribution of single-shot estimates of <H> FIX TEST AGAINST KNOWN SOLUTIONS
+def num_cliques(M): # How many of the four cliques actually carry Paulis for M qubits
+    if M==1:
+        return(2)
+    elif M==2:
+        return(3)
+    return(4)
+
+def clique_weights(M,V,W,nua,nub): # The oeater coefficients as arrays so that whole blocks of shots can be scored at once
+    # Returns [(constant, Z_j weights, Z_jZ_(j+1) weights) for each clique]. Same terms as oeater1 to oeater4.
+    out=[]
+    const=idenc(M,V,W,nua,nub)
+    lin=np.zeros(M)
+    pair=np.zeros(max(M-1,0))
+    if M>1:
+        lin[0]=z1c(M,V,W,nua,nub)
+        lin[M-1]=zMc(M,V,W,nua,nub)
+        for j in range(1,M-1):
+            lin[j]=zjc(j+1,M,V,W,nua,nub)
+        for j in range(M-1):
+            pair[j]=zijc(j+1,M,V,W,nua,nub)
+    else:
+        const=idenc(1,V,W,nua,nub)
+        lin[0]=2*zjc(1,1,V,W,nua,nub)
+    out.append((const,lin,pair))
+    lin=np.array([xjc(j+1,M,V,W,nua,nub) for j in range(M)])
+    out.append((0.0,lin,np.zeros(max(M-1,0))))
+    for start in (0,1)[:num_cliques(M)-2]: # Cliques 3 and 4 pair up neighbouring qubits starting from 0 and 1 respectively
+        lin=np.zeros(M)
+        for j in range(start,M-1,2):
+            lin[j]+=xzjc(j+1,M,V,W,nua,nub)
+            lin[j+1]+=zxjc(j+1,M,V,W,nua,nub)
+        out.append((0.0,lin,np.zeros(M-1)))
+    return(out)
+
+def bits_from_strings(bitstrings): # Turns a list of equal-length bitstrings into an (shots, M) uint8 array
+    if len(bitstrings)==0:
+        return(np.zeros((0,0),dtype=np.uint8))
+    M=len(bitstrings[0])
+    raw=np.frombuffer(''.join(bitstrings).encode('ascii'),dtype=np.uint8)
+    return((raw-ord('0')).reshape(-1,M))
+
+def strings_from_bits(bits): # Inverse of bits_from_strings
+    bits=np.asarray(bits,dtype=np.uint8)
+    if bits.size==0:
+        return([])
+    M=bits.shape[1]
+    raw=(bits+ord('0')).tobytes().decode('ascii')
+    return([raw[i:i+M] for i in range(0,len(raw),M)])
+
+def oeater_array(weights,bits): # Vectorized output eater. weights is one entry of clique_weights, bits is (shots, M)
+    const,lin,pair=weights
+    spins=1.0-2.0*bits # 0 -> +1 and 1 -> -1, same as (-1)**int(st[j])
+    out=const+spins@lin
+    if len(pair)>0:
+        out+=(spins[:,:-1]*spins[:,1:])@pair
+    return(out)
+
+def packed_weights(weights,M): # Per-byte lookup tables so oeater_packed can score np.packbits rows without unpacking
+    # Returns (constant, (row_bytes, 256) table of each byte's Z and in-byte ZZ energy, ZZ weights across byte borders)
+    const,lin,pair=weights
+    row_bytes=(M+7)//8
+    lin=np.concatenate([lin,np.zeros(8*row_bytes-M)]).reshape(row_bytes,8) # Padding bits get zero weight
+    pair=np.concatenate([pair,np.zeros(8*row_bytes-len(pair))]).reshape(row_bytes,8)
+    spins=1.0-2.0*((np.arange(256)[:,None]>>np.arange(7,-1,-1))&1) # packbits puts the first qubit in the high bit
+    tables=spins@lin.T+(spins[:,:-1]*spins[:,1:])@pair[:,:7].T
+    return((const,np.ascontiguousarray(tables.T),pair[:-1,7]))
+
+def oeater_packed(pweights,packed): # oeater_array on (shots, row_bytes) packed rows, from packed_weights tables
+    const,tables,cross=pweights
+    out=np.full(packed.shape[0],float(const))
+    for k in range(tables.shape[0]):
+        out+=tables[k][packed[:,k]]
+    for k in range(len(cross)):
+        if cross[k]!=0:
+            out+=cross[k]*(1.0-2.0*(packed[:,k]&1))*(1.0-2.0*(packed[:,k+1]>>7))
+    return(out)
+
+def group_blocks(lines): # total_circuit_runner lines (comma-terminated blocks, cliques in turn) -> [[clique1 bitstrings],...]
+    blocks=[(line.split(','))[0:-1] for line in lines]
+    blocks=[b for b in blocks if len(b)>0] # The empty end-of-run line
+    if len(blocks)==0:
+        return([])
+    K=num_cliques(len(blocks[0][0]))
+    groups=[[] for _ in range(min(K,len(blocks)))]
+    for i,b in enumerate(blocks):
+        groups[i%K]+=b
+    return(groups)
+
+def read_cliques(inp_data_filename): # Reads a total_circuit_runner file into [[clique1 bitstrings],[clique2 bitstrings],...]
     fo=open(f'{inp_data_filename}.txt','r')
     bigstr=fo.readlines() # Here I'm opening the file and reading it.
     fo.close()
-    inp_data=[(lilstr.split(','))[0:-1] for lilstr in bigstr]
+    return(group_blocks(bigstr))
+
+def read_legacy(path,num_groups=4): # Reads any of our shot text formats into [[clique1 bitstrings],[clique2 bitstrings],...]
+    # total_circuit_runner files (comma-terminated lines, one block of shots each, cliques in turn), Python list dumps like 53qub10000.txt,
+    # Mathematica {"..",..} lists like 53qublines.txt and one-quoted-string-per-line files like 53qublines2.txt.
+    # Files without explicit grouping are split into num_groups equal cliques, the same as 53qubanalyzer does.
+    with open(path,'r') as fo:
+        text=fo.read()
+    if '{' in text:
+        groups=[re.findall(r'"([01]+)"',g) for g in re.findall(r'\{([^{}]*)\}',text)]
+    elif '[' in text:
+        groups=[re.findall(r"'([01]+)'",g) for g in re.findall(r'\[([^\[\]]*)\]',text)]
+    elif '"' in text:
+        groups=[re.findall(r'"([01]+)"',text)]
+    else:
+        return(group_blocks(text.splitlines()))
+    if len(groups)==1:
+        size=len(groups[0])//num_groups
+        groups=[groups[0][c*size:(c+1)*size] for c in range(num_groups)]
+    return(groups)
+
+def distr_from_archive(V,W,nua,nub,archive_path,start=0,stop=None): # distr_from_bits on a shot range of an archive.ShotArchive
+    # Only the chunks overlapping [start, stop) are read and decompressed.
+    from archive import ShotArchive
+    with ShotArchive(archive_path) as arc:
+        return(distr_from_bits(V,W,nua,nub,[arc.read(c,start,stop) for c in range(arc.num_cliques)]))
+
+def distr_from_bits(V,W,nua,nub,clique_bits): # Vectorized distrfinder on a list of (shots, M) bit arrays, one per clique
+    M=clique_bits[0].shape[1]
+    weights=clique_weights(M,V,W,nua,nub)
+    return(sum(oeater_array(weights[c],clique_bits[c]) for c in range(num_cliques(M))))
+
+@instrumented('distrfinder',lambda a,r: {'shots':len(r),'bytes_read':os.path.getsize(f"{a['inp_data_filename']}.txt")})
+def distrfinder(V,W,nua,nub,inp_data_filename): # Finds the distribution of single-shot estimates of <H> FIX TEST AGAINST KNOWN SOLUTIONS
+    inp_data=read_cliques(inp_data_filename)
     M=len(inp_data[0][0])
     if M==1:
         h_distr=[(oeater1(V,W,nua,nub,inp_data[0][j])+oeater2(V,W,nua,nub,inp_data[1][j])) for j in range(len(inp_data[0]))]
@@ -125,6 +250,33 @@ def distrfinder2(V,W,nua,nub): # Just changing the input to the 53 qubits data g
         h_distr=[(oeater1(V,W,nua,nub,inp_data[0][j])+oeater2(V,W,nua,nub,inp_data[1][j])+oeater3(V,W,nua,nub,inp_data[2][j])+oeater4(V,W,nua,nub,inp_data[3][j])) for j in range(len(inp_data[0]))]
     return(h_distr)
 
+def log_prefixes(shots,num_points=40,smallest=10): # Log-spaced prefix lengths from smallest up to shots (always includes shots)
+    pre=np.unique(np.geomspace(min(smallest,shots),shots,num_points).astype(int))
+    return(pre)
+
+def prefix_convergence(distr,prefixes=None): # Estimate and standard error using only the first n shots, for every n in prefixes
+    # One pass of cumulative sums over the per-shot energies, so any number of prefixes costs the same.
+    # prefixes=None gives every prefix length 1..shots. Returns (prefixes, means, standard errors).
+    distr=np.asarray(distr,dtype=float)
+    if prefixes is None:
+        prefixes=np.arange(1,len(distr)+1)
+    prefixes=np.asarray(prefixes)
+    s1=np.cumsum(distr)[prefixes-1]
+    s2=np.cumsum(distr**2)[prefixes-1]
+    means=s1/prefixes
+    var=np.clip(s2/prefixes-means**2,0,None) # Same normalization as np.std
+    return((prefixes,means,np.sqrt(var/prefixes)))
+
+def convergence_curves(distrs,targets,prefixes): # Relative error (%) versus prefix length for many problems at once
+    # distrs is a list of per-shot energy arrays (each at least max(prefixes) long) and targets the known eigenvalues.
+    rel=np.empty((len(distrs),len(prefixes)))
+    se=np.empty((len(distrs),len(prefixes)))
+    for i in range(len(distrs)):
+        _,means,errs=prefix_convergence(distrs[i],prefixes)
+        rel[i]=abs(100*(means-targets[i])/targets[i])
+        se[i]=errs
+    return((rel,se))
+
 #print(distrfinder(3,1.2,0,0,'test_dest'))
 #distr=distrfinder2(np.sqrt(3),np.sqrt(2),0,0)
 #print(sum(distr)/len(distr))
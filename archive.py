@@ -0,0 +1,128 @@
+# Indexed, chunked binary archive for shot data.
+# Shots are stored per clique as bit-packed (np.packbits) rows in fixed-size chunks, each chunk zlib-compressed.
+# A JSON footer holds the metadata (M, V, W, nua, nub, level, shots, provenance) and the chunk index, so any clique and
+# shot range can be read by decompressing only the chunks it overlaps.
+#
+# Layout: MAGIC | chunk bytes ... | footer JSON | uint64 footer offset | MAGIC
+import os
+import json
+import zlib
+import time
+import struct
+import hashlib
+import numpy as np
+from analyzer import read_legacy, bits_from_strings
+
+MAGIC=b'LMGSHOT1'
+DEFAULT_CHUNK_SHOTS=1<<16
+
+
+def write_archive(path,clique_bits,meta=None,chunk_shots=DEFAULT_CHUNK_SHOTS,compress_level=6):
+    '''
+    Writes a list of (shots, M) bit arrays (one per clique, as from pipeline.sample_cliques) to path.
+    meta is any JSON-serializable dict (M, V, W, nua, nub, level, provenance, ...); M, shots and the
+    per-clique shot counts are filled in from the data.
+    '''
+    M=clique_bits[0].shape[1]
+    meta=dict(meta or {})
+    meta['M']=int(M)
+    meta['shots']=int(clique_bits[0].shape[0])
+    index=[]
+    tmp=path+'.tmp'
+    with open(tmp,'wb') as fo:
+        fo.write(MAGIC)
+        for bits in clique_bits:
+            chunks=[]
+            for start in range(0,bits.shape[0],chunk_shots):
+                block=zlib.compress(np.packbits(bits[start:start+chunk_shots],axis=1).tobytes(),compress_level)
+                chunks.append([fo.tell(),len(block),int(min(chunk_shots,bits.shape[0]-start))])
+                fo.write(block)
+            index.append(chunks)
+        footer=json.dumps({'version':1,'meta':meta,'chunk_shots':chunk_shots,'index':index},default=str).encode()
+        footer_at=fo.tell()
+        fo.write(footer)
+        fo.write(struct.pack('<Q',footer_at))
+        fo.write(MAGIC)
+    os.replace(tmp,path)
+    return(path)
+
+
+class ShotArchive:
+    '''
+    Read side of write_archive. Only the footer is read on open; shot data is read lazily per chunk.
+
+    with ShotArchive('run.lmgz') as arc:
+        bits=arc.read(clique=2,start=1000,stop=2000)
+    '''
+    def __init__(self,path):
+        self.path=path
+        self.fo=open(path,'rb')
+        self.fo.seek(-8-len(MAGIC),os.SEEK_END)
+        tail=self.fo.read()
+        if tail[8:]!=MAGIC:
+            self.fo.close()
+            raise ValueError(f'{path} is not a shot archive')
+        footer_at=struct.unpack('<Q',tail[:8])[0]
+        end=self.fo.seek(0,os.SEEK_END)-len(tail)
+        self.fo.seek(footer_at)
+        footer=json.loads(self.fo.read(end-footer_at).decode())
+        self.meta=footer['meta']
+        self.chunk_shots=footer['chunk_shots']
+        self.index=footer['index']
+        self.M=self.meta['M']
+        self.num_cliques=len(self.index)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def close(self):
+        self.fo.close()
+
+    def shots(self,clique=0):
+        return(sum(c[2] for c in self.index[clique]))
+
+    def _chunk(self,clique,k): # Decompressed (count, M) bits of one chunk
+        offset,nbytes,count=self.index[clique][k]
+        self.fo.seek(offset)
+        packed=np.frombuffer(zlib.decompress(self.fo.read(nbytes)),dtype=np.uint8).reshape(count,-1)
+        return(np.unpackbits(packed,axis=1,count=self.M))
+
+    def read(self,clique,start=0,stop=None): # Bits of shots [start, stop) of one clique
+        total=self.shots(clique)
+        stop=total if stop is None else min(stop,total)
+        if start>=stop:
+            return(np.zeros((0,self.M),dtype=np.uint8))
+        first=start//self.chunk_shots
+        last=(stop-1)//self.chunk_shots
+        parts=[self._chunk(clique,k) for k in range(first,last+1)]
+        out=np.concatenate(parts) if len(parts)>1 else parts[0]
+        return(out[start-first*self.chunk_shots:stop-first*self.chunk_shots])
+
+    def iter_chunks(self,clique): # Streams a clique chunk by chunk
+        for k in range(len(self.index[clique])):
+            yield(self._chunk(clique,k))
+
+
+def file_sha256(path):
+    h=hashlib.sha256()
+    with open(path,'rb') as fo:
+        for block in iter(lambda: fo.read(1<<20),b''):
+            h.update(block)
+    return(h.hexdigest())
+
+
+def convert_legacy(src,dst,meta=None,chunk_shots=DEFAULT_CHUNK_SHOTS):
+    '''
+    Converts a shot text file (any format analyzer.read_legacy understands) into an archive.
+    meta should carry the physics (V, W, nua, nub, level); provenance (source name, size, sha256, time) is added.
+    '''
+    groups=read_legacy(src)
+    clique_bits=[bits_from_strings(g) for g in groups]
+    meta=dict(meta or {})
+    meta.setdefault('provenance',{})
+    meta['provenance'].update({'source':os.path.basename(src),'source_bytes':os.path.getsize(src),
+                               'source_sha256':file_sha256(src),'converted':time.strftime('%Y-%m-%dT%H:%M:%S')})
+    return(write_archive(dst,clique_bits,meta,chunk_shots))
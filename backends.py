@@ -0,0 +1,351 @@
+# Execution backends for total_circuit_runner.
+# A backend turns (angles, clique, shots) into a (shots, M) uint8 array of measured bits, qubit 0 first.
+# DwaveBackend goes through dwave.gate (the reference). NumpyBackend is a dense statevector simulator specialised to
+# the only gates the pipeline uses (RY, CRY, Hadamard, CNOT): each gate is applied in place on strided views of a
+# preallocated (2,)*M tensor, so there is no per-gate circuit object overhead and no temporary full-size copies.
+# MpsBackend keeps the state as a bond dimension 2-4 matrix product state, so it scales to any M (see dispatch.py for
+# choosing between them).
+#
+# total_circuit_runner(angles, None, 10**4, backend=NumpyBackend(seed=1))
+import numpy as np
+from analyzer import num_cliques, bits_from_strings
+from instrument import instrumented, statevector_bytes
+
+
+class DwaveBackend:
+    name='dwave'
+
+    def sample_clique(self,angles,clique,num_shots):
+        from lmg import state_prep, clique1_diag, clique2_diag, clique3_diag, clique4_diag
+        circ=state_prep(angles)
+        circ.unlock()
+        if clique==1:
+            outs=clique1_diag(circ,num_shots)[0]
+        else:
+            outs=(clique2_diag,clique3_diag,clique4_diag)[clique-2](circ,num_shots)
+        return(bits_from_strings(outs))
+
+    def sample_circuit(self,angles,circuit,num_shots): # state_prep(angles) followed by a pauli.py circuit
+        from lmg import state_prep
+        circ=state_prep(angles)
+        circ.unlock()
+        return(self._append_and_sample(circ,circuit,num_shots))
+
+    def sample_program(self,num_qubits,circuit,num_shots): # |0...0> followed by a gate list (see binary.py)
+        from dwave.gate import Circuit
+        return(self._append_and_sample(Circuit(num_qubits,num_qubits),circuit,num_shots))
+
+    def _append_and_sample(self,circ,circuit,num_shots):
+        import dwave.gate.operations as gt
+        import dwave.gate.simulator
+        gates={'h':gt.Hadamard,'s':gt.S,'cnot':gt.CNOT,'cz':gt.CZ}
+        with circ.context as reg:
+            for gate,qubits,*params in circuit:
+                if gate=='sdg': # S^dagger = S^3
+                    for k in range(3):
+                        gt.S(reg.q[qubits[0]])
+                elif gate=='ry':
+                    gt.RY(params[0],reg.q[qubits[0]])
+                else:
+                    gates[gate](*[reg.q[k] for k in qubits])
+            meas=gt.Measurement(reg.q) | reg.c
+        dwave.gate.simulator.simulate(circ)
+        return(bits_from_strings(meas.sample(list(range(circ.num_qubits)),num_shots,as_bitstring=True)))
+
+
+def _half(T,q,control=None): # Views of the q=0 and q=1 halves of the state tensor (optionally only where control is 1)
+    # Length-1 slices rather than integer indices, so the result is always a view (even when every axis is fixed)
+    i0=[slice(None)]*T.ndim
+    if control is not None:
+        i0[control]=slice(1,2)
+    i1=list(i0)
+    i0[q]=slice(0,1)
+    i1[q]=slice(1,2)
+    return(T[tuple(i0)],T[tuple(i1)])
+
+
+def _per_member(x,a): # Scalar angle terms broadcast as is; a (batch,) array is shaped to line up with the batch axis
+    x=np.asarray(x)
+    return(x.reshape(x.shape+(1,)*(a.ndim-x.ndim)) if x.ndim else x)
+
+
+def apply_ry(T,q,theta,control=None): # RY(theta) on tensor axis q, or CRY when control is given
+    a0,a1=_half(T,q,control)
+    c=_per_member(np.cos(np.asarray(theta)/2),a0)
+    s=_per_member(np.sin(np.asarray(theta)/2),a0)
+    tmp=a0.copy()
+    a0*=c
+    a0-=s*a1
+    a1*=c
+    a1+=s*tmp
+
+
+def apply_h(T,q):
+    a0,a1=_half(T,q)
+    tmp=a0.copy()
+    a0+=a1
+    a1*=-1
+    a1+=tmp
+    a0*=np.sqrt(0.5)
+    a1*=np.sqrt(0.5)
+
+
+def apply_cnot(T,control,target):
+    a0,a1=_half(T,target,control)
+    tmp=a0.copy()
+    a0[...]=a1
+    a1[...]=tmp
+
+
+def apply_phase(T,q,phase): # diag(1, phase) on qubit q: S is phase 1j, S^dagger is -1j (needs a complex dtype)
+    a0,a1=_half(T,q)
+    a1*=phase
+
+
+def apply_cz(T,a,b):
+    a0,a1=_half(T,b,a)
+    a1*=-1
+
+
+def apply_circuit(T,circuit,offset=0): # Gate lists (gate, qubits) from pauli.py, or (gate, qubits, theta) for 'ry'
+    for gate,qubits,*params in circuit:
+        q=[offset+k for k in qubits]
+        if gate=='ry':
+            apply_ry(T,q[0],params[0])
+        elif gate=='h':
+            apply_h(T,q[0])
+        elif gate=='s':
+            apply_phase(T,q[0],1j)
+        elif gate=='sdg':
+            apply_phase(T,q[0],-1j)
+        elif gate=='cnot':
+            apply_cnot(T,q[0],q[1])
+        elif gate=='cz':
+            apply_cz(T,q[0],q[1])
+        else:
+            raise ValueError(f'Unknown gate {gate!r}')
+    return(T)
+
+
+class NumpyBackend:
+    '''
+    Dense statevector backend. dtype=np.complex64 halves the memory of the default complex128; since every gate the
+    pipeline uses is real, np.float64 / np.float32 are also exact and halve it again.
+    The prepared state for the last angles is kept, so the four cliques of one point only run state_prep once.
+    prepare, basis_change and sample_clique_batch also take a (batch, M) array of angles, in which case the state is a
+    (batch,)+(2,)*M tensor and every gate is one vectorized kernel over the whole batch.
+    '''
+    name='numpy'
+
+    def __init__(self,dtype=np.complex128,seed=None):
+        self.dtype=np.dtype(dtype)
+        self.rng=np.random.default_rng(seed)
+        self._base=None # Prepared state for self._angles
+        self._work=None # Scratch buffer the basis changes are applied to
+        self._angles=None
+
+    def _buffers(self,M):
+        if self._base is None or self._base.ndim!=M:
+            self._base=np.empty((2,)*M,dtype=self.dtype)
+            self._work=np.empty((2,)*M,dtype=self.dtype)
+            self._angles=None
+        return(self._base,self._work)
+
+    def prepare(self,angles,out=None): # state_prep(angles) as a (2,)*M tensor, qubit 0 on axis 0 (after any batch axis)
+        angles=np.asarray(angles,dtype=float)
+        M=angles.shape[-1]
+        b=angles.ndim-1 # Number of batch axes (0 or 1)
+        T=np.empty(angles.shape[:-1]+(2,)*M,dtype=self.dtype) if out is None else out
+        T.fill(0)
+        T[(Ellipsis,)+(0,)*M]=1
+        apply_ry(T,b,angles[...,0])
+        for k in range(1,M):
+            apply_ry(T,b+k,angles[...,k],control=b+k-1)
+        return(T)
+
+    def statevector(self,angles): # Flat statevector in the simulator's ordering (qubit 0 most significant)
+        return(self.prepare(angles).reshape(-1))
+
+    def basis_change(self,T,clique,batch=False): # Same gates as lmg.clique_basis_change
+        b=int(batch)
+        M=T.ndim-b
+        if clique==2:
+            for k in range(M):
+                apply_h(T,b+k)
+        elif clique in (3,4):
+            for k in range(clique-3,M-1,2):
+                apply_h(T,b+k+1)
+                apply_cnot(T,b+k,b+k+1)
+                apply_h(T,b+k)
+        return(T)
+
+    def clique_state(self,angles,clique):
+        M=len(angles)
+        base,work=self._buffers(M)
+        if self._angles is None or not np.array_equal(self._angles,angles):
+            self.prepare(angles,base)
+            self._angles=np.array(angles,dtype=float)
+        np.copyto(work,base)
+        return(self.basis_change(work,clique))
+
+    def sample_circuit(self,angles,circuit,num_shots): # state_prep(angles) followed by a pauli.py circuit
+        M=len(angles)
+        base,work=self._buffers(M)
+        if self._angles is None or not np.array_equal(self._angles,angles):
+            self.prepare(angles,base)
+            self._angles=np.array(angles,dtype=float)
+        if any(gate in ('s','sdg') for gate,*rest in circuit) and self.dtype.kind!='c':
+            raise ValueError('Phase gates need a complex dtype')
+        np.copyto(work,base)
+        return(sample_bits(apply_circuit(work,circuit).reshape(-1),num_shots,self.rng))
+
+    def sample_program(self,num_qubits,circuit,num_shots): # |0...0> followed by a gate list (see binary.py)
+        if any(gate in ('s','sdg') for gate,*rest in circuit) and self.dtype.kind!='c':
+            raise ValueError('Phase gates need a complex dtype')
+        T=np.zeros((2,)*num_qubits,dtype=self.dtype)
+        T[(0,)*num_qubits]=1
+        return(sample_bits(apply_circuit(T,circuit).reshape(-1),num_shots,self.rng))
+
+    @instrumented('backends.numpy.sample_clique',lambda a,r: {'shots':a['num_shots'],'statevector_bytes':statevector_bytes(len(a['angles']),a['self'].dtype.itemsize)})
+    def sample_clique(self,angles,clique,num_shots):
+        T=self.clique_state(angles,clique)
+        return(sample_bits(T.reshape(-1),num_shots,self.rng))
+
+    def sample_clique_batch(self,angle_rows,clique,num_shots,base=None):
+        # (batch, M) angles -> (batch, num_shots, M) bits. base is an already prepared batch to start from (left untouched).
+        angle_rows=np.asarray(angle_rows,dtype=float)
+        T=self.prepare(angle_rows) if base is None else base.copy()
+        self.basis_change(T,clique,batch=True)
+        return(sample_bits_batch(T.reshape(T.shape[0],-1),num_shots,self.rng))
+
+
+class MpsBackend:
+    '''
+    Matrix product state backend. state_prep only produces the M+1 thermometer states |1..10..0>, which is an exact MPS
+    of bond dimension 2 (the bond records whether the run of ones has ended yet), and the clique basis changes act on
+    disjoint neighbouring pairs, which at most doubles it. Memory and time are linear in M, so any number of qubits
+    works; shots are drawn qubit by qubit from the conditional probabilities, vectorized over the shots.
+    '''
+    name='mps'
+
+    def __init__(self,seed=None):
+        self.rng=np.random.default_rng(seed)
+
+    def clique_mps(self,angles,clique): # [(left bond, 2, right bond) site tensors], qubit 0 first
+        from verify import unary_amplitudes
+        M=len(angles)
+        c=unary_amplitudes(angles)[::-1] # c[m] is the amplitude of the state with m leading ones
+        sites=[]
+        for j in range(M):
+            A=np.zeros((2,2,2))
+            A[1,1,1]=1.0 # Still in the run of ones
+            A[1,0,0]=c[j] # The run ends at qubit j
+            A[0,0,0]=1.0 # Zeros after the end
+            sites.append(A)
+        sites[0]=sites[0][1:] # Every state starts inside the run
+        sites[-1]=sites[-1]@np.array([[1.0],[c[M]]]) # All ones when the run never ends
+        if clique==2:
+            H=np.array([[1.0,1.0],[1.0,-1.0]])*np.sqrt(0.5)
+            sites=[np.einsum('ts,lsr->ltr',H,A) for A in sites]
+        elif clique in (3,4):
+            for k in range(clique-3,M-1,2):
+                sites[k],sites[k+1]=_apply_pair(sites[k],sites[k+1],PAIR_BASIS_CHANGE)
+        return(sites)
+
+    @instrumented('backends.mps.sample_clique',lambda a,r: {'shots':a['num_shots']})
+    def sample_clique(self,angles,clique,num_shots):
+        return(sample_mps(self.clique_mps(angles,clique),num_shots,self.rng))
+
+
+def _pair_gate(): # H(k+1), CNOT(k,k+1), H(k) as one 4x4 matrix on (qubit k, qubit k+1)
+    H=np.array([[1.0,1.0],[1.0,-1.0]])*np.sqrt(0.5)
+    I=np.eye(2)
+    CNOT=np.array([[1.0,0,0,0],[0,1.0,0,0],[0,0,0,1.0],[0,0,1.0,0]])
+    return(np.kron(H,I)@CNOT@np.kron(I,H))
+
+PAIR_BASIS_CHANGE=_pair_gate()
+
+
+def _apply_pair(A,B,gate,cutoff=1e-14): # Two-qubit gate on neighbouring sites, split back with an exact (truncation-free) SVD
+    l,r=A.shape[0],B.shape[2]
+    theta=np.einsum('lam,mbr->labr',A,B).reshape(l,4,r)
+    theta=np.einsum('ts,lsr->ltr',gate,theta).reshape(l*2,2*r)
+    u,s,vt=np.linalg.svd(theta,full_matrices=False)
+    keep=max(1,int(np.sum(s>cutoff*s[0])))
+    return((u[:,:keep]*s[:keep]).reshape(l,2,keep),vt[:keep].reshape(keep,2,r))
+
+
+def mps_environments(sites): # envs[j] contracts sites j.. with themselves (real tensors), envs[M] is [[1]]
+    envs=[np.ones((1,1))]
+    for A in sites[::-1]:
+        E=envs[-1]
+        envs.append(np.einsum('lsr,rq,psq->lp',A,E,A))
+    return(envs[::-1])
+
+
+def sample_mps(sites,num_shots,rng): # (shots, M) bits sampled qubit by qubit from a real MPS
+    envs=mps_environments(sites)
+    M=len(sites)
+    bits=np.empty((num_shots,M),dtype=np.uint8)
+    L=np.ones((num_shots,1))
+    for j,A in enumerate(sites):
+        v0=L@A[:,0,:]
+        v1=L@A[:,1,:]
+        p0=np.einsum('ni,ij,nj->n',v0,envs[j+1],v0)
+        p1=np.einsum('ni,ij,nj->n',v1,envs[j+1],v1)
+        one=rng.random(num_shots)*(p0+p1)<p1
+        bits[:,j]=one
+        L=np.where(one[:,None],v1,v0)
+        L/=np.sqrt(np.where(one,p1,p0))[:,None] # Keeps the conditional amplitudes O(1)
+    return(bits)
+
+
+def sample_bits(state,num_shots,rng): # Full-register measurement samples of a flat statevector as (shots, M) bits
+    return(sample_bits_batch(state.reshape(1,-1),num_shots,rng)[0])
+
+
+def sample_bits_batch(states,num_shots,rng): # (batch, 2^M) statevectors -> (batch, shots, M) bits, one pass
+    # Outcome counts are drawn with one multinomial per member and then shuffled, which avoids a binary search per shot;
+    # shots stay in random order so that clique k's shot i is still independent of clique l's shot i.
+    B,N=states.shape
+    probs=np.abs(states).astype(np.float64)**2
+    probs/=probs.sum(axis=1,keepdims=True)
+    counts=rng.multinomial(num_shots,probs)
+    idx=np.repeat(np.tile(np.arange(N),B),counts.reshape(-1)).reshape(B,num_shots)
+    rng.permuted(idx,axis=1,out=idx)
+    M=N.bit_length()-1
+    if N<=B*num_shots: # Cheaper to gather rows of a small outcome -> bits table
+        return(index_bits(np.arange(N),M)[idx])
+    return(index_bits(idx.reshape(-1),M).reshape(B,num_shots,M))
+
+
+def index_bits(idx,M): # Basis-state indices to (n, M) bits with qubit 0 as the most significant bit
+    shifts=np.arange(M-1,-1,-1,dtype=np.int64)
+    return(((np.asarray(idx,dtype=np.int64)[:,None]>>shifts)&1).astype(np.uint8))
+
+
+BACKENDS={'dwave':DwaveBackend,'numpy':NumpyBackend,'mps':MpsBackend}
+
+def get_backend(backend): # Accepts a backend object, a registered name or None (the dwave.gate reference)
+    if backend is None:
+        return(DwaveBackend())
+    if isinstance(backend,str):
+        return(BACKENDS[backend]())
+    return(backend)
+
+
+def run_cliques(angles,num_shots,backend): # All the cliques M needs, as a list of (shots, M) bit arrays
+    backend=get_backend(backend)
+    return([backend.sample_clique(angles,clique,num_shots) for clique in range(1,num_cliques(len(angles))+1)])
+
+
+def run_cliques_batch(angle_rows,num_shots,backend='numpy'):
+    # Every clique for a (batch, M) array of angles, as a list of (batch, shots, M) bit arrays.
+    # Backends without sample_clique_batch (dwave) are run member by member.
+    backend=get_backend(backend)
+    angle_rows=np.asarray(angle_rows,dtype=float)
+    cliques=range(1,num_cliques(angle_rows.shape[1])+1)
+    if not hasattr(backend,'sample_clique_batch'):
+        return([np.stack([backend.sample_clique(a,c,num_shots) for a in angle_rows]) for c in cliques])
+    base=backend.prepare(angle_rows) # state_prep once, shared by all the cliques
+    return([backend.sample_clique_batch(angle_rows,c,num_shots,base) for c in cliques])
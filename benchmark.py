@@ -0,0 +1,162 @@
+# Stage-by-stage benchmark of the pipeline across qubit count M and shot count.
+# Each stage is timed on its own: eigensolve (ham_maker + eigh), angle_finder, circuit construction, simulate,
+# sampling, writing the shot file, parsing it back and scoring (vectorized and the original per-shot oeaters).
+# The bundled 53-qubit data files are timed as fixed analysis workloads.
+# Results are written as JSON so that runs from different releases can be compared.
+#
+# python benchmark.py --out bench.json --max-M 12 --max-shots 100000
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+from state_generator import state_finder_fock, angle_finder
+from lmg import state_prep, clique_basis_change, write_clique_line
+from analyzer import (read_cliques, read_legacy, bits_from_strings, distr_from_bits, num_cliques, distrfinder2,
+                      oeater1, oeater2, oeater3, oeater4)
+
+DEFAULT_MS=(1,2,3,4,6,8,10,12,14,16)
+DEFAULT_SHOTS=(10,10**2,10**3,10**4,10**5,10**6)
+LEGACY_SCORE_LIMIT=10**5 # The per-shot Python oeaters get slow beyond this
+
+
+def timed(fn,*args,repeats=1): # Returns (best wall time over repeats, result of the last call)
+    best=None
+    for _ in range(repeats):
+        start=time.perf_counter()
+        out=fn(*args)
+        took=time.perf_counter()-start
+        best=took if best is None else min(best,took)
+    return(best,out)
+
+
+def build_clique_circuits(angles): # State prep + basis change + measurement for every clique that M needs
+    import dwave.gate.operations as gt
+    built=[]
+    for clique in range(1,num_cliques(len(angles))+1):
+        circ=state_prep(angles)
+        circ.unlock()
+        clique_basis_change(circ,clique)
+        circ.unlock()
+        with circ.context as reg:
+            meas=gt.Measurement(reg.q) | reg.c
+        built.append((circ,meas))
+    return(built)
+
+
+def simulate_all(built):
+    import dwave.gate.simulator
+    for circ,meas in built:
+        dwave.gate.simulator.simulate(circ)
+
+
+def sample_all(built,shots):
+    return([meas.sample(list(range(circ.num_qubits)),shots,as_bitstring=True) for circ,meas in built])
+
+
+def write_all(outs,name):
+    with open(name+'.txt','w') as fo:
+        for o in outs:
+            write_clique_line(fo,o)
+
+
+def parse_all(name):
+    return([bits_from_strings(strs) for strs in read_cliques(name)])
+
+
+def legacy_score(V,W,nua,nub,outs): # The original per-shot scoring loop from distrfinder
+    eaters=(oeater1,oeater2,oeater3,oeater4)[:len(outs)]
+    return([sum(eaters[c](V,W,nua,nub,outs[c][j]) for c in range(len(outs))) for j in range(len(outs[0]))])
+
+
+def bench_point(M,shots,V=3.0,W=1.2,nua=0,nub=1,repeats=1,scratch_dir=None):
+    # Times every stage for one (M, shots). Returns {stage: seconds}.
+    stages={}
+    stages['eigensolve'],(targ_val,targ_state)=timed(state_finder_fock,M,V,W,nua,nub,0,repeats=repeats)
+    stages['angle_finder'],angs=timed(angle_finder,targ_state,repeats=repeats)
+    stages['build_circuits'],built=timed(build_clique_circuits,angs,repeats=repeats)
+    stages['simulate'],_=timed(simulate_all,built,repeats=repeats)
+    stages['sample'],outs=timed(sample_all,built,shots)
+    fd,path=tempfile.mkstemp(dir=scratch_dir,suffix='.txt')
+    os.close(fd)
+    name=path[:-4]
+    try:
+        stages['write_file'],_=timed(write_all,outs,name,repeats=repeats)
+        stages['bytes_written']=os.path.getsize(path)
+        stages['parse_file'],bits=timed(parse_all,name,repeats=repeats)
+    finally:
+        os.remove(path)
+    stages['score'],distr=timed(distr_from_bits,V,W,nua,nub,bits,repeats=repeats)
+    if shots<=LEGACY_SCORE_LIMIT:
+        stages['score_legacy'],_=timed(legacy_score,V,W,nua,nub,outs)
+    stages['mean']=float(np.mean(distr))
+    stages['target']=float(targ_val)
+    return(stages)
+
+
+def bench_53qub(repeats=1): # Fixed analysis workloads on the bundled 53-qubit data
+    V,W=np.sqrt(3),np.sqrt(2)
+    out=[]
+    if os.path.exists('53qub10000.txt'):
+        t_parse,strs=timed(read_legacy,'53qub10000.txt',repeats=repeats)
+        t_bits,bits=timed(lambda: [bits_from_strings(s) for s in strs],repeats=repeats)
+        t_score,distr=timed(distr_from_bits,V,W,0,0,bits,repeats=repeats)
+        t_legacy,_=timed(legacy_score,V,W,0,0,strs)
+        out.append({'workload':'53qub10000','parse_file':t_parse,'to_bits':t_bits,'score':t_score,
+                    'score_legacy':t_legacy,'mean':float(np.mean(distr))})
+    if os.path.exists('53qublines2.txt'):
+        t_legacy,distr=timed(distrfinder2,V,W,0,0)
+        out.append({'workload':'53qublines2','parse_and_score_legacy':t_legacy,'mean':float(np.mean(distr))})
+    return(out)
+
+
+def metadata():
+    try:
+        rev=subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True).stdout.strip()
+    except OSError:
+        rev=''
+    return({'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),'python':sys.version.split()[0],'numpy':np.__version__,
+            'platform':platform.platform(),'processor':platform.processor(),'git_rev':rev})
+
+
+def run_benchmarks(Ms=DEFAULT_MS,shots_list=DEFAULT_SHOTS,max_stage_seconds=60.0,repeats=1,include_53qub=True,verbose=True):
+    '''
+    Runs bench_point over the (M, shots) grid. Once the sampling stage for some M takes longer than
+    max_stage_seconds, larger shot counts for that M are recorded as skipped instead of being run.
+    '''
+    results=[]
+    for M in Ms:
+        too_slow=False
+        for shots in shots_list:
+            if too_slow:
+                results.append({'M':M,'shots':shots,'skipped':True})
+                continue
+            stages=bench_point(M,shots,repeats=repeats)
+            results.append({'M':M,'shots':shots,'skipped':False,'stages':stages})
+            if verbose:
+                print(f'M={M} shots={shots}: '+', '.join(f'{k}={v:.4g}' for k,v in stages.items()))
+            too_slow=stages['sample']>max_stage_seconds
+    out={'meta':metadata(),'points':results}
+    if include_53qub:
+        out['workloads']=bench_53qub(repeats)
+    return(out)
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Stage-by-stage LMG pipeline benchmark')
+    parser.add_argument('--out',default='bench.json',help='JSON file to write the results to')
+    parser.add_argument('--max-M',type=int,default=max(DEFAULT_MS))
+    parser.add_argument('--max-shots',type=int,default=max(DEFAULT_SHOTS))
+    parser.add_argument('--max-stage-seconds',type=float,default=60.0)
+    parser.add_argument('--repeats',type=int,default=1)
+    parser.add_argument('--skip-53qub',action='store_true')
+    args=parser.parse_args()
+    res=run_benchmarks([M for M in DEFAULT_MS if M<=args.max_M],[s for s in DEFAULT_SHOTS if s<=args.max_shots],
+                       args.max_stage_seconds,args.repeats,not args.skip_53qub)
+    with open(args.out,'w') as fo:
+        json.dump(res,fo,indent=1)
+    print(f'Wrote {args.out}')
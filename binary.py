@@ -0,0 +1,199 @@
+# Binary (compact) encoding of the LMG Fock space.
+# total_circuit_runner spends M qubits on the M+1 Fock states (unary encoding). Here Fock state i (state_finder_fock
+# order) is the computational basis state |i> of n=ceil(log2(M+1)) qubits, qubit 0 most significant; the basis states
+# above M are unused and get zero amplitude and zero Hamiltonian entries.
+#   state prep:   a binary tree of RY rotations, level k a uniformly controlled RY on qubit k (Gray-code CNOT ladder),
+#                 2^n-2 CNOTs in total, exact for any real state
+#   Hamiltonian:  Pauli decomposition of the tridiagonal H, one Walsh-Hadamard transform per off-diagonal bit pattern
+#   measurement:  pauli.measurement_plan groups ('qwc' or 'full') with their Clifford basis changes, scored with
+#                 pauli.distr_from_plan
+# The simulation is exponentially smaller (2^n amplitudes instead of 2^M), but the Hamiltonian has O(n 2^n) terms
+# instead of O(M), so it needs more measurement groups and deeper circuits. compare_encodings puts numbers on this.
+#
+# res=run_binary(12,3.0,1.2,0,1,energy_level=1,shots=10**4)
+# compare_encodings(12,3.0,1.2,0,1)
+import numpy as np
+from state_generator import ham_diagonals, state_finder_fock
+from pauli import measurement_plan, distr_from_plan, score_group
+
+
+def binary_qubits(M): # Qubits needed for the M+1 Fock states
+    return(max(1,int(np.ceil(np.log2(M+1)))))
+
+
+def fwht(f): # Walsh-Hadamard transform: out[b] = sum_j (-1)^(popcount(b & j)) f[j]
+    f=np.array(f,dtype=float)
+    h=1
+    while h<len(f):
+        f=f.reshape(-1,2,h)
+        f=np.stack([f[:,0]+f[:,1],f[:,0]-f[:,1]],axis=1).reshape(-1)
+        h*=2
+    return(f)
+
+
+def _popcount(a):
+    a=np.asarray(a,dtype=np.int64)
+    count=np.zeros_like(a)
+    while np.any(a):
+        count+=a&1
+        a=a>>1
+    return(count)
+
+
+def pauli_decompose_tridiagonal(diag,off,n=None,tol=1e-12):
+    '''
+    Pauli sum {pauli string: coefficient} of the symmetric tridiagonal matrix (diag, off) embedded in n qubits.
+    The coefficient of i^(a.b) X^a Z^b is 2^-n sum_j (-1)^(b.j) H[j, j^a]; only the X patterns a = j^(j+1) (and a=0
+    for the diagonal) have nonzero entries, so each needs one transform. Terms with an odd number of Ys vanish for a
+    real symmetric matrix.
+    '''
+    n=binary_qubits(len(diag)-1) if n is None else n
+    dim=1<<n
+    patterns={0:np.zeros(dim)}
+    patterns[0][:len(diag)]=diag
+    for j,h in enumerate(off):
+        a=j^(j+1)
+        f=patterns.setdefault(a,np.zeros(dim))
+        f[j]=h
+        f[j+1]=h
+    scale=max(np.max(np.abs(diag)),np.max(np.abs(off)) if len(off) else 0.0,1.0)
+    shifts=n-1-np.arange(n)
+    out={}
+    for a,f in patterns.items():
+        coefs=fwht(f)/dim
+        b=np.arange(dim)
+        ys=_popcount(b&a)
+        keep=(ys%2==0)&(np.abs(coefs)>tol*scale)
+        xbits=(a>>shifts)&1
+        for bb,y,c in zip(b[keep],ys[keep],coefs[keep]):
+            zbits=(bb>>shifts)&1
+            out[''.join('IZXY'[x*2+z] for x,z in zip(xbits,zbits))]=float(c*(-1)**(y//2)) # i^y for even y
+    return(out)
+
+
+def binary_pauli_sum(M,V,W,nua,nub):
+    return(pauli_decompose_tridiagonal(*ham_diagonals(M,V,W,nua,nub),binary_qubits(M)))
+
+
+def binary_amplitudes(fock_state,n=None): # Fock amplitudes padded to the 2^n binary basis
+    n=binary_qubits(len(fock_state)-1) if n is None else n
+    out=np.zeros(1<<n)
+    out[:len(fock_state)]=fock_state
+    return(out)
+
+
+def tree_angles(amps):
+    # RY angles per qubit: level k holds 2^k angles, one per value of qubits 0..k-1. Inner levels split the norm of
+    # each branch, the last level uses the signed amplitudes so that any real state is reached.
+    n=len(amps).bit_length()-1
+    levels=[]
+    for k in range(n):
+        branches=np.asarray(amps,dtype=float).reshape(1<<k,2,-1)
+        if k==n-1:
+            zero,one=branches[:,0,0],branches[:,1,0]
+        else:
+            zero,one=np.linalg.norm(branches[:,0],axis=1),np.linalg.norm(branches[:,1],axis=1)
+        levels.append(2*np.arctan2(one,zero))
+    return(levels)
+
+
+def uniformly_controlled_ry(controls,target,angles):
+    # RY(angles[i]) on target when the controls (first one most significant) read i, as alternating RYs and CNOTs
+    # (Mottonen et al., quant-ph/0407010): 2^k rotations and 2^k CNOTs for k controls.
+    k=len(controls)
+    if k==0:
+        return([('ry',(target,),float(angles[0]))])
+    size=1<<k
+    gray=np.arange(size)^(np.arange(size)>>1)
+    sign=1-2*(_popcount(gray[:,None]&np.arange(size)[None,:])%2) # (-1)^(g_i . j)
+    theta=sign@np.asarray(angles,dtype=float)/size
+    circuit=[]
+    for i in range(size):
+        circuit.append(('ry',(target,),float(theta[i])))
+        flip=int(gray[i]^gray[(i+1)%size]) # The one control bit that changes next
+        circuit.append(('cnot',(controls[k-flip.bit_length()],target)))
+    return(circuit)
+
+
+def binary_prep_circuit(amps): # |0...0> -> the real state amps (length 2^n, qubit 0 most significant)
+    circuit=[]
+    for k,angles in enumerate(tree_angles(amps)):
+        circuit+=uniformly_controlled_ry(list(range(k)),k,angles)
+    return(circuit)
+
+
+def binary_setup(M,V,W,nua,nub,energy_level=0,mode='qwc'):
+    # Everything a binary-encoded run needs: {'M','n','target','state','amps','prep','pauli_sum','plan'}
+    n=binary_qubits(M)
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,energy_level)
+    amps=binary_amplitudes(targ_state,n)
+    pauli_sum=binary_pauli_sum(M,V,W,nua,nub)
+    return({'M':M,'n':n,'target':float(targ_val),'state':targ_state,'amps':amps,'prep':binary_prep_circuit(amps),
+            'pauli_sum':pauli_sum,'plan':measurement_plan(pauli_sum,mode)})
+
+
+def sample_binary(setup,num_shots=10**4,backend='numpy'): # One (shots, n) bit array per measurement group
+    from backends import get_backend
+    backend=get_backend(backend)
+    return([backend.sample_program(setup['n'],setup['prep']+g['circuit'],num_shots) for g in setup['plan']])
+
+
+def run_binary(M,V,W,nua,nub,energy_level=0,shots=10**4,mode='qwc',backend='numpy'):
+    '''
+    run_point with the binary encoding. Returns {'target','state','setup','group_bits','distr','mean','std_error'};
+    every group is measured shots times, and distr adds up shot j of every group as distr_from_bits does.
+    '''
+    setup=binary_setup(M,V,W,nua,nub,energy_level,mode)
+    group_bits=sample_binary(setup,shots,backend)
+    distr=distr_from_plan(setup['plan'],group_bits)
+    return({'target':setup['target'],'state':setup['state'],'setup':setup,'group_bits':group_bits,'distr':distr,
+            'mean':float(np.mean(distr)),'std_error':float(np.std(distr)/np.sqrt(shots))})
+
+
+def plan_moments(plan,state): # Exact <H> and single-shot sigma (groups measured independently) from a statevector
+    from backends import apply_circuit, index_bits
+    n=state.size.bit_length()-1
+    outcomes=index_bits(np.arange(state.size),n)
+    mean=0.0
+    var=0.0
+    for g in plan:
+        T=np.array(state,dtype=complex).reshape((2,)*n)
+        probs=np.abs(apply_circuit(T,g['circuit']).reshape(-1))**2
+        energies=score_group(g,outcomes)
+        m=float(probs@energies)
+        mean+=m
+        var+=float(probs@(energies-m)**2)
+    return(mean,float(np.sqrt(var)))
+
+
+def _two_qubit_gates(circuit):
+    return(sum(1 for gate,*rest in circuit if gate in ('cnot','cz')))
+
+
+def compare_encodings(M,V,W,nua,nub,energy_level=0,mode='qwc',se=None):
+    '''
+    Resource comparison of the unary four-clique scheme and the binary encoding for one problem. Per encoding:
+    'qubits', 'terms' (Pauli terms), 'groups' (circuits per estimate), 'prep_cnots' (CRY counted as 2 CNOTs),
+    'measure_cnots' (two-qubit gates in all basis changes), 'statevector_bytes' (dense simulation), 'exact' (exact
+    <H> of the prepared state), 'sigma' (single-shot spread) and 'executions', the total circuit runs for a standard
+    error of se (default 1% of |target|).
+    '''
+    from analyzer import num_cliques
+    from pauli import lmg_pauli_sum
+    from dispatch import analytic_estimate
+    from state_generator import angle_finder
+    setup=binary_setup(M,V,W,nua,nub,energy_level,mode)
+    se=0.01*max(abs(setup['target']),1e-12) if se is None else se
+    unary=analytic_estimate(V,W,nua,nub,angle_finder(setup['state']),1)
+    out={'target':setup['target'],'se':se}
+    out['unary']={'qubits':M,'terms':len(lmg_pauli_sum(M,V,W,nua,nub)),'groups':num_cliques(M),'prep_cnots':2*(M-1),
+                  'measure_cnots':M-1,'statevector_bytes':16*2**M,'exact':unary['mean'],'sigma':unary['sigma']}
+    b_mean,b_sigma=plan_moments(setup['plan'],setup['amps'])
+    out['binary']={'qubits':setup['n'],'terms':len(setup['pauli_sum']),'groups':len(setup['plan']),
+                   'prep_cnots':_two_qubit_gates(setup['prep']),
+                   'measure_cnots':sum(_two_qubit_gates(g['circuit']) for g in setup['plan']),
+                   'statevector_bytes':16*2**setup['n'],'exact':b_mean,'sigma':b_sigma}
+    for enc in ('unary','binary'):
+        r=out[enc]
+        r['executions']=int(r['groups']*np.ceil(r['sigma']**2/se**2))
+    return(out)
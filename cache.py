@@ -0,0 +1,128 @@
+# Content-addressed cache of full runs (eigensolve, circuits, sampling and analysis).
+# A run is keyed by a hash of (M, V, W, nua, nub, level, shots, seed) together with a hash of the source of the modules
+# that produce the numbers, so editing lmg.py, state_generator.py, analyzer.py or pipeline.py invalidates old entries.
+# Entries are single npz files holding the sampled shots as bit arrays plus the computed statistics.
+# The cache directory is kept under max_bytes by evicting the least recently used entries.
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import lmg
+import analyzer
+import state_generator
+import pipeline
+
+DEFAULT_CACHE_DIR='.lmg_cache'
+_code_version=None
+
+
+def code_version(): # Hash of the source files that determine a run's output
+    global _code_version
+    if _code_version is None:
+        h=hashlib.sha256()
+        for mod in (lmg,analyzer,state_generator,pipeline):
+            with open(mod.__file__,'rb') as fo:
+                h.update(fo.read())
+        _code_version=h.hexdigest()[:16]
+    return(_code_version)
+
+
+def run_key(M,V,W,nua,nub,level,shots,seed=0):
+    # floats go through repr so that the key changes with any bit of the parameter
+    inputs={'M':int(M),'V':repr(float(V)),'W':repr(float(W)),'nua':int(nua),'nub':int(nub),
+            'level':int(level),'shots':int(shots),'seed':int(seed),'code':code_version()}
+    return(hashlib.sha256(json.dumps(inputs,sort_keys=True).encode()).hexdigest())
+
+
+class ResultCache:
+    '''
+    Directory of <key>.npz entries. get() refreshes an entry's mtime, which is what eviction orders on.
+    '''
+    def __init__(self,cache_dir=DEFAULT_CACHE_DIR,max_bytes=2*1024**3):
+        self.cache_dir=cache_dir
+        self.max_bytes=max_bytes
+        os.makedirs(cache_dir,exist_ok=True)
+
+    def path(self,key):
+        return(os.path.join(self.cache_dir,f'{key}.npz'))
+
+    def get(self,key): # Returns the stored dict or None
+        path=self.path(key)
+        if not os.path.exists(path):
+            return(None)
+        try:
+            with np.load(path) as data:
+                out={name:data[name] for name in data.files}
+        except (OSError,ValueError): # A damaged entry is treated as a miss and dropped
+            os.remove(path)
+            return(None)
+        os.utime(path) # Mark as recently used
+        return(_unpack(out))
+
+    def put(self,key,result):
+        fd,tmp=tempfile.mkstemp(dir=self.cache_dir,suffix='.tmp')
+        with os.fdopen(fd,'wb') as fo:
+            np.savez_compressed(fo,**_pack(result))
+        os.replace(tmp,self.path(key))
+        self.evict()
+
+    def size(self):
+        return(sum(os.path.getsize(os.path.join(self.cache_dir,f)) for f in os.listdir(self.cache_dir) if f.endswith('.npz')))
+
+    def evict(self): # Drops least recently used entries until the directory fits in max_bytes
+        entries=[]
+        for f in os.listdir(self.cache_dir):
+            if f.endswith('.npz'):
+                st=os.stat(os.path.join(self.cache_dir,f))
+                entries.append((st.st_mtime,st.st_size,f))
+        entries.sort()
+        total=sum(e[1] for e in entries)
+        for mtime,size,f in entries:
+            if total<=self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir,f))
+            total-=size
+
+    def clear(self):
+        for f in os.listdir(self.cache_dir):
+            if f.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir,f))
+
+
+def _pack(result): # npz wants flat arrays, so the per-clique shots become clique0, clique1, ...
+    out={k:np.asarray(v) for k,v in result.items() if k!='clique_bits'}
+    for c,bits in enumerate(result['clique_bits']):
+        out[f'clique{c}']=np.packbits(bits,axis=1)
+    out['M']=np.asarray(result['clique_bits'][0].shape[1])
+    return(out)
+
+
+def _unpack(data):
+    M=int(data.pop('M'))
+    names=sorted((k for k in data if k.startswith('clique')),key=lambda k: int(k[6:]))
+    out={k:(v.item() if v.ndim==0 else v) for k,v in data.items() if not k.startswith('clique')}
+    out['clique_bits']=[np.unpackbits(data[k],axis=1,count=M) for k in names]
+    return(out)
+
+
+def cached_run(M,V,W,nua,nub,energy_level=0,shots=10**4,seed=0,cache=None):
+    '''
+    Full simulate-and-analyze run for one problem, served from the cache when the same inputs were run before.
+    Returns {'target','mean','std_error','clique_bits','distr','cached'}.
+    dwave.gate sampling cannot be seeded, so seed only distinguishes repeated samples of the same problem.
+    '''
+    if cache is None:
+        cache=ResultCache()
+    key=run_key(M,V,W,nua,nub,energy_level,shots,seed)
+    hit=cache.get(key)
+    if hit is not None:
+        hit['distr']=analyzer.distr_from_bits(V,W,nua,nub,hit['clique_bits'])
+        hit['cached']=True
+        return(hit)
+    res=pipeline.run_point(M,V,W,nua,nub,energy_level,shots)
+    result={'target':float(res['target']),'mean':res['mean'],'std_error':res['std_error'],'clique_bits':res['clique_bits']}
+    cache.put(key,result)
+    result['distr']=res['distr']
+    result['cached']=False
+    return(result)
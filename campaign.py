@@ -0,0 +1,218 @@
+# Checkpointed experiment campaigns. This replaces the print-and-forget loops in lmg_master (mult_test, step_mult_test,
+# error_perc_test, shots_scale_test) with a declarative sweep spec whose results are appended chunk by chunk to disk.
+# A killed campaign picks up exactly where it stopped: the trial list is regenerated deterministically from the spec
+# and the checkpoint records how many trials have already been written.
+import os
+import json
+import time
+import hashlib
+import itertools
+import numpy as np
+from pipeline import run_point
+from cache import cached_run
+
+PARAM_KEYS=('M','V','W','W_over_V','nua','nub','level','shots') # Drawn in this order so the seeds always mean the same thing
+INT_COLUMNS=('index','seed','M','nua','nub','level','shots')
+COLUMNS=('index','seed','M','V','W','nua','nub','level','shots','target','mean','std_error','rel_error','within_se','seconds')
+
+
+def draw(rule,rng,M=None): # Draws one value from a spec entry
+    # Scalars are fixed, ('uniform',lo,hi), ('randint',lo,hi) is inclusive like random.randint,
+    # ('signed_uniform',lo,hi) is uniform(lo,hi) with a random sign, ('choice',[...]) picks one.
+    # 'random' is only meaningful for level and means any level from 0 to M-1.
+    if isinstance(rule,str) and rule=='random':
+        return(int(rng.integers(0,M)))
+    if not isinstance(rule,tuple):
+        return(rule)
+    kind=rule[0]
+    if kind=='uniform':
+        return(float(rng.uniform(rule[1],rule[2])))
+    elif kind=='randint':
+        return(int(rng.integers(rule[1],rule[2]+1)))
+    elif kind=='signed_uniform':
+        return(float(rng.uniform(rule[1],rule[2])*(-1)**rng.integers(0,2)))
+    elif kind=='choice':
+        return(rule[1][int(rng.integers(0,len(rule[1])))])
+    raise ValueError(f'Unknown distribution {kind!r} in sweep spec')
+
+
+DISTRIBUTIONS=('uniform','randint','signed_uniform','choice')
+
+
+def spec_from_json(obj): # JSON has no tuples, so ["uniform",0.1,10] style lists are turned back into distributions
+    out={}
+    for k,v in obj.items():
+        if isinstance(v,list) and len(v)>0 and v[0] in DISTRIBUTIONS:
+            out[k]=tuple(v)
+        else:
+            out[k]=v
+    return(out)
+
+
+def expand_spec(spec):
+    '''
+    Turns a sweep spec into the full ordered list of trial parameter dicts.
+    spec keys: M, V, W (or W_over_V), nua, nub, level, shots as scalars, lists (grid axes) or distribution tuples,
+    plus 'trials' (random draws per grid point, default 1) and 'seed' (base seed, default 0).
+    Lists are crossed with each other; distributions are redrawn for every trial from a per-trial seed.
+    '''
+    grid_keys=[k for k in PARAM_KEYS if isinstance(spec.get(k),list)]
+    grid=list(itertools.product(*[spec[k] for k in grid_keys]))
+    trials=[]
+    base_seed=spec.get('seed',0)
+    for point in grid:
+        fixed=dict(zip(grid_keys,point))
+        for rep in range(spec.get('trials',1)):
+            index=len(trials)
+            seed=int(np.random.SeedSequence([base_seed,index]).generate_state(1)[0])
+            rng=np.random.default_rng(seed)
+            rules={k:fixed.get(k,spec.get(k)) for k in PARAM_KEYS}
+            M=draw(rules['M'],rng)
+            V=draw(rules['V'],rng)
+            if rules['W'] is not None:
+                W=draw(rules['W'],rng)
+            else:
+                W=V*draw(rules['W_over_V'] if rules['W_over_V'] is not None else 0.0,rng)
+            trials.append({'index':index,'seed':seed,'M':M,'V':V,'W':W,
+                           'nua':draw(rules['nua'] if rules['nua'] is not None else 0,rng),
+                           'nub':draw(rules['nub'] if rules['nub'] is not None else 0,rng),
+                           'level':draw(rules['level'] if rules['level'] is not None else 0,rng,M),
+                           'shots':draw(rules['shots'] if rules['shots'] is not None else 10**4,rng)})
+    return(trials)
+
+
+def spec_hash(spec): # Used to refuse resuming a directory with a different spec
+    return(hashlib.sha256(json.dumps(spec,sort_keys=True,default=str).encode()).hexdigest()[:16])
+
+
+def run_trial(trial,cache=None): # One full simulate-and-analyze run, kept in memory. Returns the result row as a dict.
+    # With a cache.ResultCache, trials that were already run with identical inputs are served from it.
+    start=time.time()
+    M,V,W,nua,nub=trial['M'],trial['V'],trial['W'],trial['nua'],trial['nub']
+    if cache is not None:
+        res=cached_run(M,V,W,nua,nub,trial['level'],trial['shots'],trial['seed'],cache)
+    else:
+        res=run_point(M,V,W,nua,nub,trial['level'],trial['shots'])
+    targ_val,mean,se=res['target'],res['mean'],res['std_error']
+    row=dict(trial)
+    row.update({'target':float(targ_val),'mean':float(mean),'std_error':float(se),'rel_error':float(abs(100*(mean-targ_val)/targ_val)),
+                'within_se':bool(abs(mean)-se<=abs(targ_val)<=abs(mean)+se),'seconds':time.time()-start})
+    return(row)
+
+
+def _atomic_write(path,write_fn): # Write to a temp name then rename so a kill never leaves half a file
+    tmp=path+'.tmp'
+    write_fn(tmp)
+    os.replace(tmp,path)
+
+
+def _dump_json(obj,path):
+    with open(path,'w') as fo:
+        json.dump(obj,fo,default=str)
+
+
+def _write_chunk(out_dir,start,rows,fmt):
+    cols={c:np.array([r[c] for r in rows]) for c in COLUMNS}
+    if fmt=='npz':
+        path=os.path.join(out_dir,f'chunk_{start:08d}.npz')
+        def write_fn(tmp):
+            with open(tmp,'wb') as fo:
+                np.savez(fo,**cols)
+    elif fmt=='csv':
+        path=os.path.join(out_dir,f'chunk_{start:08d}.csv')
+        def write_fn(tmp):
+            with open(tmp,'w') as fo:
+                fo.write(','.join(COLUMNS)+'\n')
+                for r in rows:
+                    fo.write(','.join(repr(r[c]) if isinstance(r[c],float) else str(r[c]) for c in COLUMNS)+'\n')
+    else:
+        raise ValueError(f'Unknown storage format {fmt!r}, use npz or csv')
+    _atomic_write(path,write_fn)
+
+
+def read_checkpoint(out_dir):
+    path=os.path.join(out_dir,'checkpoint.json')
+    if not os.path.exists(path):
+        return(None)
+    with open(path,'r') as fo:
+        return(json.load(fo))
+
+
+def run_campaign(spec,out_dir,batch_size=10,fmt='npz',verbose=True,cache=None):
+    '''
+    Runs every trial of spec that is not yet recorded in out_dir, batch_size trials per chunk.
+    After each chunk the checkpoint is updated, so rerunning the same call after an interruption resumes
+    from the first unfinished batch. Pass a cache.ResultCache to reuse runs shared with earlier campaigns.
+    Returns the number of trials completed in this call.
+    '''
+    os.makedirs(out_dir,exist_ok=True)
+    trials=expand_spec(spec)
+    chk=read_checkpoint(out_dir)
+    if chk is None:
+        chk={'spec':spec,'spec_hash':spec_hash(spec),'format':fmt,'completed':0,'total':len(trials)}
+    elif chk['spec_hash']!=spec_hash(spec):
+        raise ValueError(f'{out_dir} holds a campaign with a different spec. Use a new directory.')
+    fmt=chk['format']
+    done_before=chk['completed']
+    for start in range(done_before,len(trials),batch_size):
+        rows=[run_trial(trial,cache) for trial in trials[start:start+batch_size]]
+        _write_chunk(out_dir,start,rows,fmt)
+        chk['completed']=start+len(rows)
+        _atomic_write(os.path.join(out_dir,'checkpoint.json'),lambda tmp: _dump_json(chk,tmp))
+        if verbose:
+            print(f'Finished {chk["completed"]} of {len(trials)} trials.')
+    return(chk['completed']-done_before)
+
+
+def load_campaign(out_dir): # Concatenates every finished chunk into one dict of column arrays
+    chk=read_checkpoint(out_dir)
+    if chk is None:
+        raise FileNotFoundError(f'No campaign checkpoint in {out_dir}')
+    names=sorted(f for f in os.listdir(out_dir) if f.startswith('chunk_') and f.endswith('.'+chk['format']))
+    parts={c:[] for c in COLUMNS}
+    for name in names:
+        if int(name[6:14])>=chk['completed']: # Written but never checkpointed. It will be redone on resume.
+            continue
+        path=os.path.join(out_dir,name)
+        if chk['format']=='npz':
+            with np.load(path) as data:
+                for c in COLUMNS:
+                    parts[c].append(data[c])
+        else:
+            with open(path,'r') as fo:
+                fo.readline()
+                rows=[line.rstrip('\n').split(',') for line in fo]
+            for i,c in enumerate(COLUMNS):
+                if c=='within_se':
+                    parts[c].append(np.array([r[i]=='True' for r in rows]))
+                elif c in INT_COLUMNS:
+                    parts[c].append(np.array([r[i] for r in rows],dtype=np.int64))
+                else:
+                    parts[c].append(np.array([r[i] for r in rows],dtype=float))
+    return({c:(np.concatenate(parts[c]) if parts[c] else np.array([])) for c in COLUMNS})
+
+
+def success_summary(results,by='M'): # Percentage within one standard error, grouped like step_mult_test prints it
+    out={}
+    for key in np.unique(results[by]):
+        sel=results[by]==key
+        out[key.item()]=100*np.mean(results['within_se'][sel])
+    return(out)
+
+
+# Specs equivalent to the lmg_master loops
+def mult_test_spec(num_tests,seed=0):
+    return({'M':('randint',1,10),'V':('signed_uniform',0.1,10),'W_over_V':('signed_uniform',0,1),
+            'nua':('randint',0,1),'nub':('randint',0,1),'level':'random','shots':10**4,'trials':num_tests,'seed':seed})
+
+def step_mult_test_spec(num_tests,seed=0):
+    return({'M':list(range(1,11)),'V':('uniform',0.1,10),'W_over_V':('signed_uniform',0,1),
+            'nua':('randint',0,1),'nub':('randint',0,1),'level':0,'shots':10**4,'trials':num_tests,'seed':seed})
+
+def error_perc_test_spec(num_tests,seed=0):
+    return({'M':('randint',1,5),'V':('uniform',0.1,10),'W_over_V':('signed_uniform',0,1),
+            'nua':('randint',0,1),'nub':('randint',0,1),'level':0,'shots':10**4,'trials':num_tests,'seed':seed})
+
+def shots_scale_test_spec(num_tests,seed=0):
+    return({'M':('randint',1,5),'V':('uniform',0.1,10),'W_over_V':('signed_uniform',0,1),
+            'nua':('randint',0,1),'nub':('randint',0,1),'level':0,'shots':[10,10**2,10**3,10**4],'trials':num_tests,'seed':seed})
@@ -0,0 +1,220 @@
+# Picks how to execute a run from estimated memory and time.
+# A dense 2^M statevector stops fitting in memory somewhere around M=30, and total_circuit_runner would try anyway.
+# Four execution paths exist:
+#   'dense'     NumpyBackend statevector, per-shot bits. Memory and time grow as 2^M.
+#   'mps'       MpsBackend matrix product state, per-shot bits. Linear in M, but slower per shot than dense sampling.
+#   'counts'    dense statevector, but only outcome counts are drawn (one multinomial per clique), so the cost does not
+#               grow with shots. Gives a sampled <H> +/- SE without per-shot data.
+#   'analytic'  exact <H> and the single-shot spread from the MPS by a transfer-matrix pass, O(M). Nothing is sampled:
+#               std_error is the one a run with that many shots would have.
+# plan_run estimates every path, drops those that exceed the memory budget or cannot give the requested output
+# ('shots' for per-shot data, 'estimate' for a sampled <H> +/- SE, 'exact') and picks the fastest. The reason is
+# logged (logger 'dispatch') and emitted as an instrument record.
+#
+# res=run(40,3.0,1.2,0,1,shots=10**5,output='estimate')
+# print(res['path'],res['reason'])
+import os
+import logging
+import numpy as np
+from analyzer import num_cliques, clique_weights, oeater_array
+import instrument
+
+log=logging.getLogger('dispatch')
+
+MEMORY_BUDGET=None # Bytes. None uses half of the physical memory.
+PROVIDES={'dense':('shots','estimate'),'mps':('shots','estimate'),'counts':('estimate',),'analytic':('exact',)}
+OUTPUT_NAMES={'shots':'per-shot data','estimate':'a sampled <H> +/- SE','exact':'the exact <H>'}
+
+# Rough seconds per unit of work, measured with numpy on one core. Only their ratios matter for the choice.
+COSTS={'gate':3.5e-9, # One gate on one dense amplitude
+       'outcome':6e-8, # Probabilities, multinomial and shuffle per dense amplitude
+       'bit':5e-9, # Turning one sampled index into one bit
+       'mps_bit':1.2e-7, # Sampling one qubit of one shot from the MPS
+       'site':5e-5, # Building / contracting one MPS site
+       'call':1e-4} # Fixed overhead per clique
+
+
+def default_memory_budget(): # Half of the physical memory, or 4 GiB where that cannot be read
+    if MEMORY_BUDGET is not None:
+        return(MEMORY_BUDGET)
+    try:
+        return(os.sysconf('SC_PHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')//2)
+    except (ValueError,OSError,AttributeError):
+        return(4<<30)
+
+
+def estimate_costs(M,shots):
+    # {path: {'bytes','seconds'}} for one run of all the cliques M needs. Per-shot paths keep every clique's bits.
+    nc=num_cliques(M)
+    N=2.0**M
+    per_shot=shots*(M*nc+24) # Bits of every clique, one index array and the scored energies
+    dense_state=N*(2*8+24) # Real float64 state and work buffers plus probabilities, counts and outcome indices
+    out={}
+    out['dense']={'bytes':dense_state+per_shot+(N*M if N<=shots else 0),
+                  'seconds':nc*(COSTS['call']+N*(M*COSTS['gate']+COSTS['outcome'])+shots*M*COSTS['bit'])}
+    out['mps']={'bytes':per_shot+shots*8*12+M*nc*256,
+                'seconds':nc*(COSTS['call']+M*COSTS['site']+shots*M*COSTS['mps_bit'])}
+    out['counts']={'bytes':dense_state+min(N,shots)*(M+16),
+                   'seconds':nc*(COSTS['call']+N*(M*COSTS['gate']+COSTS['outcome'])+min(N,shots)*M*COSTS['bit'])}
+    out['analytic']={'bytes':M*nc*512,'seconds':nc*(COSTS['call']+2*M*COSTS['site'])}
+    return(out)
+
+
+def _fmt_bytes(n):
+    for unit in ('B','KiB','MiB','GiB','TiB','PiB'):
+        if n<1024 or unit=='PiB':
+            return(f'{n:.3g} {unit}')
+        n/=1024
+    return(f'{n:.3g} EiB')
+
+
+def plan_run(M,shots,output='estimate',memory_budget=None,path=None):
+    '''
+    Chooses the execution path for M qubits and shots shots per clique. output is 'shots', 'estimate' or 'exact'.
+    path forces a path (it is still checked against output). Returns {'path','reason','budget','costs'} where costs
+    holds every path's estimate with 'fits' and 'provides' flags. Raises MemoryError when no suitable path fits.
+    '''
+    if output not in OUTPUT_NAMES:
+        raise ValueError(f'Unknown output {output!r}, use shots, estimate or exact')
+    budget=default_memory_budget() if memory_budget is None else memory_budget
+    costs=estimate_costs(M,shots)
+    for name,c in costs.items():
+        c['fits']=c['bytes']<=budget
+        c['provides']=output in PROVIDES[name]
+    if path is not None:
+        if not costs[path]['provides']:
+            raise ValueError(f'Path {path!r} does not give {OUTPUT_NAMES[output]}')
+        chosen=path
+        why=f'{path}: requested explicitly'
+    else:
+        ok=sorted((c['seconds'],name) for name,c in costs.items() if c['fits'] and c['provides'])
+        if not ok:
+            raise MemoryError(f'No path gives {OUTPUT_NAMES[output]} for M={M} and {shots} shots within '
+                              f'{_fmt_bytes(budget)}: '+', '.join(f'{name} needs {_fmt_bytes(c["bytes"])}'
+                                                                  for name,c in costs.items() if c['provides']))
+        chosen=ok[0][1]
+        why=f'{chosen}: fastest path giving {OUTPUT_NAMES[output]} within {_fmt_bytes(budget)}'
+    c=costs[chosen]
+    others=[]
+    for name,o in costs.items():
+        if name==chosen:
+            continue
+        if not o['provides']:
+            others.append(f'{name} does not give {OUTPUT_NAMES[output]}')
+        elif not o['fits']:
+            others.append(f'{name} needs {_fmt_bytes(o["bytes"])}')
+        else:
+            others.append(f'{name} est. {o["seconds"]:.3g} s')
+    reason=f'{why} (est. {c["seconds"]:.3g} s, {_fmt_bytes(c["bytes"])}); '+'; '.join(others)
+    log.info('M=%d, %d shots: %s',M,shots,reason)
+    instrument.emit({'stage':'dispatch','path':chosen,'reason':reason,'M':M,'shots':shots,'output':output,
+                     'estimated_seconds':c['seconds'],'estimated_bytes':c['bytes']})
+    return({'path':chosen,'reason':reason,'budget':budget,'costs':costs})
+
+
+def path_backend(path,seed=None): # The backends.py backend a per-shot path samples with
+    from backends import NumpyBackend, MpsBackend
+    if path=='dense':
+        return(NumpyBackend(dtype=np.float64,seed=seed)) # Every gate is real, so float64 is exact and half the memory
+    if path=='mps':
+        return(MpsBackend(seed=seed))
+    raise ValueError(f'Path {path!r} does not sample per-shot bits')
+
+
+def choose_backend(M,shots,memory_budget=None): # Backend for total_circuit_runner(..., backend='auto')
+    return(path_backend(plan_run(M,shots,'shots',memory_budget)['path']))
+
+
+def mps_moments(sites,weights):
+    # Exact mean and variance of one clique's energy (weights from clique_weights) under the MPS's outcome
+    # distribution. Sweeping left to right, F[b][k] sums |amplitude|^2 * (energy of the qubits so far)^k over every
+    # prefix ending in bit b, kept as (bond, bond) matrices, so the 2^M outcomes are never listed.
+    const,lin,pair=weights
+    F=[[np.ones((1,1)),np.zeros((1,1)),np.zeros((1,1))],None]
+    for j,A in enumerate(sites):
+        new=[None,None]
+        for b in (0,1):
+            spin=1-2*b
+            acc=[0.0,0.0,0.0]
+            for prev in (0,1):
+                if F[prev] is None:
+                    continue
+                f0,f1,f2=F[prev]
+                d=lin[j]*spin+(pair[j-1]*spin*(1-2*prev) if j>0 else 0.0)
+                acc[0]=acc[0]+f0
+                acc[1]=acc[1]+f1+d*f0
+                acc[2]=acc[2]+f2+2*d*f1+d*d*f0
+            Ab=A[:,b,:]
+            new[b]=[Ab.T@x@Ab for x in acc]
+        F=new
+    z=[F[0][k][0,0]+F[1][k][0,0] for k in range(3)]
+    mean=z[1]/z[0]
+    return((const+mean,max(z[2]/z[0]-mean**2,0.0)))
+
+
+def analytic_estimate(V,W,nua,nub,angles,shots): # Exact <H>, single-shot sigma and the SE of a shots-shot run
+    from backends import MpsBackend
+    M=len(angles)
+    weights=clique_weights(M,V,W,nua,nub)
+    mps=MpsBackend()
+    mean=0.0
+    var=0.0
+    for c in range(num_cliques(M)):
+        m,v=mps_moments(mps.clique_mps(angles,c+1),weights[c])
+        mean+=m
+        var+=v # The cliques are sampled independently, so variances add
+    return({'mean':mean,'sigma':float(np.sqrt(var)),'std_error':float(np.sqrt(var/shots))})
+
+
+def counts_estimate(V,W,nua,nub,angles,shots,seed=None):
+    # Sampled <H> +/- SE from per-clique outcome counts. Shot j of every clique is added up in the per-shot pipeline;
+    # since the cliques are independent the single-shot variance is the sum of the per-clique sample variances.
+    from backends import NumpyBackend, index_bits
+    M=len(angles)
+    weights=clique_weights(M,V,W,nua,nub)
+    backend=NumpyBackend(dtype=np.float64,seed=seed)
+    mean=0.0
+    var=0.0
+    clique_counts=[]
+    for c in range(num_cliques(M)):
+        probs=backend.clique_state(angles,c+1).reshape(-1)**2
+        counts=backend.rng.multinomial(shots,probs/probs.sum())
+        nz=np.flatnonzero(counts)
+        energies=oeater_array(weights[c],index_bits(nz,M))
+        m=float(counts[nz]@energies)/shots
+        mean+=m
+        var+=float(counts[nz]@(energies-m)**2)/shots
+        clique_counts.append((nz,counts[nz]))
+    return({'mean':mean,'sigma':float(np.sqrt(var)),'std_error':float(np.sqrt(var/shots)),'clique_counts':clique_counts})
+
+
+def run(M,V,W,nua,nub,energy_level=0,shots=10**4,output='estimate',memory_budget=None,path=None,seed=None,
+        out_file_name=None):
+    '''
+    run_point with the execution path chosen by plan_run. Writing a shot file (out_file_name) needs output='shots'.
+    Returns {'target','state','angles','mean','std_error','path','reason','plan'} plus, by path,
+    'clique_bits','distr','file' (dense, mps), 'sigma','clique_counts' (counts) or 'sigma' (analytic).
+    '''
+    from state_generator import state_finder_fock, angle_finder
+    if out_file_name is not None:
+        output='shots'
+    plan=plan_run(M,shots,output,memory_budget,path)
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,energy_level)
+    angs=angle_finder(targ_state)
+    out={'target':targ_val,'state':targ_state,'angles':angs,'path':plan['path'],'reason':plan['reason'],'plan':plan}
+    with instrument.measure('dispatch.'+plan['path'],shots=shots):
+        if plan['path'] in ('dense','mps'):
+            from pipeline import sample_cliques
+            from analyzer import distr_from_bits
+            if out_file_name is True:
+                from pipeline import unique_shot_name
+                out_file_name=unique_shot_name()
+            clique_bits=sample_cliques(angs,shots,out_file_name,path_backend(plan['path'],seed))
+            distr=distr_from_bits(V,W,nua,nub,clique_bits)
+            out.update({'clique_bits':clique_bits,'distr':distr,'mean':float(np.mean(distr)),
+                        'std_error':float(np.std(distr)/np.sqrt(shots)),'file':out_file_name})
+        elif plan['path']=='counts':
+            out.update(counts_estimate(V,W,nua,nub,angs,shots,seed))
+        else:
+            out.update(analytic_estimate(V,W,nua,nub,angs,shots))
+    return(out)
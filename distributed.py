@@ -0,0 +1,186 @@
+# Coordinator / worker mode for campaigns that do not fit on one machine.
+# The work queue is a directory (local or on a shared filesystem) so no external service is needed:
+#   pending/<index>.json              trial specs waiting for a worker (from campaign.expand_spec)
+#   running/<index>.<worker>.json     claimed trials; claiming is an atomic rename, so exactly one worker wins
+#   results/<index>.json              compact result rows (campaign.run_trial), written atomically
+#   workers/<worker>.hb               heartbeat files whose mtime a worker thread refreshes every few seconds
+#   queue.json                        total trial count and spec hash; 'closed' once the coordinator is done
+# The coordinator requeues the trials of any worker whose heartbeat is older than dead_after seconds, and writes the
+# collected rows out in the same chunk/checkpoint layout as run_campaign, so load_campaign reads them.
+#
+# On the coordinator:  run_coordinator(spec,'/shared/queue','results/')
+# On each worker node: run_worker('/shared/queue')
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from campaign import expand_spec, spec_hash, run_trial, _atomic_write, _dump_json, _write_chunk
+
+QUEUE_DIRS=('pending','running','results','workers')
+
+
+def _read_json(path):
+    with open(path,'r') as fo:
+        return(json.load(fo))
+
+
+def _entries(queue_dir,d): # Finished entries of a queue directory (skips half-written .tmp files)
+    return(sorted(name for name in os.listdir(os.path.join(queue_dir,d)) if not name.endswith('.tmp')))
+
+
+def read_queue(queue_dir): # The queue.json record, or None if nothing was published there
+    path=os.path.join(queue_dir,'queue.json')
+    return(_read_json(path) if os.path.exists(path) else None)
+
+
+def _running_parts(name): # running/<index>.<worker>.json -> (index, worker); the worker name may contain dots
+    index,rest=name.split('.',1)
+    return(index,rest.rsplit('.',1)[0])
+
+
+def publish(spec,queue_dir): # Puts every trial of spec without a result yet on the queue. Returns the trial count.
+    trials=expand_spec(spec)
+    for d in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir,d),exist_ok=True)
+    info=read_queue(queue_dir)
+    if info is not None and info['spec_hash']!=spec_hash(spec):
+        raise ValueError(f'{queue_dir} holds a queue for a different spec. Use a new directory.')
+    done=set(_entries(queue_dir,'results'))
+    claimed={_running_parts(name)[0]+'.json' for name in _entries(queue_dir,'running')}
+    for trial in trials:
+        name=f'{trial["index"]:08d}.json'
+        if name not in done and name not in claimed:
+            _atomic_write(os.path.join(queue_dir,'pending',name),lambda tmp: _dump_json(trial,tmp))
+    _atomic_write(os.path.join(queue_dir,'queue.json'),
+                  lambda tmp: _dump_json({'spec':spec,'spec_hash':spec_hash(spec),'total':len(trials),'closed':False},tmp))
+    return(len(trials))
+
+
+def requeue_dead(queue_dir,dead_after=30.0): # Moves trials of workers with stale heartbeats back to pending
+    now=time.time()
+    moved=0
+    for name in _entries(queue_dir,'running'):
+        index,worker=_running_parts(name)
+        hb=os.path.join(queue_dir,'workers',worker+'.hb')
+        try:
+            alive=now-os.path.getmtime(hb)<dead_after
+        except FileNotFoundError:
+            alive=False
+        if alive:
+            continue
+        if os.path.exists(os.path.join(queue_dir,'results',index+'.json')): # Finished just before it died
+            try:
+                os.remove(os.path.join(queue_dir,'running',name))
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            os.rename(os.path.join(queue_dir,'running',name),os.path.join(queue_dir,'pending',index+'.json'))
+            moved+=1
+        except FileNotFoundError: # The worker finished it after all
+            pass
+    return(moved)
+
+
+def queue_status(queue_dir):
+    return({d:len(_entries(queue_dir,d)) for d in QUEUE_DIRS})
+
+
+def run_coordinator(spec,queue_dir,out_dir,fmt='npz',poll=1.0,dead_after=30.0,verbose=True):
+    '''
+    Publishes spec's trials to queue_dir, requeues the work of dead workers until every trial has a result, then
+    writes all rows to out_dir in run_campaign's layout (readable with campaign.load_campaign) and closes the queue
+    so idle workers exit. Returns the number of trials.
+    '''
+    total=publish(spec,queue_dir)
+    last=-1
+    while True:
+        requeued=requeue_dead(queue_dir,dead_after)
+        status=queue_status(queue_dir)
+        if verbose and (status['results']!=last or requeued):
+            print(f'{status["results"]} of {total} trials done, {status["running"]} running, {status["pending"]} pending'
+                  +(f', requeued {requeued}' if requeued else ''))
+            last=status['results']
+        if status['results']>=total:
+            break
+        time.sleep(poll)
+    results_dir=os.path.join(queue_dir,'results')
+    rows=[_read_json(os.path.join(results_dir,name)) for name in _entries(queue_dir,'results')]
+    os.makedirs(out_dir,exist_ok=True)
+    _write_chunk(out_dir,0,rows,fmt)
+    chk={'spec':spec,'spec_hash':spec_hash(spec),'format':fmt,'completed':len(rows),'total':total}
+    _atomic_write(os.path.join(out_dir,'checkpoint.json'),lambda tmp: _dump_json(chk,tmp))
+    info=read_queue(queue_dir)
+    info['closed']=True
+    _atomic_write(os.path.join(queue_dir,'queue.json'),lambda tmp: _dump_json(info,tmp))
+    return(total)
+
+
+class Heartbeat: # Background thread refreshing a worker's heartbeat file
+    def __init__(self,path,interval=5.0):
+        self.path=path
+        self.interval=interval
+        self.stopped=threading.Event()
+        self.beat()
+        self.thread=threading.Thread(target=self._loop,daemon=True)
+        self.thread.start()
+
+    def beat(self):
+        with open(self.path,'a'):
+            os.utime(self.path,None)
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def claim(queue_dir,worker): # Atomically takes one pending trial. Returns (trial, running path) or (None, None).
+    pending=os.path.join(queue_dir,'pending')
+    for name in _entries(queue_dir,'pending'):
+        running=os.path.join(queue_dir,'running',f'{name[:-5]}.{worker}.json')
+        try:
+            os.rename(os.path.join(pending,name),running)
+        except FileNotFoundError: # Another worker got there first
+            continue
+        return((_read_json(running),running))
+    return((None,None))
+
+
+def run_worker(queue_dir,worker=None,heartbeat=5.0,poll=1.0,max_trials=None,cache=None,verbose=True):
+    '''
+    Takes trials from queue_dir and runs them (campaign.run_trial) until the coordinator closes the queue, or after
+    max_trials trials. Pass a cache.ResultCache to reuse earlier runs. Returns the number of trials this worker ran.
+    '''
+    worker=worker or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}'.replace('.','-')
+    while read_queue(queue_dir) is None:
+        time.sleep(poll)
+    hb=Heartbeat(os.path.join(queue_dir,'workers',worker+'.hb'),heartbeat)
+    done=0
+    try:
+        while max_trials is None or done<max_trials:
+            trial,running=claim(queue_dir,worker)
+            if trial is None:
+                if read_queue(queue_dir)['closed']:
+                    break
+                time.sleep(poll)
+                continue
+            row=run_trial(trial,cache)
+            _atomic_write(os.path.join(queue_dir,'results',f'{trial["index"]:08d}.json'),lambda tmp: _dump_json(row,tmp))
+            try:
+                os.remove(running)
+            except FileNotFoundError: # Requeued while we were running it; the result is written anyway
+                pass
+            done+=1
+            if verbose:
+                print(f'{worker}: trial {trial["index"]} done ({row["seconds"]:.1f}s)')
+    finally:
+        hb.stop()
+    return(done)
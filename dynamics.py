@@ -0,0 +1,150 @@
+# Quench dynamics in the Fock basis.
+# A quench prepares an eigenstate of one LMG Hamiltonian and evolves it under another (hbar=1). The post-quench
+# Hamiltonian is diagonalized once (it is tridiagonal, so scipy's eigh_tridiagonal is used when scipy is installed),
+# after which psi(t) for any number of times is one vectorized phase multiplication in the eigenbasis.
+# Above eigen_max_dim the eigendecomposition is skipped and the state is stepped through the times with a Lanczos
+# (Krylov) propagator that only needs tridiagonal matrix-vector products.
+# The state_prep ansatz has real amplitudes, so an evolved state is circuit-ready only when it is real up to a global
+# phase; ansatz_angles returns its angles in that case.
+#
+# res=quench(20,(3.0,1.2,0,1),(1.0,1.2,0,1),np.linspace(0,10,5000),observables=('H0','survival'))
+import numpy as np
+from state_generator import ham_diagonals, state_finder_fock, angle_finder
+
+EIGEN_MAX_DIM=4000 # Largest Fock dimension handled by a full eigendecomposition in method='auto'
+
+
+def tridiag_matvec(diag,off,x): # H x for the tridiagonal H, x of shape (dim,) or (dim, k)
+    y=diag.reshape((-1,)+(1,)*(x.ndim-1))*x
+    off=off.reshape((-1,)+(1,)*(x.ndim-1))
+    y[:-1]+=off*x[1:]
+    y[1:]+=off*x[:-1]
+    return(y)
+
+
+def tridiag_eigh(diag,off): # Eigenvalues and eigenvectors (columns) of the symmetric tridiagonal matrix
+    try:
+        from scipy.linalg import eigh_tridiagonal
+    except ImportError:
+        return(np.linalg.eigh(np.diag(diag)+np.diag(off,-1)+np.diag(off,1)))
+    if len(diag)==1:
+        return(diag.copy(),np.ones((1,1)))
+    return(eigh_tridiagonal(diag,off))
+
+
+def evolve_eigen(psi0,times,evals,evecs): # psi(t) for every t as a (times, dim) array
+    coeffs=evecs.T@psi0
+    return((np.exp(-1j*np.outer(times,evals))*coeffs)@evecs.T)
+
+
+def krylov_step(diag,off,psi,dt,dim=30,tol=1e-10):
+    # exp(-i H dt) psi by Lanczos. Splits dt in half until the a-posteriori error estimate is below tol.
+    norm=np.linalg.norm(psi)
+    V=np.zeros((dim,len(psi)),dtype=complex)
+    alpha=np.zeros(dim)
+    beta=np.zeros(dim)
+    V[0]=psi/norm
+    k=dim
+    for j in range(dim):
+        w=tridiag_matvec(diag,off,V[j])
+        alpha[j]=np.real(np.vdot(V[j],w))
+        w-=alpha[j]*V[j]
+        if j>0:
+            w-=beta[j-1]*V[j-1]
+        w-=V[:j+1].T@(V[:j+1].conj()@w) # Full reorthogonalization, cheap at this size
+        beta[j]=np.linalg.norm(w)
+        if beta[j]<1e-14 or j==dim-1:
+            k=j+1
+            break
+        V[j+1]=w/beta[j]
+    evals,evecs=np.linalg.eigh(np.diag(alpha[:k])+np.diag(beta[:k-1],-1)+np.diag(beta[:k-1],1))
+    small=evecs@(np.exp(-1j*evals*dt)*evecs[0])
+    if k==dim and beta[k-1]*abs(small[-1])>tol and dt>1e-12:
+        half=krylov_step(diag,off,psi,dt/2,dim,tol)
+        return(krylov_step(diag,off,half,dt/2,dim,tol))
+    return(norm*(small@V[:k]))
+
+
+def evolve_krylov(diag,off,psi0,times,dim=30,tol=1e-10): # psi(t) for sorted times, stepping from one to the next
+    out=np.empty((len(times),len(psi0)),dtype=complex)
+    psi=np.asarray(psi0,dtype=complex)
+    t=0.0
+    for i,ti in enumerate(times):
+        if ti!=t:
+            psi=krylov_step(diag,off,psi,ti-t,dim,tol)
+            t=ti
+        out[i]=psi
+    return(out)
+
+
+def evolve(psi0,times,diag,off,method='auto',krylov_dim=30,tol=1e-10):
+    '''
+    Evolves the Fock-basis state psi0 under the tridiagonal Hamiltonian (diag, off) to every time in times.
+    method 'eigen' diagonalizes once, 'krylov' steps through the (sorted) times, 'auto' picks by dimension.
+    Returns a (times, dim) complex array.
+    '''
+    times=np.asarray(times,dtype=float)
+    if method=='auto':
+        method='eigen' if len(diag)<=EIGEN_MAX_DIM else 'krylov'
+    if method=='eigen':
+        evals,evecs=tridiag_eigh(diag,off)
+        return(evolve_eigen(np.asarray(psi0,dtype=complex),times,evals,evecs))
+    if method=='krylov':
+        if np.any(np.diff(times)<0):
+            raise ValueError('Krylov propagation needs sorted times')
+        return(evolve_krylov(diag,off,psi0,times,krylov_dim,tol))
+    raise ValueError(f'Unknown method {method!r}, use auto, eigen or krylov')
+
+
+def expectation_series(psi_t,observable): # <O>(t); observable is a (dim,) diagonal, a (dim, dim) matrix or (diag, off)
+    if isinstance(observable,tuple):
+        return(np.real(np.sum(np.conj(psi_t)*tridiag_matvec(observable[0],observable[1],psi_t.T).T,axis=1)))
+    observable=np.asarray(observable)
+    if observable.ndim==1:
+        return(np.abs(psi_t)**2@observable)
+    return(np.real(np.einsum('ti,ij,tj->t',np.conj(psi_t),observable,psi_t)))
+
+
+def quench(M,before,after,times,energy_level=0,observables=('H','H0','survival'),method='auto'):
+    '''
+    Prepares the energy_levelth eigenstate of the LMG Hamiltonian with parameters before=(V, W, nua, nub) and evolves
+    it under after=(V, W, nua, nub). observables may contain 'H' (post-quench energy, constant), 'H0' (pre-quench
+    Hamiltonian), 'survival' (|<psi0|psi(t)>|^2), 'fock' (populations, (times, M+1)) or a name -> observable dict
+    entry as accepted by expectation_series. Returns {'times','psi0','states', plus one entry per observable}.
+    '''
+    targ_val,psi0=state_finder_fock(M,*before,energy_level)
+    diag,off=ham_diagonals(M,*after)
+    states=evolve(psi0,times,diag,off,method)
+    named={'H':(diag,off),'H0':ham_diagonals(M,*before)}
+    out={'times':np.asarray(times,dtype=float),'psi0':psi0,'states':states}
+    if isinstance(observables,dict):
+        items=observables.items()
+    else:
+        items=[(name,None) for name in observables]
+    for name,obs in items:
+        if obs is not None:
+            out[name]=expectation_series(states,obs)
+        elif name=='survival':
+            out[name]=np.abs(states@np.conj(psi0))**2
+        elif name=='fock':
+            out[name]=np.abs(states)**2
+        else:
+            out[name]=expectation_series(states,named[name])
+    return(out)
+
+
+def ansatz_angles(psi,tol=1e-8):
+    # state_prep angles for a Fock-basis state (state_finder_fock order), or None if the state is not real up to a
+    # global phase and so cannot be prepared by the RY/CRY ansatz.
+    psi=np.asarray(psi,dtype=complex)
+    k=np.argmax(np.abs(psi))
+    real=psi*np.exp(-1j*np.angle(psi[k]))
+    if np.max(np.abs(real.imag))>tol:
+        return(None)
+    return(angle_finder(real.real/np.linalg.norm(real.real)))
+
+
+def representable_times(states,tol=1e-8): # Boolean mask of the evolved states the ansatz can prepare
+    k=np.argmax(np.abs(states),axis=1)
+    phase=np.exp(-1j*np.angle(states[np.arange(len(states)),k]))
+    return(np.max(np.abs((states*phase[:,None]).imag),axis=1)<=tol)
@@ -0,0 +1,110 @@
+# Exact single-shot energy distribution.
+# distr_from_bits adds up shot j of every clique, and the cliques are sampled independently, so a single-shot energy is
+# a sum of independent per-clique energies and its distribution is the convolution of the per-clique distributions.
+# Each clique's distribution comes either from outcome counts (measured shots) or from exact outcome probabilities
+# (the simulated statevector), is binned on a common grid, and the binned cliques are convolved with one FFT.
+# No per-shot list is built, so the histogram is as smooth as the bin width allows for any number of virtual shots.
+#
+# centers,probs=energy_distribution(3.0,1.2,0,1,angles=angle_finder(targ_state))
+# plot_energy_distribution(centers,probs,targ_val)
+import numpy as np
+from analyzer import num_cliques, clique_weights, oeater_array
+
+
+def outcome_energies(weights,M): # Energy of every one of the 2^M outcomes of one clique, in statevector index order
+    from backends import index_bits
+    return(oeater_array(weights,index_bits(np.arange(1<<M),M)))
+
+
+def clique_spectra_exact(V,W,nua,nub,angles,backend=None):
+    # [(energies, probabilities)] per clique from the statevector of state_prep(angles) (dense, so moderate M only)
+    from backends import NumpyBackend
+    backend=NumpyBackend() if backend is None else backend
+    M=len(angles)
+    weights=clique_weights(M,V,W,nua,nub)
+    out=[]
+    for c in range(num_cliques(M)):
+        probs=np.abs(backend.clique_state(angles,c+1).reshape(-1))**2
+        keep=probs>0
+        out.append((outcome_energies(weights[c],M)[keep],probs[keep]/probs.sum()))
+    return(out)
+
+
+def clique_spectra_counts(V,W,nua,nub,clique_bits):
+    # [(energies, frequencies)] per clique from measured (shots, M) bit arrays; each distinct outcome is scored once
+    M=clique_bits[0].shape[1]
+    weights=clique_weights(M,V,W,nua,nub)
+    out=[]
+    for c in range(num_cliques(M)):
+        rows,counts=np.unique(clique_bits[c],axis=0,return_counts=True)
+        out.append((oeater_array(weights[c],rows),counts/counts.sum()))
+    return(out)
+
+
+def bin_spectrum(energies,probs,lo,width,num_bins):
+    # Each outcome is split linearly between its two nearest grid points, which keeps the mean exact
+    pos=(np.asarray(energies)-lo)/width
+    left=np.floor(pos).astype(np.int64)
+    frac=pos-left
+    hist=np.bincount(left,probs*(1-frac),minlength=num_bins+1)
+    hist+=np.bincount(left+1,probs*frac,minlength=num_bins+1)
+    return(hist[:num_bins])
+
+
+def convolve_spectra(spectra,bin_width=None,num_bins=4096):
+    '''
+    Distribution of the sum of independent clique energies. spectra is a list of (energies, probabilities).
+    bin_width defaults to the full energy range over num_bins. Returns (centers, probs) with probs summing to 1.
+    '''
+    lows=[float(np.min(e)) for e,p in spectra]
+    highs=[float(np.max(e)) for e,p in spectra]
+    if bin_width is None:
+        bin_width=max(sum(highs)-sum(lows),1e-12)/num_bins
+    start=0.0
+    size=1
+    hists=[]
+    for (e,p),lo,hi in zip(spectra,lows,highs):
+        lo=np.floor(lo/bin_width)*bin_width
+        n=int(np.ceil((hi-lo)/bin_width))+2
+        hists.append(bin_spectrum(e,p,lo,bin_width,n))
+        start+=lo
+        size+=n-1
+    nfft=1<<int(np.ceil(np.log2(size)))
+    total=np.ones(nfft//2+1,dtype=complex)
+    for h in hists:
+        total*=np.fft.rfft(h,nfft)
+    probs=np.fft.irfft(total,nfft)[:size]
+    np.clip(probs,0,None,out=probs) # FFT round-off leaves tiny negative values
+    probs/=probs.sum()
+    return((start+bin_width*np.arange(size),probs))
+
+
+def energy_distribution(V,W,nua,nub,angles=None,clique_bits=None,bin_width=None,num_bins=4096,backend=None):
+    # Exact (angles given) or empirical (clique_bits given) single-shot energy distribution as (centers, probs)
+    if angles is not None:
+        spectra=clique_spectra_exact(V,W,nua,nub,angles,backend)
+    elif clique_bits is not None:
+        spectra=clique_spectra_counts(V,W,nua,nub,clique_bits)
+    else:
+        raise ValueError('Give either angles or clique_bits')
+    return(convolve_spectra(spectra,bin_width,num_bins))
+
+
+def distribution_moments(centers,probs): # Mean and standard deviation of a binned distribution
+    mean=float(np.sum(centers*probs))
+    return((mean,float(np.sqrt(max(np.sum((centers-mean)**2*probs),0.0)))))
+
+
+def sample_distribution(centers,probs,shots,rng=None): # Virtual single-shot energies drawn from the binned distribution
+    rng=np.random.default_rng() if rng is None else rng
+    return(rng.choice(centers,size=shots,p=probs))
+
+
+def plot_energy_distribution(centers,probs,targ_val): # Smooth version of lmg_master.plot_distr
+    import matplotlib.pyplot as plt # Imported here so that importing this module does not load matplotlib
+    width=centers[1]-centers[0] if len(centers)>1 else 1.0
+    plt.plot(centers,probs/width,color='b',label='Single Shot Energy Distribution')
+    plt.ylabel('Probability density')
+    plt.axvline(x = targ_val, color = 'g', label = 'calculated_expectation_value')
+    plt.xlabel('Single Shot Estimated Energy')
+    plt.show()
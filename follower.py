@@ -0,0 +1,140 @@
+# Follows a shot file written by total_circuit_runner while it is still being written.
+# Only the newly appended bytes are read on each poll, so the prefix is never parsed twice.
+# The file holds blocks of shots going round the cliques in turn, so every clique has shots after the first round;
+# running per-clique aggregates give <H> +/- standard error snapshots as the shots come in.
+import os
+import time
+import numpy as np
+from analyzer import clique_weights, bits_from_strings, oeater_array, num_cliques
+
+
+class CliqueTally: # Running count, mean and sum of squared deviations (Chan et al. merge) for one clique
+    def __init__(self):
+        self.n=0
+        self.mean=0.0
+        self.m2=0.0
+
+    def add(self,energies):
+        k=len(energies)
+        if k==0:
+            return
+        chunk_mean=float(np.mean(energies))
+        chunk_m2=float(np.sum((energies-chunk_mean)**2))
+        delta=chunk_mean-self.mean
+        tot=self.n+k
+        self.mean+=delta*k/tot
+        self.m2+=chunk_m2+delta**2*self.n*k/tot
+        self.n=tot
+
+    def var(self):
+        if self.n<2:
+            return(0.0)
+        return(self.m2/(self.n-1))
+
+
+class ShotFollower:
+    '''
+    Incrementally parses a total_circuit_runner output file (lines of comma-terminated bitstrings, one block per line,
+    line i belonging to clique i mod num_cliques, and an empty line once the run is over).
+    Call poll() to read whatever has been appended since the last call and fold it into the running tallies.
+    '''
+    def __init__(self,V,W,nua,nub,inp_data_filename):
+        self.V,self.W,self.nua,self.nub=V,W,nua,nub
+        self.path=f'{inp_data_filename}.txt'
+        self.offset=0
+        self.partial='' # An incomplete bitstring left over at the end of the last read
+        self.block=0 # Which line (block) the next bitstring belongs to
+        self.line_shots=0 # Shots already folded in from the current line
+        self.finished=False # The empty end-of-run line has been read
+        self.M=None
+        self.weights=None
+        self.tallies=[]
+
+    def done(self): # True once the end-of-run line has been read
+        return(self.finished)
+
+    def _fold(self,tokens):
+        if len(tokens)==0:
+            return
+        if self.M is None:
+            self.M=len(tokens[0])
+            self.weights=clique_weights(self.M,self.V,self.W,self.nua,self.nub)
+            self.tallies=[CliqueTally() for _ in range(num_cliques(self.M))]
+        clique=self.block%len(self.tallies)
+        energies=oeater_array(self.weights[clique],bits_from_strings(tokens))
+        self.tallies[clique].add(energies)
+        self.line_shots+=len(tokens)
+
+    def poll(self): # Reads newly appended data. Returns the number of new shots folded in.
+        if not os.path.exists(self.path):
+            return(0)
+        with open(self.path,'r') as fo:
+            fo.seek(self.offset)
+            text=fo.read()
+            self.offset=fo.tell()
+        if text=='':
+            return(0)
+        before=self.total_shots()
+        segs=(self.partial+text).split('\n')
+        for k,seg in enumerate(segs):
+            toks=seg.split(',')
+            if k==len(segs)-1:
+                self.partial=toks.pop() # Everything after the last comma may still be mid-write
+            else:
+                toks=[t for t in toks if t!='']
+            self._fold(toks)
+            if k<len(segs)-1:
+                if self.line_shots==0:
+                    self.finished=True
+                else:
+                    self.block+=1
+                    self.line_shots=0
+        return(self.total_shots()-before)
+
+    def total_shots(self):
+        return(sum(t.n for t in self.tallies))
+
+    def snapshot(self): # Current estimate. estimate and error stay None until every clique has at least two shots.
+        cliques=[{'shots':t.n,'mean':t.mean,'var':t.var()} for t in self.tallies]
+        est=None
+        err=None
+        if len(self.tallies)>0 and min(t.n for t in self.tallies)>=2:
+            est=sum(t.mean for t in self.tallies)
+            err=np.sqrt(sum(t.var()/t.n for t in self.tallies)) # Cliques are sampled independently so their variances add
+        return({'shots':self.total_shots(),'estimate':est,'error':err,'cliques':cliques,'complete':self.done()})
+
+
+def follow_distr(V,W,nua,nub,inp_data_filename,every=1000,poll_interval=0.5,timeout=None):
+    '''
+    Generator yielding snapshot dicts ({'shots','estimate','error','cliques','complete'}) while the file grows.
+    A snapshot is yielded whenever at least `every` new shots have arrived, and once more when the file is complete.
+    Stops when the end-of-run line has been read or, if timeout is given, after timeout seconds without new data.
+    '''
+    fol=ShotFollower(V,W,nua,nub,inp_data_filename)
+    pending=0
+    last_growth=time.time()
+    while True:
+        new=fol.poll()
+        if new>0:
+            pending+=new
+            last_growth=time.time()
+        if fol.done():
+            yield(fol.snapshot())
+            return
+        if pending>=every:
+            pending=0
+            yield(fol.snapshot())
+        if timeout is not None and time.time()-last_growth>timeout:
+            return
+        if new==0:
+            time.sleep(poll_interval)
+
+
+def watch_distr(V,W,nua,nub,inp_data_filename,callback,every=1000,poll_interval=0.5,timeout=None):
+    # Callback version of follow_distr. If callback returns True we stop following (e.g. to abort a bad run).
+    # Returns the last snapshot seen.
+    snap=None
+    for snap in follow_distr(V,W,nua,nub,inp_data_filename,every,poll_interval,timeout):
+        if callback(snap):
+            break
+    return(snap)
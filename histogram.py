@@ -0,0 +1,147 @@
+# Mergeable fixed-edge histograms of single-shot energies.
+# Instead of keeping a per-shot list (and letting plt.hist pick sqrt(shots)/4 bins), shots are scored block by block
+# into counts over fixed edges. The edges only depend on the problem (the extreme energies any shot can score), so
+# histograms of the same problem from different runs, workers or archive chunks can simply be added together.
+# Exact running moments are kept next to the counts, so mean and standard error do not suffer from binning.
+#
+# hist=histogram_from_bits(V,W,nua,nub,clique_bits)
+# hist.merge(histogram_from_archive(V,W,nua,nub,'run2.lmgz'))
+# plot_distr(hist,targ_val,hist.n)
+import numpy as np
+from analyzer import clique_weights, oeater_array, num_cliques
+
+DEFAULT_BINS=200
+
+
+class EnergyHistogram:
+    '''
+    Counts over num_bins equal bins spanning [lo, hi], plus underflow/overflow and the running count, mean and sum of
+    squared deviations of every value added (merged with Chan's formula).
+    '''
+    def __init__(self,lo,hi,num_bins=DEFAULT_BINS):
+        self.lo=float(lo)
+        self.hi=float(hi)
+        self.num_bins=int(num_bins)
+        self.counts=np.zeros(self.num_bins,dtype=np.int64)
+        self.under=0
+        self.over=0
+        self.n=0
+        self.mean_=0.0
+        self.m2=0.0
+
+    def edges(self):
+        return(np.linspace(self.lo,self.hi,self.num_bins+1))
+
+    def centers(self):
+        e=self.edges()
+        return((e[:-1]+e[1:])/2)
+
+    def compatible(self,other):
+        return(self.lo==other.lo and self.hi==other.hi and self.num_bins==other.num_bins)
+
+    def _moments(self,n,mean,m2): # Folds (n, mean, m2) of another sample into the running moments
+        if n==0:
+            return
+        delta=mean-self.mean_
+        tot=self.n+n
+        self.mean_+=delta*n/tot
+        self.m2+=m2+delta**2*self.n*n/tot
+        self.n=tot
+
+    def add(self,values):
+        values=np.asarray(values,dtype=float)
+        if values.size==0:
+            return(self)
+        idx=np.floor((values-self.lo)*(self.num_bins/(self.hi-self.lo))).astype(np.int64)
+        idx[values==self.hi]=self.num_bins-1 # The last bin is closed, like np.histogram
+        self.under+=int(np.sum(idx<0))
+        self.over+=int(np.sum(idx>=self.num_bins))
+        self.counts+=np.bincount(idx[(idx>=0)&(idx<self.num_bins)],minlength=self.num_bins)
+        m=float(np.mean(values))
+        self._moments(values.size,m,float(np.sum((values-m)**2)))
+        return(self)
+
+    def merge(self,other):
+        if not self.compatible(other):
+            raise ValueError('Histograms have different edges')
+        self.counts+=other.counts
+        self.under+=other.under
+        self.over+=other.over
+        self._moments(other.n,other.mean_,other.m2)
+        return(self)
+
+    def __add__(self,other):
+        return(self.copy().merge(other))
+
+    def copy(self):
+        out=EnergyHistogram(self.lo,self.hi,self.num_bins)
+        return(out.merge(self))
+
+    def mean(self):
+        return(self.mean_)
+
+    def std(self): # Same normalization as np.std
+        return(float(np.sqrt(self.m2/self.n)) if self.n>0 else 0.0)
+
+    def std_error(self):
+        return(self.std()/np.sqrt(self.n) if self.n>0 else 0.0)
+
+    def density(self): # Normalized like plt.hist(density=True)
+        width=(self.hi-self.lo)/self.num_bins
+        return(self.counts/max(self.counts.sum(),1)/width)
+
+    def to_dict(self):
+        return({'lo':self.lo,'hi':self.hi,'num_bins':self.num_bins,'counts':self.counts,'under':self.under,
+                'over':self.over,'n':self.n,'mean':self.mean_,'m2':self.m2})
+
+    def save(self,path):
+        with open(path,'wb') as fo:
+            np.savez(fo,**self.to_dict())
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as data:
+            out=cls(float(data['lo']),float(data['hi']),int(data['num_bins']))
+            out.counts=data['counts'].astype(np.int64)
+            out.under,out.over,out.n=int(data['under']),int(data['over']),int(data['n'])
+            out.mean_,out.m2=float(data['mean']),float(data['m2'])
+        return(out)
+
+
+def energy_bounds(M,V,W,nua,nub): # Lowest and highest single-shot energy any set of clique outcomes can score
+    lo=0.0
+    hi=0.0
+    for const,lin,pair in clique_weights(M,V,W,nua,nub)[:num_cliques(M)]:
+        spread=float(np.sum(np.abs(lin))+np.sum(np.abs(pair)))
+        lo+=const-spread
+        hi+=const+spread
+    return((lo,hi))
+
+
+def histogram_for(M,V,W,nua,nub,num_bins=DEFAULT_BINS): # Empty histogram with the problem's fixed edges
+    lo,hi=energy_bounds(M,V,W,nua,nub)
+    if hi<=lo:
+        hi=lo+1.0
+    return(EnergyHistogram(lo,hi,num_bins))
+
+
+def histogram_from_bits(V,W,nua,nub,clique_bits,hist=None,num_bins=DEFAULT_BINS,block=1<<16):
+    # Scores (shots, M) clique bit arrays block by block into hist (a new histogram_for the problem by default)
+    M=clique_bits[0].shape[1]
+    weights=clique_weights(M,V,W,nua,nub)
+    hist=histogram_for(M,V,W,nua,nub,num_bins) if hist is None else hist
+    shots=clique_bits[0].shape[0]
+    for start in range(0,shots,block):
+        hist.add(sum(oeater_array(weights[c],clique_bits[c][start:start+block]) for c in range(num_cliques(M))))
+    return(hist)
+
+
+def histogram_from_archive(V,W,nua,nub,archive_path,hist=None,num_bins=DEFAULT_BINS):
+    # Streams an archive.ShotArchive chunk by chunk; only one chunk per clique is in memory at a time
+    from archive import ShotArchive
+    with ShotArchive(archive_path) as arc:
+        weights=clique_weights(arc.M,V,W,nua,nub)
+        hist=histogram_for(arc.M,V,W,nua,nub,num_bins) if hist is None else hist
+        for chunks in zip(*[arc.iter_chunks(c) for c in range(arc.num_cliques)]):
+            hist.add(sum(oeater_array(weights[c],chunks[c]) for c in range(arc.num_cliques)))
+    return(hist)
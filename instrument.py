@@ -0,0 +1,165 @@
+# Profiling hooks for the pipeline stages. Stages are wrapped with @instrumented(...) or `with measure(...)`
+# and every call produces a record {'stage','seconds','ts', plus shots/bytes_written/bytes_read/statevector_bytes
+# when they apply} that is handed to the registered sinks.
+# With no sinks registered (the default) the wrappers just call straight through, so the cost is one list check.
+#
+# import instrument
+# instrument.add_sink(instrument.JsonLinesSink('metrics.jsonl'))
+# instrument.add_sink(instrument.PrometheusSink('metrics.prom'))
+import os
+import time
+import json
+import atexit
+import inspect
+import functools
+
+_sinks=[]
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return(sink)
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+def clear_sinks():
+    for sink in _sinks:
+        sink.flush()
+    del _sinks[:]
+
+def enabled():
+    return(len(_sinks)>0)
+
+def emit(record):
+    for sink in _sinks:
+        sink.emit(record)
+
+
+class measure:
+    '''
+    Context manager timing a block. The yielded dict can be filled with extra fields (shots, bytes_written, ...).
+    When instrumentation is off a throwaway dict is yielded and nothing is timed or emitted.
+    '''
+    def __init__(self,stage,**fields):
+        self.stage=stage
+        self.fields=fields
+
+    def __enter__(self):
+        self.on=len(_sinks)>0
+        self.record=dict(self.fields)
+        if self.on:
+            self.start=time.perf_counter()
+        return(self.record)
+
+    def __exit__(self,exc_type,exc,tb):
+        if self.on:
+            self.record['stage']=self.stage
+            self.record['seconds']=time.perf_counter()-self.start
+            self.record['ts']=time.time()
+            if exc_type is not None:
+                self.record['error']=exc_type.__name__
+            emit(self.record)
+        return(False)
+
+
+def instrumented(stage,fields=None):
+    # Decorator form of measure. fields(args, result) returns extra record entries and is only evaluated when a
+    # sink is listening. args maps parameter names to values (defaults filled in), however the call passed them.
+    # If fields fails the record gets 'fields_error' instead; the call's result is returned either way.
+    def wrap(fn):
+        sig=inspect.signature(fn)
+        @functools.wraps(fn)
+        def inner(*args,**kwargs):
+            if not _sinks:
+                return(fn(*args,**kwargs))
+            start=time.perf_counter()
+            result=fn(*args,**kwargs)
+            record={'stage':stage,'seconds':time.perf_counter()-start,'ts':time.time()}
+            if fields is not None:
+                try:
+                    bound=sig.bind(*args,**kwargs)
+                    bound.apply_defaults()
+                    record.update(fields(bound.arguments,result))
+                except Exception as exc:
+                    record['fields_error']=type(exc).__name__
+            emit(record)
+            return(result)
+        return(inner)
+    return(wrap)
+
+
+def statevector_bytes(num_qubits,itemsize=16): # Dense complex128 statevector size
+    return(itemsize*2**num_qubits)
+
+
+class NullSink: # Accepts and drops records
+    def emit(self,record):
+        pass
+
+    def flush(self):
+        pass
+
+
+class JsonLinesSink: # One JSON object per record, appended to path
+    def __init__(self,path):
+        self.fo=open(path,'a')
+        atexit.register(self.flush)
+
+    def emit(self,record):
+        self.fo.write(json.dumps(record,default=str)+'\n')
+
+    def flush(self):
+        if not self.fo.closed:
+            self.fo.flush()
+
+    def close(self):
+        self.fo.close()
+
+
+class PrometheusSink:
+    '''
+    Aggregates records per stage and writes them in the Prometheus text exposition format, e.g. for the
+    node_exporter textfile collector. The file is rewritten at most every `interval` seconds and at exit.
+    '''
+    COUNTERS=(('seconds','lmg_stage_seconds_total','Wall time spent in the stage'),
+              ('shots','lmg_stage_shots_total','Shots produced or consumed by the stage'),
+              ('bytes_written','lmg_stage_bytes_written_total','Bytes written by the stage'),
+              ('bytes_read','lmg_stage_bytes_read_total','Bytes read by the stage'))
+
+    def __init__(self,path,interval=5.0):
+        self.path=path
+        self.interval=interval
+        self.last_write=0.0
+        self.stats={}
+        atexit.register(self.flush)
+
+    def emit(self,record):
+        st=self.stats.setdefault(record['stage'],{'calls':0,'statevector_bytes':0})
+        st['calls']+=1
+        for key,_,_ in self.COUNTERS:
+            if key in record:
+                st[key]=st.get(key,0)+record[key]
+        if 'statevector_bytes' in record:
+            st['statevector_bytes']=max(st['statevector_bytes'],record['statevector_bytes'])
+        if time.time()-self.last_write>=self.interval:
+            self.flush()
+
+    def render(self):
+        lines=['# HELP lmg_stage_calls_total Number of calls of the stage','# TYPE lmg_stage_calls_total counter']
+        lines+=[f'lmg_stage_calls_total{{stage="{s}"}} {st["calls"]}' for s,st in sorted(self.stats.items())]
+        for key,name,help_text in self.COUNTERS:
+            lines+=[f'# HELP {name} {help_text}',f'# TYPE {name} counter']
+            lines+=[f'{name}{{stage="{s}"}} {st[key]}' for s,st in sorted(self.stats.items()) if key in st]
+        lines+=['# HELP lmg_stage_statevector_bytes_max Largest dense statevector handled by the stage',
+                '# TYPE lmg_stage_statevector_bytes_max gauge']
+        lines+=[f'lmg_stage_statevector_bytes_max{{stage="{s}"}} {st["statevector_bytes"]}'
+                for s,st in sorted(self.stats.items()) if st['statevector_bytes']>0]
+        return('\n'.join(lines)+'\n')
+
+    def flush(self):
+        tmp=self.path+'.tmp'
+        with open(tmp,'w') as fo:
+            fo.write(self.render())
+        os.replace(tmp,self.path)
+        self.last_write=time.time()
@@ -1,14 +1,16 @@
-import dwave.gate.operations as gt
-from dwave.gate import Circuit
 import numpy as np
-import dwave.gate.simulator
+from instrument import instrumented, measure, statevector_bytes
 # Run pip install dwave.gate --upgrade to upgrade to newest version of dwave.gate
+# dwave.gate is imported inside the functions that build or simulate circuits so that importing this module
+# (e.g. from analysis-only code) does not pull in the simulator stack.
 
 # First we need to define the state-prep circuit.
 def intcaststr(bitlist): # Taken from Stack Exchange
   return("".join(str(i) for i in bitlist))
 
 def state_prep(angles):
+  import dwave.gate.operations as gt
+  from dwave.gate import Circuit
   M=len(angles) # The total number of qubits required which is roughly equal to the number of particles N/2
   blank=Circuit(M,M) #A blank circuit with M qubits and M bits. Not sure if we need the bits.
   if M==1:
@@ -23,8 +25,23 @@ def state_prep(angles):
 
 # Now we need to write functions for the measurement diagonalization circuits
 
+def clique_basis_change(circ,clique): # Appends the gates that rotate clique (1 to 4) into the computational basis
+  import dwave.gate.operations as gt
+  with circ.context as (q,c):
+    if clique==2:
+      for k in range(circ.num_qubits):
+        gt.Hadamard(q[k]) # Clique 2 is all Xs so we just apply Hadamards to each qubit.
+    elif clique in (3,4):
+      for k in range(clique-3,circ.num_qubits-1,2): # Clique 3 pairs qubits (0,1),(2,3),... and clique 4 pairs (1,2),(3,4),...
+        gt.Hadamard(q[k+1]) # Might be the other way around...
+        gt.CNOT(q[k],q[k+1])
+        gt.Hadamard(q[k])
+  return(circ)
+
 def clique1_diag(circ,num_shots): # A new version of diagonal circuit 1
   # used for testing Theodor's new sample() function which should fix entanglement issue
+  import dwave.gate.operations as gt
+  import dwave.gate.simulator
   with circ.context as reg:
     meas1 = gt.Measurement(reg.q) | reg.c
   st=dwave.gate.simulator.simulate(circ)
@@ -33,9 +50,9 @@ def clique1_diag(circ,num_shots): # A new version of diagonal circuit 1
   return((samples,st))
 
 def clique2_diag(circ,num_shots): # The post-prep circuit required to diagonalize the state for the measurement basis. Works with Clique 2 (see literature)
-  with circ.context as (q,c):
-    for k in range(circ.num_qubits):
-      gt.Hadamard(q[k]) # Clique 2 is all Xs so we just apply Hadamards to each qubit.
+  import dwave.gate.operations as gt
+  import dwave.gate.simulator
+  clique_basis_change(circ,2)
   circ.unlock()
   with circ.context as reg:
     meas2 = gt.Measurement(reg.q) | reg.c
@@ -45,14 +62,12 @@ def clique2_diag(circ,num_shots): # The post-prep circuit required to diagonaliz
   return(samples)
     
 def clique3_diag(circ,num_shots):
+  import dwave.gate.operations as gt
+  import dwave.gate.simulator
   if circ.num_qubits<2:
     print('Less than 2 qubits, so we do not need to measure clique 3.\n')
   else:
-    with circ.context as (q,c):
-      for k in range(0,circ.num_qubits-1,2):
-        gt.Hadamard(q[k+1]) # Might be the other way around...
-        gt.CNOT(q[k],q[k+1])
-        gt.Hadamard(q[k])
+    clique_basis_change(circ,3)
     circ.unlock()
     with circ.context as reg:
       meas3 = gt.Measurement(reg.q) | reg.c
@@ -64,14 +79,12 @@ def clique3_diag(circ,num_shots):
 
   
 def clique4_diag(circ,num_shots):
+  import dwave.gate.operations as gt
+  import dwave.gate.simulator
   if circ.num_qubits<3:
     print('Less than 3 qubits, so we do not need to measure clique 4.\n')
   else:
-    with circ.context as (q,c):
-      for k in range(1,circ.num_qubits-1,2):
-        gt.Hadamard(q[k+1]) # Might be the other way around...
-        gt.CNOT(q[k],q[k+1])
-        gt.Hadamard(q[k])
+    clique_basis_change(circ,4)
     circ.unlock()
     with circ.context as reg:
       meas4 = gt.Measurement(reg.q) | reg.c
@@ -82,33 +95,80 @@ def clique4_diag(circ,num_shots):
   
 
 
-def total_circuit_runner(angles,out_file_name,num_shots=10**4):
+@instrumented('write_clique_line',lambda a,r: {'shots':len(a['outs']),'bytes_written':r})
+def write_clique_line(fo,outs): # Writes one block of a clique's bitstrings as a single line and flushes so followers see it right away
+  line=''.join(str(bs)+',' for bs in outs)+'\n'
+  fo.write(line)
+  fo.flush()
+  return(len(line))
+
+@instrumented('total_circuit_runner.simulate',lambda a,r: {'clique':a['clique'],'statevector_bytes':statevector_bytes(len(a['angles']))})
+def clique_sampler(angles,clique): # Builds and simulates one clique's circuit once; the returned function draws n more bitstrings
+  import dwave.gate.operations as gt
+  import dwave.gate.simulator
+  circ=state_prep(angles)
+  circ.unlock()
+  clique_basis_change(circ,clique)
+  circ.unlock()
+  with circ.context as reg:
+    meas = gt.Measurement(reg.q) | reg.c
+  dwave.gate.simulator.simulate(circ)
+  qubs=[qubit for qubit in range(circ.num_qubits)]
+  return(lambda n: list(meas.sample(qubs,n,as_bitstring=True)))
+
+@instrumented('total_circuit_runner',lambda a,r: {'shots':sum(len(o) for o in r)})
+def total_circuit_runner(angles,out_file_name=None,num_shots=10**4,backend=None,as_bits=False,block_shots=None):
   # Takes in a set of angles and num_shots
   # Runs the necessary circuits (up to 4) with num_shots shots
   # outputs lists of bitstrings collected in chronological order [[clique1 bitstrings],[clique2 bitsrings],...]
+  # If out_file_name is given the bitstrings are also written to <out_file_name>.txt in blocks of block_shots shots,
+  # one line per block, going round the cliques in turn (clique 1, 2, .., 1, 2, ..), and an empty line at the end.
+  # Every line is flushed as soon as it has been sampled, so follower.follow_distr has shots of every clique (and
+  # an estimate) after the first round instead of waiting for the last clique. block_shots=None makes ten rounds.
+  # analyzer.read_cliques puts the blocks back together; a file with one line per clique is the same format.
+  # backend=None builds and simulates the dwave.gate circuits below; otherwise it is a backends.py backend
+  # (or its name, e.g. 'numpy') that samples each clique directly. backend='auto' lets dispatch.py pick dense or MPS
+  # simulation from the memory budget, so large M no longer tries to allocate a 2^M statevector.
+  # as_bits=True returns (num_shots, M) uint8 arrays instead of bitstring lists
   # Uses a unary encoding
+  from analyzer import num_cliques, strings_from_bits, bits_from_strings
   M=len(angles)
-  base1=state_prep(angles) # Makes the state prep circuit object which will have diagonalization circuits appended to it.
-  base1.unlock()
-  bitstrings_1,base_state=clique1_diag(base1,num_shots)
-  base2=state_prep(angles) # Uh... if I didn't make separate ones it just changed them all each time. Problem? FIX
-  base2.unlock()
-  bitstrings_2=clique2_diag(base2,num_shots)
-  list_of_outputs=[bitstrings_1,bitstrings_2]
-  if M>1: # If M>1 then clique 3 will come into play
-    base3=state_prep(angles)
-    base3.unlock()
-    bitstrings_3=clique3_diag(base3,num_shots)
-    list_of_outputs.append(bitstrings_3)
-    if M>2: # If M>2 then clique 4 will come into play
-      base4=state_prep(angles)
-      base4.unlock()
-      bitstrings_4=clique4_diag(base4,num_shots)
-      list_of_outputs.append(bitstrings_4)
-  fo=open(str(out_file_name)+'.txt','w')
-  for outs in list_of_outputs:
-      for bs in outs:
-        fo.write(str(bs)+',')
-      fo.write('\n')
-  fo.close()
-  #return(base_state)
+  K=num_cliques(M)
+  if block_shots is None:
+    block_shots=-(-num_shots//10)
+  block_shots=max(int(block_shots),1)
+  if backend is None:
+    samplers={} # Each circuit is simulated once, when its first block is drawn
+    def draw(c,n):
+      if c not in samplers:
+        samplers[c]=clique_sampler(angles,c+1)
+      return(samplers[c](n))
+  else:
+    from backends import get_backend
+    if isinstance(backend,str) and backend=='auto':
+      from dispatch import choose_backend
+      backend=choose_backend(M,num_shots)
+    backend=get_backend(backend)
+    draw=lambda c,n: backend.sample_clique(angles,c+1,n)
+  fo=None
+  if out_file_name is not None:
+    fo=open(str(out_file_name)+'.txt','w')
+  blocks=[[] for _ in range(K)]
+  for start in range(0,num_shots,block_shots):
+    n=min(block_shots,num_shots-start)
+    for c in range(K):
+      with measure(f'total_circuit_runner.clique{c+1}',shots=n) as rec: # Per-clique timing, whatever the backend
+        out=draw(c,n)
+        if backend is None:
+          rec['statevector_bytes']=statevector_bytes(M)
+      blocks[c].append(out)
+      if fo is not None:
+        write_clique_line(fo,out if backend is None else strings_from_bits(out))
+  if fo is not None:
+    fo.write('\n') # End of run, so followers know no more blocks are coming
+    fo.close()
+  if backend is None:
+    list_of_outputs=[sum(b,[]) for b in blocks]
+    return([bits_from_strings(o) for o in list_of_outputs] if as_bits else list_of_outputs)
+  list_of_outputs=[np.concatenate(b) if len(b)>0 else np.zeros((0,M),dtype=np.uint8) for b in blocks]
+  return(list_of_outputs if as_bits else [strings_from_bits(o) for o in list_of_outputs])
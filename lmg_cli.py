@@ -0,0 +1,227 @@
+# Command line entry point (installed as `lmgvqe`, or run with python -m lmg_cli).
+# Heavy modules are imported inside each subcommand so that e.g. `lmgvqe analyze` never loads the simulator.
+#
+# lmgvqe run 4 3.0 1.2 0 1 --level 1 --shots 10000
+# lmgvqe run 40 3.0 1.2 0 1 --backend auto --memory-budget 8e9
+# lmgvqe analyze 3.0 1.2 0 1 test_dest
+# lmgvqe follow 3.0 1.2 0 1 test_dest --every 2000
+# lmgvqe campaign spec.json results/ --batch-size 20
+# lmgvqe bench --max-M 8 --out bench.json
+# lmgvqe coordinate spec.json /shared/queue results/   (then on each node: lmgvqe worker /shared/queue)
+# lmgvqe optimize 4 3.0 1.2 0 1 --init random --shots 4000
+# lmgvqe encodings 4 12 40 3.0 1.2 0 1
+# lmgvqe convert 53qub10000.txt 53qub10000.lmgz --V 1.7320508 --W 1.4142136
+import sys
+import json
+import argparse
+
+
+def _strip_txt(name): # The analyzers add .txt themselves
+    return(name[:-4] if name.endswith('.txt') else name)
+
+
+def cmd_run(args):
+    if args.backend=='auto':
+        from dispatch import run
+        output='shots' if args.out is not None or args.plot else 'estimate'
+        res=run(args.M,args.V,args.W,args.nua,args.nub,args.level,args.shots,output,args.memory_budget,
+                out_file_name=args.out)
+        print(f'Path: {res["reason"]}')
+        res.setdefault('file',None)
+    else:
+        from pipeline import run_point
+        res=run_point(args.M,args.V,args.W,args.nua,args.nub,args.level,args.shots,args.out,args.backend)
+    print(f'Target <H> = {res["target"]:.6f}')
+    print(f'Estimate   = {res["mean"]:.6f} +/- {res["std_error"]:.6f} ({args.shots} shots)')
+    if res['file'] is not None:
+        print(f'Shots written to {res["file"]}.txt')
+    if args.plot:
+        from lmg_master import plot_distr
+        plot_distr(res['distr'],res['target'],args.shots)
+    if args.plot_exact:
+        from energy_distribution import energy_distribution, plot_energy_distribution
+        centers,probs=energy_distribution(args.V,args.W,args.nua,args.nub,angles=res['angles'])
+        plot_energy_distribution(centers,probs,res['target'])
+
+
+def cmd_analyze(args):
+    import numpy as np
+    from analyzer import read_cliques, bits_from_strings, distr_from_bits
+    bits=[bits_from_strings(strs) for strs in read_cliques(_strip_txt(args.file))]
+    distr=distr_from_bits(args.V,args.W,args.nua,args.nub,bits)
+    print(f'Estimate = {np.mean(distr):.6f} +/- {np.std(distr)/np.sqrt(len(distr)):.6f} ({len(distr)} shots)')
+
+
+def cmd_follow(args):
+    from follower import follow_distr
+    for snap in follow_distr(args.V,args.W,args.nua,args.nub,_strip_txt(args.file),args.every,args.poll,args.timeout):
+        if snap['estimate'] is None:
+            print(f'{snap["shots"]} shots read, waiting for every clique')
+        else:
+            print(f'{snap["shots"]} shots read: {snap["estimate"]:.6f} +/- {snap["error"]:.6f}')
+
+
+def cmd_campaign(args):
+    from campaign import run_campaign, spec_from_json
+    with open(args.spec,'r') as fo:
+        spec=spec_from_json(json.load(fo))
+    run_campaign(spec,args.out_dir,args.batch_size,args.format)
+
+
+def cmd_coordinate(args):
+    from campaign import spec_from_json
+    from distributed import run_coordinator
+    with open(args.spec,'r') as fo:
+        spec=spec_from_json(json.load(fo))
+    run_coordinator(spec,args.queue_dir,args.out_dir,args.format,dead_after=args.dead_after)
+
+
+def cmd_worker(args):
+    from distributed import run_worker
+    run_worker(args.queue_dir,args.name,args.heartbeat)
+
+
+def cmd_bench(args):
+    from benchmark import run_benchmarks, DEFAULT_MS, DEFAULT_SHOTS
+    res=run_benchmarks([M for M in DEFAULT_MS if M<=args.max_M],[s for s in DEFAULT_SHOTS if s<=args.max_shots],
+                       args.max_stage_seconds)
+    with open(args.out,'w') as fo:
+        json.dump(res,fo,indent=1)
+    print(f'Wrote {args.out}')
+
+
+def cmd_optimize(args):
+    from variational import optimize
+    res=optimize(args.M,args.V,args.W,args.nua,args.nub,args.init,args.shots,args.steps,args.lr,args.method,args.tol,
+                 seed=args.seed,verbose=args.verbose)
+    print(f'Reference <H> = {res["reference"]:.6f}')
+    print(f'Optimized <H> = {res["energy"]:.6f} (error {res["error"]:.2e}) after {res["steps"]} steps, '
+          f'{res["circuits"]} circuits, {"converged" if res["converged"] else "not converged"}')
+    if args.shots is not None:
+        print(f'Last shot estimate error {res["noisy_error"]:.2e} +/- {res["history"]["std_error"][-1]:.2e}')
+
+
+def cmd_encodings(args):
+    from binary import compare_encodings
+    keys=('qubits','terms','groups','prep_cnots','measure_cnots','sigma','executions')
+    print('M    encoding  '+''.join(f'{k:>14}' for k in keys))
+    for M in args.M:
+        res=compare_encodings(M,args.V,args.W,args.nua,args.nub,args.level,args.mode)
+        for enc in ('unary','binary'):
+            print(f'{M:<5}{enc:<10}'+''.join(f'{res[enc][k]:>14.4g}' for k in keys))
+
+
+def cmd_convert(args):
+    from archive import convert_legacy, ShotArchive
+    meta={'V':args.V,'W':args.W,'nua':args.nua,'nub':args.nub,'level':args.level}
+    convert_legacy(args.src,args.dst,meta,args.chunk_shots)
+    with ShotArchive(args.dst) as arc:
+        print(f'Wrote {args.dst}: M={arc.M}, {arc.num_cliques} cliques of {arc.shots()} shots')
+
+
+def _add_model_args(p,with_M=True):
+    if with_M:
+        p.add_argument('M',type=int,help='number of qubits / particle pairs')
+    p.add_argument('V',type=float)
+    p.add_argument('W',type=float)
+    p.add_argument('nua',type=int,choices=(0,1))
+    p.add_argument('nub',type=int,choices=(0,1))
+
+
+def build_parser():
+    parser=argparse.ArgumentParser(prog='lmgvqe',description='LMG eigenstate preparation and <H> estimation')
+    sub=parser.add_subparsers(dest='command',required=True)
+
+    p=sub.add_parser('run',help='simulate one eigenstate and estimate <H>')
+    _add_model_args(p)
+    p.add_argument('--level',type=int,default=0,help='energy level, 0 is the ground state')
+    p.add_argument('--shots',type=int,default=10**4)
+    p.add_argument('--out',default=None,help='also write the shots to OUT.txt')
+    p.add_argument('--plot',action='store_true',help='show the single-shot energy histogram')
+    p.add_argument('--plot-exact',action='store_true',help='show the exact single-shot energy distribution')
+    p.add_argument('--backend',choices=('dwave','numpy','mps','auto'),default=None,
+                   help='simulator (default: dwave.gate); auto picks the fastest path that fits in memory')
+    p.add_argument('--memory-budget',type=float,default=None,help='bytes available to --backend auto (default: half the RAM)')
+    p.set_defaults(func=cmd_run)
+
+    p=sub.add_parser('analyze',help='estimate <H> from a shot file')
+    _add_model_args(p,with_M=False)
+    p.add_argument('file')
+    p.set_defaults(func=cmd_analyze)
+
+    p=sub.add_parser('follow',help='follow a shot file while it is being written')
+    _add_model_args(p,with_M=False)
+    p.add_argument('file')
+    p.add_argument('--every',type=int,default=1000,help='report after this many new shots')
+    p.add_argument('--poll',type=float,default=0.5,help='seconds between polls')
+    p.add_argument('--timeout',type=float,default=None,help='give up after this many idle seconds')
+    p.set_defaults(func=cmd_follow)
+
+    p=sub.add_parser('campaign',help='run or resume a checkpointed sweep from a JSON spec')
+    p.add_argument('spec')
+    p.add_argument('out_dir')
+    p.add_argument('--batch-size',type=int,default=10)
+    p.add_argument('--format',choices=('npz','csv'),default='npz')
+    p.set_defaults(func=cmd_campaign)
+
+    p=sub.add_parser('coordinate',help='publish a campaign to a shared queue directory and collect the results')
+    p.add_argument('spec')
+    p.add_argument('queue_dir')
+    p.add_argument('out_dir')
+    p.add_argument('--format',choices=('npz','csv'),default='npz')
+    p.add_argument('--dead-after',type=float,default=30.0,help='requeue a worker\'s trials after this many silent seconds')
+    p.set_defaults(func=cmd_coordinate)
+
+    p=sub.add_parser('worker',help='run trials from a shared queue directory')
+    p.add_argument('queue_dir')
+    p.add_argument('--name',default=None,help='worker name (default: host-pid-random)')
+    p.add_argument('--heartbeat',type=float,default=5.0,help='seconds between heartbeats')
+    p.set_defaults(func=cmd_worker)
+
+    p=sub.add_parser('bench',help='stage-by-stage benchmark')
+    p.add_argument('--out',default='bench.json')
+    p.add_argument('--max-M',type=int,default=16)
+    p.add_argument('--max-shots',type=int,default=10**6)
+    p.add_argument('--max-stage-seconds',type=float,default=60.0)
+    p.set_defaults(func=cmd_bench)
+
+    p=sub.add_parser('optimize',help='variational search for the ground state with parameter-shift gradients')
+    _add_model_args(p)
+    p.add_argument('--init',choices=('random','perturbed'),default='random')
+    p.add_argument('--shots',type=int,default=None,help='shots per circuit (default: exact <H>)')
+    p.add_argument('--steps',type=int,default=300)
+    p.add_argument('--lr',type=float,default=0.1)
+    p.add_argument('--method',choices=('adam','gd'),default='adam')
+    p.add_argument('--tol',type=float,default=1e-6)
+    p.add_argument('--seed',type=int,default=None)
+    p.add_argument('--verbose',action='store_true')
+    p.set_defaults(func=cmd_optimize)
+
+    p=sub.add_parser('encodings',help='compare qubit and measurement costs of the unary and binary encodings')
+    p.add_argument('M',type=int,nargs='+')
+    _add_model_args(p,with_M=False)
+    p.add_argument('--level',type=int,default=0)
+    p.add_argument('--mode',choices=('qwc','full'),default='full',help='grouping of the binary Pauli terms')
+    p.set_defaults(func=cmd_encodings)
+
+    p=sub.add_parser('convert',help='convert a shot text file into an indexed binary archive')
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.add_argument('--V',type=float,default=None)
+    p.add_argument('--W',type=float,default=None)
+    p.add_argument('--nua',type=int,default=None)
+    p.add_argument('--nub',type=int,default=None)
+    p.add_argument('--level',type=int,default=None)
+    p.add_argument('--chunk-shots',type=int,default=1<<16)
+    p.set_defaults(func=cmd_convert)
+    return(parser)
+
+
+def main(argv=None):
+    args=build_parser().parse_args(argv)
+    args.func(args)
+    return(0)
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -4,13 +4,16 @@
 ## We sampled an eigenvalue of ______ +/- ______ with __ samples
 # I'd like to set it up so that it "waits" for inputs manually. I've never figured that shit out.
 import numpy as np
-from lmg import total_circuit_runner
-from analyzer import distrfinder, distrfinder2
+from analyzer import distrfinder2, distr_from_bits, log_prefixes, convergence_curves
+from pipeline import sample_cliques, run_point
 from state_generator import state_finder_fock, angle_finder
 import random as ra
-import dwave.gate.simulator
-from lmg import state_prep
-import matplotlib.pyplot as plt
+from verify import verify_state
+from cache import cached_run
+from instrument import instrumented
+from validation import sequential_rate, within_one_se_trial
+from triage import triage
+from histogram import EnergyHistogram, histogram_for
 # Gives correct answer when fed sample data from research
 # Theodor has fixed the measurement issue and it now works after I cloned his dwave-gate repo
 
@@ -27,25 +30,40 @@ import matplotlib.pyplot as plt
 #     print('Failure!\n')
 
 
-def single_run(M,V,W,nua,nub,energy_level,file_name_bitstring='test_dest',shots=10**4): 
+def plot_distr(distr,targ_val,shots): # Histogram of single-shot energies with the known eigenvalue marked
+    import matplotlib.pyplot as plt # Imported here so that importing lmg_master does not load matplotlib
+    # distr may be a per-shot list or a histogram.EnergyHistogram; the latter is drawn straight from its counts,
+    # so it costs the same for 10^4 or 10^8 shots.
+    if isinstance(distr,EnergyHistogram):
+        plt.stairs(distr.density(), distr.edges(), fill=True, color='b', label='Single Shot Energy Distribution')
+    else:
+        # We define bin width as bin_width= 4 * (max(distr) - min(distr)) / np.sqrt(shots)
+        plt.hist(distr, density=True, bins=int(np.sqrt(shots)/4), color='b', label='Single Shot Energy Distribution')  # density=False would make counts
+    plt.ylabel('Counts')
+    plt.axvline(x = targ_val, color = 'g', label = 'calculated_expectation_value')
+    plt.xlabel('Single Shot Estimated Energy')
+    plt.show()
+
+
+@instrumented('lmg_master.single_run')
+def single_run(M,V,W,nua,nub,energy_level,file_name_bitstring=None,shots=10**4,cache=None): 
     '''
     Will output energy and some basic data in a printed statement as well as an energy distribution graph.
     Simulates the energy_levelth eigenstate of the described LMG Hamiltonian and estimates the eigenvalue
+    The shots stay in memory unless file_name_bitstring is given (a name without .txt, or True for a unique name).
+    If a cache.ResultCache is given, a previous run with the same inputs is reused instead of simulating again.
     '''
-    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,energy_level)
-    angs=angle_finder(targ_state)
-    total_circuit_runner(angs,file_name_bitstring,shots)
-    distr=distrfinder(V,W,nua,nub,f'{file_name_bitstring}.txt')
-    mean=sum(distr)/len(distr)
-    standard_error=np.std(distr)/np.sqrt(shots)
+    if cache is not None:
+        res=cached_run(M,V,W,nua,nub,energy_level,shots,cache=cache)
+    else:
+        res=run_point(M,V,W,nua,nub,energy_level,shots,file_name_bitstring)
+    targ_val=res['target']
+    hist=histogram_for(M,V,W,nua,nub).add(res['distr'])
+    mean=hist.mean()
+    standard_error=hist.std_error()
     print(f'\nThe known energy value is {np.round(targ_val,4)} while we estimated {np.round(mean,4)}')
     print(f'The relative error is {abs(np.round(100*(mean-targ_val)/targ_val,1))}%\n')
-    # We define bin width as bin_width= 4 * (max(distr) - min(distr)) / np.sqrt(shots)
-    plt.hist(distr, density=True, bins=int(np.sqrt(shots)/4), color='b', label='Single Shot Energy Distribution')  # density=False would make counts
-    plt.ylabel('Counts')
-    plt.axvline(x = targ_val, color = 'g', label = 'calculated_expectation_value')
-    plt.xlabel('Single Shot Estimated Energy')
-    plt.show()
+    plot_distr(hist,targ_val,shots)
     # num_st_errors_away=abs(mean-targ_val)/standard_error
     # if num_st_errors_away<=1:
     #     print('The estimate was within 1 standard error')
@@ -57,6 +75,7 @@ def single_run(M,V,W,nua,nub,energy_level,file_name_bitstring='test_dest',shots=
 
 
 
+@instrumented('lmg_master.mult_test2')
 def mult_test2(num_tests,shots=10**4):# Runs tests and sees how many are within 100/sqrt(shots)% of the expected value
     rel_error_percents=[]
     for j in range(num_tests):
@@ -67,8 +86,7 @@ def mult_test2(num_tests,shots=10**4):# Runs tests and sees how many are within
         nub=ra.randint(0,1)
         targ_val, targ_state=state_finder_fock(M,V,W,nua,nub,0)
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
         mean=sum(distr)/len(distr)
         rel_error=abs(np.round(100*(mean-targ_val)/targ_val,2))
         rel_error_percents.append(rel_error)
@@ -79,6 +97,7 @@ def mult_test2(num_tests,shots=10**4):# Runs tests and sees how many are within
             num_within_one_percent+=1
     print(f'\n{np.round(100*num_within_one_percent/num_tests,2)}% were within percentile acceptability')
 
+@instrumented('lmg_master.mult_test3')
 def mult_test3(num_tests,shots=10**4):# Runs tests and prints out relevant information if the error is beyond 5%
     for j in range(num_tests):
         M=ra.randint(1,5)
@@ -88,20 +107,12 @@ def mult_test3(num_tests,shots=10**4):# Runs tests and prints out relevant infor
         nub=ra.randint(0,1)
         targ_val, targ_state=state_finder_fock(M,V,W,nua,nub,0)
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        base_state0= list(dwave.gate.simulator.simulate(state_prep(angs)))
-        base_state0.reverse()
-        base_state=[]
-        for k in base_state0:
-            if np.round(k,15)!=0.0:
-                base_state.append(k)
+        clique_bits=sample_cliques(angs,shots)
+        ver=verify_state(angs,targ_state) # Reads only the M+1 unary amplitudes of the prepared state
+        base_state=list(ver['amplitudes'])
         targ_state=list(targ_state)
-
-        targ_equal_baseq=True
-        for k in range(len(targ_state)):
-            if np.round(targ_state[k]-base_state[k],5)!=0:
-                targ_equal_baseq=False
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        targ_equal_baseq=ver['max_dev']<0.5e-5
+        distr=list(distr_from_bits(V,W,nua,nub,clique_bits))
         mean=sum(distr)/len(distr)
         rel_error=abs(np.round(100*(mean-targ_val)/targ_val,2))
         if abs(rel_error)>=5:
@@ -123,6 +134,7 @@ def mult_test3(num_tests,shots=10**4):# Runs tests and prints out relevant infor
             print('Expectation value is within 5%')
 
 
+@instrumented('lmg_master.mult_test4')
 def mult_test4(num_tests,shots=10**4):# Runs tests and prints out relevant information if the error is beyond uncertainty bounds
     num_success=0
     for j in range(num_tests):
@@ -133,19 +145,12 @@ def mult_test4(num_tests,shots=10**4):# Runs tests and prints out relevant infor
         nub=ra.randint(0,1)
         targ_val, targ_state=state_finder_fock(M,V,W,nua,nub,ra.randint(0,M-1))
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        base_state0= list(dwave.gate.simulator.simulate(state_prep(angs)))
-        base_state0.reverse()
-        base_state=[]
-        for k in base_state0:
-            if np.round(k,15)!=0.0:
-                base_state.append(k)
+        clique_bits=sample_cliques(angs,shots)
+        ver=verify_state(angs,targ_state) # Reads only the M+1 unary amplitudes of the prepared state
+        base_state=list(ver['amplitudes'])
         targ_state=list(targ_state)
-        targ_equal_baseq=True
-        for k in range(len(targ_state)):
-            if np.round(targ_state[k]-base_state[k],5)!=0:
-                targ_equal_baseq=False
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        targ_equal_baseq=ver['max_dev']<0.5e-5
+        distr=list(distr_from_bits(V,W,nua,nub,clique_bits))
         unc=np.std(distr)/np.sqrt(shots)
         mean=sum(distr)/len(distr)
         rel_error=abs(np.round(100*(mean-targ_val)/targ_val,2))
@@ -172,10 +177,18 @@ def mult_test4(num_tests,shots=10**4):# Runs tests and prints out relevant infor
     print(f'\nOut of {num_tests} trials, {np.round(100*num_success/num_tests,1)}% were within one standard error\n')
 
 
+@instrumented('lmg_master.mult_test_triage')
+def mult_test_triage(num_tests,shots=10**4,mode='exact',screen_shots=300): # mult_test3/4, but only suspicious problems get the full shots
+    res=triage(num_tests,shots,mode,screen_shots)
+    print(f'{res["escalated"]} of {num_tests} problems escalated, screening took {np.round(res["screen_seconds"],2)} s')
+    return(res)
+
+
                 
 
 
 
+@instrumented('lmg_master.step_mult_test')
 def step_mult_test(num_tests):
     for M in range(1,11):
         success_count=0
@@ -187,8 +200,7 @@ def step_mult_test(num_tests):
             shots=10**4
             targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,0)
             angs=angle_finder(targ_state)
-            total_circuit_runner(angs,'test_dest',shots)
-            distr=distrfinder(V,W,nua,nub,'test_dest')
+            distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
             mean=sum(distr)/len(distr)
             sampling_uncertainty = np.std(distr)/np.sqrt(shots)
             #print(f'The target energy is {np.round(targ_val,5)} while we obtained a value of {np.round(mean,5)} +/- {np.round(sampling_uncertainty,5)}')
@@ -197,6 +209,19 @@ def step_mult_test(num_tests):
         print(f'\nFor M={M} it was successful in {int(100*success_count/num_tests)}% of trials.')
 
 
+@instrumented('lmg_master.step_mult_test_sequential')
+def step_mult_test_sequential(max_tests=200,method='sprt',shots=10**4): # step_mult_test, but each M stops once its success rate is settled
+    results={}
+    for M in range(1,11):
+        res=sequential_rate(lambda: within_one_se_trial(M,shots),method=method,max_trials=max_tests)
+        lo,hi=res['interval']
+        print(f'\nFor M={M} it was successful in {int(100*res["rate"])}% of {res["trials"]} trials '
+              f'(95% interval {int(100*lo)}-{int(100*hi)}%, {res["decision"]}).')
+        results[M]=res
+    return(results)
+
+
+@instrumented('lmg_master.error_quant_test')
 def error_quant_test(num_tests):
     success_count=0
     for j in range(num_tests):
@@ -208,8 +233,7 @@ def error_quant_test(num_tests):
         shots=10**4
         targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,0)
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
         mean=sum(distr)/len(distr)
         sampling_uncertainty = np.std(distr)/np.sqrt(shots)
         #print(f'The target energy is {np.round(targ_val,5)} while we obtained a value of {np.round(mean,5)} +/- {np.round(sampling_uncertainty,5)}')
@@ -221,6 +245,7 @@ def error_quant_test(num_tests):
             print(abs(mean)+sampling_uncertainty)
             print()
 
+@instrumented('lmg_master.error_perc_test')
 def error_perc_test(num_tests):
     percent_error=[]
     for j in range(num_tests):
@@ -232,8 +257,7 @@ def error_perc_test(num_tests):
         shots=10**4
         targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,0)
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
         mean=sum(distr)/len(distr)
         sampling_uncertainty = np.std(distr)/np.sqrt(shots)
         #print(f'The target energy is {np.round(targ_val,5)} while we obtained a value of {np.round(mean,5)} +/- {np.round(sampling_uncertainty,5)}')
@@ -244,6 +268,7 @@ def error_perc_test(num_tests):
     return((percent_error,distr))
 
 
+@instrumented('lmg_master.shots_scale_test')
 def shots_scale_test():
     out_dict={}
     for shots in (10,10**2,10**3,10**4):
@@ -255,8 +280,7 @@ def shots_scale_test():
         nub=ra.randint(0,1)
         targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,0)
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',10**4)
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,10**4)))
         mean=sum(distr)/len(distr)
         sampling_uncertainty = np.std(distr)/np.sqrt(shots)
         #print(f'The target energy is {np.round(targ_val,5)} while we obtained a value of {np.round(mean,5)} +/- {np.round(sampling_uncertainty,5)}')
@@ -264,6 +288,28 @@ def shots_scale_test():
         print(f'Finished with {shots} shots.')
     return(out_dict)
 
+@instrumented('lmg_master.shots_convergence_test')
+def shots_convergence_test(num_tests,shots=10**4,num_points=20): # Error versus shots from ONE run per problem (see shots_scale_test)
+    # Each problem is simulated once with `shots` shots and every log-spaced prefix of that run is scored.
+    prefixes=log_prefixes(shots,num_points)
+    distrs=[]
+    targets=[]
+    for j in range(num_tests):
+        M=ra.randint(1,5)
+        V=ra.uniform(0.1,10)
+        W=V*ra.random()*((-1)**ra.randint(0,1))
+        nua=ra.randint(0,1)
+        nub=ra.randint(0,1)
+        targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,0)
+        angs=angle_finder(targ_state)
+        distrs.append(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
+        targets.append(targ_val)
+    rel,se=convergence_curves(distrs,targets,prefixes)
+    for k in range(len(prefixes)):
+        avg=np.mean(rel[:,k])
+        print(f'For {prefixes[k]} shots we obtained an average error of {np.round(avg,3)}%. Times sqrt(shots) this is {np.round(avg/100*np.sqrt(prefixes[k]),4)}')
+    return((prefixes,rel,se))
+
 # master_dict={10:[],100:[],1000:[],10000:[]}
 # for j in range(20):
 #     out_dict=shots_scale_test()
@@ -288,6 +334,7 @@ def shots_scale_test():
 # print(f'For 10**4 shots we obtained an average error of {sum(master_dict[10000])/len(master_dict[10000])}%')
 # print(f'This is {sum(master_dict[10000])/len(master_dict[10000])/100*np.sqrt(10000)}\n')
 
+@instrumented('lmg_master.mult_test')
 def mult_test(num_tests): # Tests to see if the final <H> is within one sampling uncertainty unit of the expected answer.
     success_count=0
     for j in range(num_tests):
@@ -299,8 +346,7 @@ def mult_test(num_tests): # Tests to see if the final <H> is within one sampling
         shots=10**4
         targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,ra.randint(0,M-1))
         angs=angle_finder(targ_state)
-        total_circuit_runner(angs,'test_dest',shots)
-        distr=distrfinder(V,W,nua,nub,'test_dest')
+        distr=list(distr_from_bits(V,W,nua,nub,sample_cliques(angs,shots)))
         mean=sum(distr)/len(distr)
         sampling_uncertainty = np.std(distr)/np.sqrt(shots)
         #print(f'The target energy is {np.round(targ_val,5)} while we obtained a value of {np.round(mean,5)} +/- {np.round(sampling_uncertainty,5)}')
@@ -310,7 +356,8 @@ def mult_test(num_tests): # Tests to see if the final <H> is within one sampling
 
 
 
-mult_test(10)
+if __name__=='__main__':
+    mult_test(10)
 
 # SOMETIMES FAILS... TOO OFTEN
 # FIGURE OUT WHY!!! First found May 11 2023
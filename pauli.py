@@ -0,0 +1,289 @@
+# General measurement engine for Hamiltonians written as weighted Pauli sums.
+# A Pauli sum is a dict {'XZIY...': coefficient} with qubit 0 as the first character. measurement_plan splits it into
+# qubit-wise commuting ('qwc') or fully commuting ('full') groups by greedy graph colouring, and synthesizes for each
+# group a Clifford circuit that maps every term to a signed Z-string. Measured bits are then scored with one parity
+# product per group, the generalization of analyzer.oeater_array.
+# Circuits are lists of (gate, qubits) with gates 'h', 's', 'sdg', 'cnot' and 'cz'; they run on the backends.py
+# simulators after state_prep (sample_plan) or are contracted exactly against a statevector (plan_expectation).
+#
+# The hand-written LMG cliques are the special case lmg_plan; lmg_regression_check compares the two.
+#
+# plan=measurement_plan(lmg_pauli_sum(5,3.0,1.2,0,1),mode='full')
+# distr=distr_from_plan(plan,sample_plan(plan,angles,10**4))
+import numpy as np
+from analyzer import num_cliques, clique_weights
+
+PAULI_BITS={'I':(0,0),'X':(1,0),'Y':(1,1),'Z':(0,1)}
+
+
+def pauli_arrays(paulis): # Strings -> (x, z) uint8 arrays of shape (terms, M)
+    x=np.array([[PAULI_BITS[ch][0] for ch in p] for p in paulis],dtype=np.uint8)
+    z=np.array([[PAULI_BITS[ch][1] for ch in p] for p in paulis],dtype=np.uint8)
+    return(x,z)
+
+
+def conflicts(paulis,mode='qwc'): # (terms, terms) bool matrix, True where two terms cannot share a group
+    x,z=pauli_arrays(paulis)
+    if mode=='qwc':
+        code=x+2*z # 0 I, 1 X, 2 Z, 3 Y
+        return(np.any((code[:,None,:]!=code[None,:,:])&(code[:,None,:]>0)&(code[None,:,:]>0),axis=2))
+    if mode=='full':
+        sym=(x.astype(np.int64)@z.T.astype(np.int64)+z.astype(np.int64)@x.T.astype(np.int64))%2
+        return(sym.astype(bool))
+    raise ValueError(f'Unknown mode {mode!r}, use qwc or full')
+
+
+def colour_groups(conflict): # Greedy colouring, largest degree first. Returns a list of index lists
+    order=np.argsort(-conflict.sum(axis=1),kind='stable')
+    groups=[]
+    for i in order:
+        for g in groups:
+            if not conflict[i,g].any():
+                g.append(i)
+                break
+        else:
+            groups.append([i])
+    return([sorted(g) for g in groups])
+
+
+def conjugate(x,z,r,circuit):
+    # Heisenberg images U P U^dagger of signed Paulis (x, z, sign bit r; arrays of shape (terms, M)) under the circuit,
+    # using the Aaronson-Gottesman update rules. Works on copies.
+    x=x.copy()
+    z=z.copy()
+    r=r.copy()
+    for gate,qubits in circuit:
+        if gate=='h':
+            a=qubits[0]
+            r^=x[:,a]&z[:,a]
+            x[:,a],z[:,a]=z[:,a].copy(),x[:,a].copy()
+        elif gate in ('s','sdg'):
+            a=qubits[0]
+            for k in range(1 if gate=='s' else 3): # S^dagger = S^3
+                r^=x[:,a]&z[:,a]
+                z[:,a]^=x[:,a]
+        elif gate=='cnot':
+            a,b=qubits
+            r^=x[:,a]&z[:,b]&(x[:,b]^z[:,a]^1)
+            x[:,b]^=x[:,a]
+            z[:,a]^=z[:,b]
+        elif gate=='cz': # H_b CNOT(a,b) H_b
+            a,b=qubits
+            x,z,r=conjugate(x,z,r,[('h',(b,)),('cnot',(a,b)),('h',(b,))])
+        else:
+            raise ValueError(f'Unknown gate {gate!r}')
+    return(x,z,r)
+
+
+def diagonalize_qwc(paulis): # Single-qubit basis changes: X -> H, Y -> Sdg then H
+    M=len(paulis[0])
+    circuit=[]
+    for q in range(M):
+        letters={p[q] for p in paulis}-{'I'}
+        if letters=={'X'}:
+            circuit.append(('h',(q,)))
+        elif letters=={'Y'}:
+            circuit+=[('sdg',(q,)),('h',(q,))]
+    return(circuit)
+
+
+def diagonalize_commuting(paulis):
+    # Clifford circuit for a set of mutually commuting Paulis, by symplectic Gaussian elimination on their generators:
+    # make the X block full rank (H), clear X off the pivot columns (CNOT), clear Z on the pivots (S, CZ), then H.
+    x,z=pauli_arrays(paulis)
+    x=x.copy()
+    z=z.copy()
+    M=x.shape[1]
+    circuit=[]
+    pivots=[]
+    rows=[]
+    for i in range(len(paulis)):
+        for r,p in zip(rows,pivots): # Reduce row i against the earlier pivot rows
+            if x[i,p]:
+                x[i]^=x[r]
+                z[i]^=z[r]
+        free=[c for c in range(M) if c not in pivots]
+        cols=[c for c in free if x[i,c]]
+        if not cols:
+            cols=[c for c in free if z[i,c]]
+            if not cols:
+                continue # Dependent on the earlier rows
+            circuit.append(('h',(cols[0],)))
+            x[:,cols[0]],z[:,cols[0]]=z[:,cols[0]].copy(),x[:,cols[0]].copy()
+        p=cols[0]
+        for j in range(len(paulis)): # Clear column p from every other row's X part
+            if j!=i and x[j,p]:
+                x[j]^=x[i]
+                z[j]^=z[i]
+        rows.append(i)
+        pivots.append(p)
+    gen_x=x[rows]
+    gen_z=z[rows]
+    for k,p in enumerate(pivots):
+        for c in range(M):
+            if c not in pivots and gen_x[k,c]:
+                circuit.append(('cnot',(p,c)))
+                gen_x[:,c]^=gen_x[:,p]
+                gen_z[:,p]^=gen_z[:,c]
+    for k,p in enumerate(pivots):
+        if gen_z[k,p]:
+            circuit.append(('s',(p,)))
+            gen_z[:,p]^=gen_x[:,p]
+        for l in range(k+1,len(pivots)):
+            if gen_z[k,pivots[l]]:
+                circuit.append(('cz',(p,pivots[l])))
+                gen_z[:,p]^=gen_x[:,pivots[l]]
+                gen_z[:,pivots[l]]^=gen_x[:,p]
+    circuit+=[('h',(p,)) for p in pivots]
+    return(circuit)
+
+
+def make_group(paulis,coefs,circuit): # Measured Z-masks and signs of each term after the circuit
+    x,z=pauli_arrays(paulis)
+    x,z,r=conjugate(x,z,np.zeros(len(paulis),dtype=np.uint8),circuit)
+    if x.any():
+        raise ValueError('Circuit does not diagonalize the group')
+    return({'paulis':list(paulis),'coefs':np.asarray(coefs,dtype=float),'circuit':list(circuit),'masks':z,
+            'weights':np.asarray(coefs,dtype=float)*(1-2.0*r)})
+
+
+def measurement_plan(pauli_sum,mode='qwc'):
+    '''
+    Groups the terms of pauli_sum (dict {pauli string: coefficient}) into commuting groups and synthesizes their
+    diagonalization circuits. Returns a list of groups {'paulis','coefs','circuit','masks','weights'}; a term contributes
+    weight * (-1)**(parity of the measured bits under its mask) to each shot. The identity term goes in the first group.
+    '''
+    paulis=[p for p in pauli_sum if set(p)!={'I'}]
+    ident=[p for p in pauli_sum if set(p)=={'I'}]
+    groups=colour_groups(conflicts(paulis,mode)) if paulis else [[]]
+    diag=diagonalize_qwc if mode=='qwc' else diagonalize_commuting
+    plan=[]
+    for k,g in enumerate(groups):
+        members=[paulis[i] for i in g]+(ident if k==0 else [])
+        circuit=diag([paulis[i] for i in g]) if g else []
+        plan.append(make_group(members,[pauli_sum[p] for p in members],circuit))
+    return(plan)
+
+
+def score_group(group,bits): # Per-shot energies of one group's measured (shots, M) bits
+    parity=(np.asarray(bits,dtype=np.int64)@group['masks'].T.astype(np.int64))&1
+    return((1.0-2.0*parity)@group['weights'])
+
+
+def distr_from_plan(plan,group_bits): # Single-shot energy distribution, one bit array per group (as distr_from_bits)
+    return(sum(score_group(g,b) for g,b in zip(plan,group_bits)))
+
+
+def sample_plan(plan,angles,num_shots=10**4,backend='numpy'): # Runs state_prep(angles) + each group's circuit
+    from backends import get_backend
+    backend=get_backend(backend)
+    return([backend.sample_circuit(angles,g['circuit'],num_shots) for g in plan])
+
+
+def plan_expectation(plan,state): # Exact <H> from a flat statevector (dense, small M)
+    from backends import apply_circuit, index_bits
+    M=state.size.bit_length()-1
+    outcomes=index_bits(np.arange(state.size),M)
+    total=0.0
+    for g in plan:
+        T=np.array(state,dtype=complex).reshape((2,)*M)
+        apply_circuit(T,g['circuit'])
+        total+=float(np.sum(np.abs(T.reshape(-1))**2*score_group(g,outcomes)))
+    return(total)
+
+
+def pauli_matrix(pauli_sum,M): # Dense 2^M x 2^M matrix of a Pauli sum (small M, for checks)
+    mats={'I':np.eye(2),'X':np.array([[0,1],[1,0]]),'Y':np.array([[0,-1j],[1j,0]]),'Z':np.diag([1,-1])}
+    out=np.zeros((1<<M,1<<M),dtype=complex)
+    for p,c in pauli_sum.items():
+        term=np.ones((1,1))
+        for ch in p:
+            term=np.kron(term,mats[ch])
+        out+=c*term
+    return(out)
+
+
+def _term(M,ops): # Pauli string with the given {qubit: letter}
+    return(''.join(ops.get(q,'I') for q in range(M)))
+
+
+def lmg_pauli_sum(M,V,W,nua,nub):
+    # The unary-encoded LMG Hamiltonian as a Pauli sum, from the analyzer coefficients. Clique 1 holds the Z and ZZ
+    # terms, clique 2 the Xs, and the clique 3/4 circuit H(k+1) CNOT(k,k+1) H(k) measures X_k Z_(k+1) on qubit k and
+    # Z_k X_(k+1) on qubit k+1.
+    weights=clique_weights(M,V,W,nua,nub)
+    out={}
+    def add(p,c):
+        if c!=0:
+            out[p]=out.get(p,0.0)+float(c)
+    const,lin,pair=weights[0]
+    add('I'*M,const)
+    for j in range(M):
+        add(_term(M,{j:'Z'}),lin[j])
+    for j in range(M-1):
+        add(_term(M,{j:'Z',j+1:'Z'}),pair[j])
+    for j in range(M):
+        add(_term(M,{j:'X'}),weights[1][1][j])
+    for c,start in zip(range(2,num_cliques(M)),(0,1)):
+        lin=weights[c][1]
+        for j in range(start,M-1,2):
+            add(_term(M,{j:'X',j+1:'Z'}),lin[j])
+            add(_term(M,{j:'Z',j+1:'X'}),lin[j+1])
+    return(out)
+
+
+def lmg_plan(M,V,W,nua,nub): # The hand-written four cliques (lmg.clique_basis_change) expressed as a measurement plan
+    pauli_sum=lmg_pauli_sum(M,V,W,nua,nub)
+    plan=[]
+    for c in range(1,num_cliques(M)+1):
+        if c==1:
+            members=[p for p in pauli_sum if set(p)<={'I','Z'}]
+            circuit=[]
+        elif c==2:
+            members=[p for p in pauli_sum if set(p)=={'I','X'} or set(p)=={'X'}]
+            circuit=[('h',(k,)) for k in range(M)]
+        else:
+            members=[p for p in pauli_sum if 'X' in p and 'Z' in p and (p.index('X')+p.index('Z')-1)//2%2==c-3]
+            circuit=[]
+            for k in range(c-3,M-1,2):
+                circuit+=[('h',(k+1,)),('cnot',(k,k+1)),('h',(k,))]
+        plan.append(make_group(members,[pauli_sum[p] for p in members],circuit))
+    return(plan)
+
+
+def unary_block(matrix,M): # The (M+1)x(M+1) block on the unary states, in state_finder_fock order
+    from verify import unary_indices
+    idx=unary_indices(M)
+    return(matrix[np.ix_(idx,idx)])
+
+
+def lmg_regression_check(M,V,W,nua,nub,energy_level=0,shots=10**4,mode='full',seed=None):
+    '''
+    Checks the engine against the hand-written LMG setup:
+    'hamiltonian': largest deviation of the Pauli sum's unary block from ham_maker (M <= 10, else None);
+    'groups': number of groups the automatic plan needs (the hand-written setup uses num_cliques(M));
+    'scoring': largest deviation between lmg_plan scoring and distr_from_bits on the same sampled clique bits;
+    'exact': the automatic plan's exact <H> minus the state_finder_fock eigenvalue (M <= 14, else None);
+    'estimate', 'std_error': a shot estimate through the automatic plan, and 'target'.
+    '''
+    from backends import NumpyBackend
+    from analyzer import distr_from_bits
+    from state_generator import ham_maker, state_finder_fock, angle_finder
+    pauli_sum=lmg_pauli_sum(M,V,W,nua,nub)
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,energy_level)
+    angs=angle_finder(targ_state)
+    backend=NumpyBackend(seed=seed)
+    out={'target':float(targ_val)}
+    out['hamiltonian']=None
+    if M<=10:
+        out['hamiltonian']=float(np.max(np.abs(unary_block(pauli_matrix(pauli_sum,M),M)-ham_maker(M,V,W,nua,nub))))
+    clique_bits=[backend.sample_clique(angs,c,shots) for c in range(1,num_cliques(M)+1)]
+    hand=lmg_plan(M,V,W,nua,nub)
+    out['scoring']=float(np.max(np.abs(distr_from_plan(hand,clique_bits)-distr_from_bits(V,W,nua,nub,clique_bits))))
+    plan=measurement_plan(pauli_sum,mode)
+    out['groups']=len(plan)
+    out['exact']=float(plan_expectation(plan,backend.statevector(angs))-targ_val) if M<=14 else None
+    distr=distr_from_plan(plan,sample_plan(plan,angs,shots,backend))
+    out['estimate']=float(np.mean(distr))
+    out['std_error']=float(np.std(distr)/np.sqrt(shots))
+    return(out)
@@ -0,0 +1,63 @@
+# In-memory end-to-end pipeline: eigensolve -> angles -> circuits -> sampled shots -> <H> estimate.
+# Shots are handed from total_circuit_runner to the analyzer as (shots, M) bit arrays, so no text file is written
+# and read back for every point. Writing the shots out is optional and uses a unique name by default,
+# so several experiments can run side by side in the same directory.
+import os
+import uuid
+import numpy as np
+from lmg import total_circuit_runner
+from analyzer import distr_from_bits
+from state_generator import state_finder_fock, angle_finder
+
+
+def unique_shot_name(prefix='shots'): # A file name (without .txt) that no other process will pick
+    return(f'{prefix}_{os.getpid()}_{uuid.uuid4().hex[:8]}')
+
+
+def sample_cliques(angles,num_shots=10**4,out_file_name=None,backend=None):
+    # Runs the clique circuits and returns one (num_shots, M) uint8 array per clique.
+    # out_file_name=True writes the usual text file under a fresh unique_shot_name(); a string writes to that name.
+    # backend is passed on to total_circuit_runner (None is the dwave.gate reference, 'numpy' the fast simulator).
+    if out_file_name is True:
+        out_file_name=unique_shot_name()
+    return(total_circuit_runner(angles,out_file_name,num_shots,backend,as_bits=True))
+
+
+def run_point(M,V,W,nua,nub,energy_level=0,shots=10**4,out_file_name=None,backend=None):
+    '''
+    Simulates the energy_levelth eigenstate of the described LMG Hamiltonian and estimates its eigenvalue.
+    Returns {'target','state','angles','clique_bits','distr','mean','std_error','file'} where file is the
+    name the shots were written under (None unless out_file_name was given). backend selects the simulator, see backends.py.
+    '''
+    if out_file_name is True:
+        out_file_name=unique_shot_name()
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,energy_level)
+    angs=angle_finder(targ_state)
+    clique_bits=sample_cliques(angs,shots,out_file_name,backend)
+    distr=distr_from_bits(V,W,nua,nub,clique_bits)
+    return({'target':targ_val,'state':targ_state,'angles':angs,'clique_bits':clique_bits,'distr':distr,
+            'mean':float(np.mean(distr)),'std_error':float(np.std(distr)/np.sqrt(shots)),'file':out_file_name})
+
+
+def run_batch(M,problems,shots=10**4,backend='numpy',max_batch_bytes=1<<28):
+    '''
+    Batched run_point for many problems sharing M. problems is a list of (V, W, nua, nub, energy_level) tuples.
+    All the states are prepared, basis-changed and sampled together (see backends.run_cliques_batch), in groups sized
+    so that one group's statevectors stay under max_batch_bytes. Returns a list of run_point-style dicts.
+    '''
+    from backends import run_cliques_batch
+    targets=[state_finder_fock(M,V,W,nua,nub,level) for V,W,nua,nub,level in problems]
+    angle_rows=np.array([angle_finder(targ_state) for targ_val,targ_state in targets])
+    group=max(1,max_batch_bytes//(16<<M))
+    results=[]
+    for start in range(0,len(problems),group):
+        clique_bits=run_cliques_batch(angle_rows[start:start+group],shots,backend)
+        for j in range(len(clique_bits[0])):
+            V,W,nua,nub,level=problems[start+j]
+            targ_val,targ_state=targets[start+j]
+            bits=[cb[j] for cb in clique_bits]
+            distr=distr_from_bits(V,W,nua,nub,bits)
+            results.append({'target':targ_val,'state':targ_state,'angles':angle_rows[start+j],'clique_bits':bits,
+                            'distr':distr,'mean':float(np.mean(distr)),'std_error':float(np.std(distr)/np.sqrt(shots)),
+                            'file':None})
+    return(results)
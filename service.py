@@ -0,0 +1,208 @@
+# Asynchronous circuit submission.
+# A circuit service takes jobs and hands back results later, the way a remote gate-model service with a queue would.
+# AsyncBackend wraps a service with submit/result futures, a concurrency limit and retries, so that the classical work
+# of many points (eigensolve, angles, scoring) runs while their circuits are pending.
+# LocalService is an offline stand-in: it runs jobs on a backends.py simulator in worker threads after an injected
+# queue latency, and can fail jobs at random to exercise the retry path.
+# JobPacker sits in front of an AsyncBackend and collects the clique circuits of many points into one packed job
+# (a manifest of circuits), so per-job overhead is paid once per batch rather than once per clique.
+#
+# service=LocalService(latency=0.5,jitter=0.2,failure_rate=0.05)
+# results,info=run_points([(4,3.0,1.2,0,1,0),(5,2.0,-1.0,1,0,1)],shots=10**4,service=service,max_concurrency=16)
+# results,info=run_points(problems,shots=10**4,service=service,pack=256) # up to 256 circuits per job
+import time
+import asyncio
+import itertools
+import numpy as np
+from analyzer import num_cliques, distr_from_bits
+from state_generator import state_finder_fock, angle_finder
+
+
+class ServiceError(Exception): # A job the service reports as failed (worth retrying)
+    pass
+
+
+class LocalService:
+    '''
+    In-process stand-in for a remote circuit service.
+    A job is {'angles': [...], 'clique': c, 'shots': n}; its result is the (shots, M) bit array.
+    A packed job is {'manifest': [job, job, ...]}; its result is the list of their bit arrays in manifest order.
+    Circuits in a packed job that share (M, clique, shots) are simulated together as one batch.
+    Each job waits latency (+ uniform jitter) seconds in the "queue", then fails with probability failure_rate or
+    runs on a fresh backend in a worker thread. stats counts submitted, completed and failed jobs.
+    '''
+    def __init__(self,backend='numpy',latency=0.5,jitter=0.0,failure_rate=0.0,seed=None):
+        self.backend=backend
+        self.latency=latency
+        self.jitter=jitter
+        self.failure_rate=failure_rate
+        self.rng=np.random.default_rng(seed)
+        self.ids=itertools.count()
+        self.jobs={}
+        self.stats={'submitted':0,'completed':0,'failed':0}
+
+    def execute(self,job): # Runs one job synchronously
+        from backends import get_backend
+        backend=get_backend(self.backend)
+        if hasattr(backend,'rng'):
+            backend.rng=np.random.default_rng(job['seed'])
+        if 'manifest' not in job:
+            return(backend.sample_clique(job['angles'],job['clique'],job['shots']))
+        manifest=job['manifest']
+        groups={}
+        for i,circ in enumerate(manifest):
+            groups.setdefault((len(circ['angles']),circ['clique'],circ['shots']),[]).append(i)
+        results=[None]*len(manifest)
+        for (M,clique,shots),members in groups.items():
+            angle_rows=np.array([manifest[i]['angles'] for i in members])
+            if hasattr(backend,'sample_clique_batch'):
+                bits=backend.sample_clique_batch(angle_rows,clique,shots)
+            else:
+                bits=[backend.sample_clique(a,clique,shots) for a in angle_rows]
+            for i,b in zip(members,bits):
+                results[i]=b
+        return(results)
+
+    async def _run(self,job):
+        await asyncio.sleep(self.latency+self.jitter*self.rng.random())
+        if self.rng.random()<self.failure_rate:
+            self.stats['failed']+=1
+            raise ServiceError('job failed in the queue')
+        result=await asyncio.to_thread(self.execute,job)
+        self.stats['completed']+=1
+        return(result)
+
+    async def submit(self,job): # Returns a job id straight away
+        job=dict(job,seed=int(self.rng.integers(2**63)))
+        job_id=next(self.ids)
+        self.jobs[job_id]=asyncio.ensure_future(self._run(job))
+        self.stats['submitted']+=1
+        return(job_id)
+
+    async def result(self,job_id): # Waits for a job and returns its result (raises ServiceError if it failed)
+        try:
+            return(await self.jobs[job_id])
+        finally:
+            del self.jobs[job_id]
+
+
+class AsyncBackend:
+    '''
+    Future-based client for a circuit service. At most max_concurrency jobs are in flight; a job that fails or
+    exceeds timeout seconds is resubmitted up to retries times with exponential backoff.
+    '''
+    def __init__(self,service,max_concurrency=8,retries=3,backoff=0.1,timeout=None):
+        self.service=service
+        self.max_concurrency=max_concurrency
+        self.retries=retries
+        self.backoff=backoff
+        self.timeout=timeout
+        self._sem=None
+        self.retried=0
+
+    def _semaphore(self): # Made on first use so that it belongs to the running event loop
+        if self._sem is None:
+            self._sem=asyncio.Semaphore(self.max_concurrency)
+        return(self._sem)
+
+    async def run(self,job):
+        async with self._semaphore():
+            for attempt in range(self.retries+1):
+                try:
+                    job_id=await self.service.submit(job)
+                    return(await asyncio.wait_for(self.service.result(job_id),self.timeout))
+                except (ServiceError,asyncio.TimeoutError):
+                    if attempt==self.retries:
+                        raise
+                    self.retried+=1
+                    await asyncio.sleep(self.backoff*2**attempt)
+
+    def submit(self,angles,clique,num_shots): # Future for one clique's (shots, M) bits
+        job={'angles':[float(a) for a in angles],'clique':clique,'shots':num_shots}
+        return(asyncio.ensure_future(self.run(job)))
+
+    async def sample_cliques(self,angles,num_shots): # All of a point's cliques, submitted together
+        futures=[self.submit(angles,c,num_shots) for c in range(1,num_cliques(len(angles))+1)]
+        return(list(await asyncio.gather(*futures)))
+
+
+class JobPacker:
+    '''
+    Collects circuits from many concurrent sample_cliques calls and sends them to backend (an AsyncBackend) as packed
+    jobs of at most max_circuits, demultiplexing each job's results back to the calls that contributed to it.
+    A partly filled job goes out max_wait seconds after its first circuit arrived. Drop-in for AsyncBackend in
+    run_point_async.
+    '''
+    def __init__(self,backend,max_circuits=256,max_wait=0.05):
+        self.backend=backend
+        self.max_circuits=max_circuits
+        self.max_wait=max_wait
+        self.pending=[] # (circuit, future) not yet sent
+        self.timer=None
+        self.jobs=0
+
+    def flush(self): # Sends everything pending, in jobs of at most max_circuits
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer=None
+        while self.pending:
+            batch=self.pending[:self.max_circuits]
+            del self.pending[:self.max_circuits]
+            job=asyncio.ensure_future(self.backend.run({'manifest':[circ for circ,fut in batch]}))
+            job.add_done_callback(lambda job,futures=[fut for circ,fut in batch]: self._demux(job,futures))
+            self.jobs+=1
+
+    def _demux(self,job,futures):
+        if job.cancelled() or job.exception() is not None:
+            exc=job.exception() if not job.cancelled() else asyncio.CancelledError()
+            for fut in futures:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        for fut,bits in zip(futures,job.result()):
+            if not fut.done():
+                fut.set_result(bits)
+
+    async def sample_cliques(self,angles,num_shots):
+        loop=asyncio.get_running_loop()
+        futures=[]
+        for c in range(1,num_cliques(len(angles))+1):
+            futures.append(loop.create_future())
+            self.pending.append(({'angles':[float(a) for a in angles],'clique':c,'shots':num_shots},futures[-1]))
+        if len(self.pending)>=self.max_circuits:
+            self.flush()
+        elif self.timer is None:
+            self.timer=loop.call_later(self.max_wait,self.flush)
+        return(list(await asyncio.gather(*futures)))
+
+
+async def run_point_async(M,V,W,nua,nub,energy_level,shots,backend):
+    # run_point with the circuits going through an AsyncBackend. The eigensolve and angles run before the
+    # jobs go out and the scoring after they return, in worker threads so the event loop keeps submitting and
+    # collecting other points' jobs meanwhile.
+    targ_val,targ_state=await asyncio.to_thread(state_finder_fock,M,V,W,nua,nub,energy_level)
+    angs=await asyncio.to_thread(angle_finder,targ_state)
+    clique_bits=await backend.sample_cliques(angs,shots)
+    distr=await asyncio.to_thread(distr_from_bits,V,W,nua,nub,clique_bits)
+    return({'target':targ_val,'state':targ_state,'angles':angs,'clique_bits':clique_bits,'distr':distr,
+            'mean':float(np.mean(distr)),'std_error':float(np.std(distr)/np.sqrt(shots)),'file':None})
+
+
+async def run_points_async(problems,shots,backend):
+    return(list(await asyncio.gather(*[run_point_async(*p,shots,backend) for p in problems])))
+
+
+def run_points(problems,shots=10**4,service=None,max_concurrency=8,retries=3,timeout=None,pack=None):
+    '''
+    Runs many (M, V, W, nua, nub, energy_level) problems against a circuit service (a LocalService with default
+    settings if none is given). Returns (results, info): the run_point-style dicts in input order and
+    {'seconds','retried','service'} with the wall time, the number of resubmissions and the service's job counts.
+    pack=n packs up to n circuits into each job (see JobPacker) instead of sending one job per clique.
+    '''
+    service=LocalService() if service is None else service
+    client=AsyncBackend(service,max_concurrency,retries,timeout=timeout)
+    backend=client if pack is None else JobPacker(client,pack)
+    start=time.perf_counter()
+    results=asyncio.run(run_points_async(problems,shots,backend))
+    info={'seconds':time.perf_counter()-start,'retried':client.retried,'service':dict(getattr(service,'stats',{}))}
+    return(results,info)
@@ -0,0 +1,157 @@
+# Shot blocks shared between processes without copying.
+# Shots from a simulation worker are written once, bit-packed (np.packbits rows, qubit 0 in the high bit), into a
+# (num_cliques, shots, ceil(M/8)) uint8 block in multiprocessing.shared_memory, or in a memory-mapped file when a
+# directory is given (e.g. on a node-local SSD, or for blocks larger than /dev/shm).
+# Only the descriptor, a small dict {'kind','name','M','shots','num_cliques'}, travels between processes; analysis
+# workers attach to the block and score the packed bytes in place (analyzer.oeater_packed), so no shot data is pickled.
+#
+# results=run_points_shared([(12,3.0,1.2,0,1,0),(14,2.0,-1.0,1,0,1)],shots=10**6,processes=4)
+#
+# Whoever creates a block releases it (close and unlink); other processes only close. Numpy views taken from
+# block.packed must be dropped before close.
+import os
+import uuid
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from analyzer import num_cliques, clique_weights, packed_weights, oeater_packed
+
+
+class SharedShots:
+    def __init__(self,desc,create=False):
+        self.desc=dict(desc)
+        self.created=create
+        shape=(desc['num_cliques'],desc['shots'],(desc['M']+7)//8)
+        self._shm=None
+        if desc['kind']=='shm':
+            self._shm=shared_memory.SharedMemory(name=desc['name'],create=create,size=max(int(np.prod(shape)),1))
+            self.packed=np.ndarray(shape,dtype=np.uint8,buffer=self._shm.buf)
+        elif desc['kind']=='mmap':
+            self.packed=np.memmap(desc['name'],dtype=np.uint8,mode='w+' if create else 'r+',shape=shape)
+        else:
+            raise ValueError(f'Unknown block kind {desc["kind"]!r}, use shm or mmap')
+
+    @classmethod
+    def create(cls,M,shots,directory=None): # A new block for all the cliques M needs
+        name=f'lmg_{uuid.uuid4().hex[:16]}'
+        desc={'kind':'shm','name':name,'M':int(M),'shots':int(shots),'num_cliques':num_cliques(M)}
+        if directory is not None:
+            desc.update({'kind':'mmap','name':os.path.join(directory,name+'.shots')})
+        return(cls(desc,create=True))
+
+    @classmethod
+    def attach(cls,desc):
+        return(cls(desc))
+
+    def write(self,clique_index,bits,start=0,block=1<<16): # Packs (n, M) bits into shots start..start+n of a clique
+        for s in range(0,bits.shape[0],block):
+            self.packed[clique_index,start+s:start+s+block]=np.packbits(bits[s:s+block],axis=1)
+
+    def read(self,clique_index,start=0,stop=None): # Unpacked (n, M) copy, for code that wants plain bit arrays
+        return(np.unpackbits(self.packed[clique_index,start:stop],axis=1,count=self.desc['M']))
+
+    def clique_bits(self):
+        return([self.read(c) for c in range(self.desc['num_cliques'])])
+
+    def close(self):
+        if isinstance(self.packed,np.memmap):
+            self.packed.flush()
+        self.packed=None
+        if self._shm is not None:
+            self._shm.close()
+
+    def unlink(self):
+        if self._shm is not None:
+            self._shm.unlink()
+        elif os.path.exists(self.desc['name']):
+            os.remove(self.desc['name'])
+
+    def release(self): # close and unlink
+        self.close()
+        self.unlink()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,exc_type,exc,tb):
+        if self.created:
+            self.release()
+        else:
+            self.close()
+        return(False)
+
+
+def score_block(V,W,nua,nub,desc,start=0,stop=None,num_bins=200):
+    # Scores shots start..stop of a shared block in place into a histogram.EnergyHistogram (small, so it is cheap to
+    # send back and merges exactly with the other ranges of the same problem)
+    from histogram import histogram_for
+    block=SharedShots.attach(desc)
+    try:
+        M=desc['M']
+        pweights=[packed_weights(w,M) for w in clique_weights(M,V,W,nua,nub)[:desc['num_cliques']]]
+        hist=histogram_for(M,V,W,nua,nub,num_bins)
+        stop=desc['shots'] if stop is None else stop
+        for s in range(start,stop,1<<16):
+            e=min(s+(1<<16),stop)
+            hist.add(sum(oeater_packed(pw,block.packed[c,s:e]) for c,pw in enumerate(pweights)))
+    finally:
+        block.close()
+    return(hist)
+
+
+def simulate_into(problem,shots,desc,backend='numpy'): # Samples every clique of one problem straight into a block
+    from backends import get_backend
+    from state_generator import state_finder_fock, angle_finder
+    M,V,W,nua,nub,level=problem
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,level)
+    angs=angle_finder(targ_state)
+    backend=get_backend(backend)
+    block=SharedShots.attach(desc)
+    try:
+        for c in range(desc['num_cliques']):
+            block.write(c,backend.sample_clique(angs,c+1,shots))
+    finally:
+        block.close()
+    return({'target':targ_val,'angles':angs})
+
+
+def _simulate_task(args):
+    return(simulate_into(*args))
+
+
+def _score_task(args):
+    return(score_block(*args))
+
+
+def run_points_shared(problems,shots=10**4,processes=None,backend='numpy',directory=None,split=1<<18,keep=False):
+    '''
+    Runs (M, V, W, nua, nub, energy_level) problems on a process pool: simulation workers write their shots into
+    shared blocks, then analysis workers score ranges of split shots of each block in place. Only descriptors and
+    histograms cross process boundaries. Returns run_point-style dicts {'target','angles','mean','std_error',
+    'histogram'}; with keep=True each also has 'block', a SharedShots the caller must release().
+    '''
+    blocks=[SharedShots.create(p[0],shots,directory) for p in problems]
+    try:
+        with ProcessPoolExecutor(processes) as pool:
+            sims=list(pool.map(_simulate_task,[(tuple(p),shots,b.desc,backend) for p,b in zip(problems,blocks)]))
+            ranges=[(j,s,min(s+split,shots)) for j in range(len(problems)) for s in range(0,shots,split)]
+            hists=list(pool.map(_score_task,[(*problems[j][1:5],blocks[j].desc,s,e) for j,s,e in ranges]))
+        results=[]
+        for j,sim in enumerate(sims):
+            parts=[h for (k,s,e),h in zip(ranges,hists) if k==j]
+            hist=parts[0]
+            for h in parts[1:]:
+                hist.merge(h)
+            res=dict(sim)
+            res.update({'mean':hist.mean(),'std_error':hist.std_error(),'histogram':hist})
+            if keep:
+                res['block']=blocks[j]
+            results.append(res)
+    except BaseException:
+        keep=False
+        raise
+    finally:
+        if not keep:
+            for b in blocks:
+                b.release()
+    return(results)
@@ -1,8 +1,9 @@
 # This will take in M, V, W, nua, nub and energy level and then output the angles required for the state and the expectation value
 import numpy as np
+from instrument import instrumented
 
 
-def ham_maker(M,V,W,nua,nub): # Will generate the LMG Hamiltonian matrix in the Fock basis
+def ham_diagonals(M,V,W,nua,nub): # Main and off diagonal of the tridiagonal LMG Hamiltonian (see ham_maker)
     ## Tested for a few values of M against Mathematica quickham[]. Agrees.
     main_diagonal=[(-4*k+2*M-nua+nub)/2+(W*(2*k+nua)*(2*M+nub-2*k))/(2*M+nua+nub)+W/2 for k in range(M,-1,-1)] # works best with (M,-1,-1)
     off_diag=[V/(2*(2*M+nua+nub))*np.sqrt((nub+2*k+1)*(nub+2*k+2)*(2*M+nua-2*k)*(2*M+nua-2*k-1)) for k in range(0,M)] # works best as (0,M)
@@ -10,10 +11,16 @@ def ham_maker(M,V,W,nua,nub): # Will generate the LMG Hamiltonian matrix in the
     # print(str(main_diagonal)+'\n')
     # print("Off diag is")
     # print(off_diag)
+    return(np.array(main_diagonal,dtype=float),np.array(off_diag,dtype=float))
+
+
+def ham_maker(M,V,W,nua,nub): # Will generate the LMG Hamiltonian matrix in the Fock basis
+    main_diagonal,off_diag=ham_diagonals(M,V,W,nua,nub)
     return(np.diag(main_diagonal, 0) + np.diag(off_diag, -1) + np.diag(off_diag, 1))
 
 
 
+@instrumented('state_finder_fock',lambda a,r: {'M':a['M']})
 def state_finder_fock(M,V,W,nua,nub,energy_level): # Given a hamiltonian matrix, find the (energy_level)th eigenstate and eigenvalue
     if energy_level>=M or energy_level<0:
         print("Desired energy level is not within eigenspectrum of model. Please choose a value from 0 to M-1.")
@@ -26,6 +33,7 @@ def state_finder_fock(M,V,W,nua,nub,energy_level): # Given a hamiltonian matrix,
         eigvecs=np.transpose(eigvecs)
         return((eigvals[energy_level],eigvecs[energy_level])) # Returns a tuple of (eigenvalue, normalized eigenvector)
 
+@instrumented('angle_finder',lambda a,r: {'M':len(r)})
 def angle_finder(inp_state): # Given an eigenstate to prepare, it outputs the necessary angles for the circuit.
     # Eigenvectors and -values seem to agree with Mathematica...
     inp_state=list(inp_state)
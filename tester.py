@@ -1,11 +1,7 @@
-import dwave.gate.operations as gt
-from dwave.gate import Circuit
-import dwave.gate.simulator
 import numpy as np
 import random as ra
-from lmg import total_circuit_runner, state_prep
-from state_generator import state_finder_fock, angle_finder, ham_maker
-from analyzer import distrfinder
+from verify import verify_state
+from state_generator import state_finder_fock, angle_finder
 
 # What's wrong (5-18-2023)?
 # -- The estimated value of <H> is too far off in too many trials.
@@ -26,36 +22,90 @@ from analyzer import distrfinder
 # # Some of the states' coefficients were negative when they should be positive. Fixed as of 5-18-2023
 # # Even with 1000 randomly generated problems, the output state agreed with the target state to 10 decimal places.
 
-inc_len=0
-inc_vals=0
-for j in range(1000):
-  vals = []
-  M = ra.randint(1, 10)
-  V = ra.uniform(0.1, 10)
-  W = V*ra.random()*(-1)*(-1)**ra.randint(0, 1)
-  nua = ra.randint(0, 1)
-  nub = ra.randint(0, 1)
-  # shots=10**4
-  targ_val, targ_state = state_finder_fock(M, V, W, nua, nub, 0)
+def check_states(num_checks=1000): # Compares the circuit's output state with the target state for random problems
+  # verify_state gathers only the M+1 unary amplitudes instead of scanning all 2^M entries.
+  # See verify.random_problem_check for the batched version.
+  inc_len=0
+  inc_vals=0
+  for j in range(num_checks):
+    M = ra.randint(1, 10)
+    V = ra.uniform(0.1, 10)
+    W = V*ra.random()*(-1)*(-1)**ra.randint(0, 1)
+    nua = ra.randint(0, 1)
+    nub = ra.randint(0, 1)
+    # shots=10**4
+    targ_val, targ_state = state_finder_fock(M, V, W, nua, nub, 0)
+    angs = angle_finder(targ_state)
+    res = verify_state(angs, targ_state)
+    if res['leakage'] > 1e-10: # Weight outside the unary subspace
+      print('LEAKED STATE')
+      inc_len+=1
+    if res['max_dev'] >= 0.5e-5:
+      print('WRONG STATE')
+      inc_vals+=1
+  print(f'\n{inc_len} had weight outside the unary subspace\n')
+  print(f'\n{inc_vals} had the incorrect values\n')
+
+
+def check_pauli_backends(shots=20000,tol=4.0): # A plan with Y terms (S^dagger basis changes) on both backends
+  from pauli import measurement_plan, sample_plan, distr_from_plan, plan_expectation
+  from backends import NumpyBackend
+  targ_val, targ_state = state_finder_fock(3, 3.0, 1.2, 0, 1, 1)
   angs = angle_finder(targ_state)
-  out_state = dwave.gate.simulator.simulate(state_prep(angs))
-  out_state = np.flip(out_state)
-  out = []
-  for k in range(len(out_state)):
-      if np.round(out_state[k], 20) != 0.0j:
-          out.append(out_state[k])
-
-  # negq='negative'
-  # if W>=0:
-  #   negq='positive'
-  # if np.round(targ_state[1]+out[1],10)==0.j:
-  #    print(f'Sign error! W is {negq}\n')
-
-  for k in range(len(out)):
-      vals.append(np.round((out[k]-targ_state[k]), 5))
-  for entry in vals:
-      if entry!=0.0:
-          print('WRONG STATE')
-          inc_vals+=1
-print(f'\n{inc_len} had the incorrect length\n')
-print(f'\n{inc_vals} had the incorrect values\n')
+  plan = measurement_plan({'YYI':0.7,'XXZ':0.3,'ZIY':-0.4,'IYY':0.2},'qwc')
+  exact = plan_expectation(plan,NumpyBackend().statevector(angs))
+  ok = True
+  for backend in ('numpy','dwave'):
+    distr = distr_from_plan(plan,sample_plan(plan,angs,shots,backend))
+    se = np.std(distr)/np.sqrt(shots)
+    print(f'{backend}: {np.mean(distr):.4f} +/- {se:.4f}, exact {exact:.4f}')
+    ok = ok and abs(np.mean(distr)-exact)<=tol*se
+  return(ok)
+
+
+def check_follow_partial(shots=4000,tol=4.0): # The follower gives a finite estimate from a half-written shot file
+  import os, tempfile
+  from lmg import total_circuit_runner
+  from follower import ShotFollower
+  from analyzer import read_cliques, bits_from_strings, distr_from_bits
+  V,W,nua,nub=3.0,1.2,0,1
+  targ_val, targ_state = state_finder_fock(4, V, W, nua, nub, 1)
+  name = os.path.join(tempfile.mkdtemp(), 'follow')
+  total_circuit_runner(angle_finder(targ_state), name, shots, 'numpy')
+  with open(name+'.txt') as fo:
+    text = fo.read()
+  with open(name+'_part.txt','w') as fo:
+    fo.write(text[:len(text)//3]) # Cut off mid-line, as a run still being written would be
+  part = ShotFollower(V, W, nua, nub, name+'_part')
+  part.poll()
+  snap = part.snapshot()
+  full = ShotFollower(V, W, nua, nub, name)
+  full.poll()
+  distr = distr_from_bits(V, W, nua, nub, [bits_from_strings(c) for c in read_cliques(name)])
+  print(f'partial: {snap["estimate"]} +/- {snap["error"]} from {snap["shots"]} shots, target {targ_val:.4f}')
+  return(snap['estimate'] is not None and np.isfinite(snap['estimate']) and not snap['complete']
+         and abs(snap['estimate']-targ_val)<=tol*snap['error'] and full.done()
+         and abs(full.snapshot()['estimate']-np.mean(distr))<1e-9)
+
+def check_async_overlap(heavy_M=1500,latency=0.3): # Small points' jobs go out while a big point is still solving
+  import time, asyncio
+  from service import LocalService, AsyncBackend, run_point_async
+  start = time.perf_counter()
+  angle_finder(state_finder_fock(heavy_M, 3.0, 1.2, 0, 1, 0)[1])
+  classical = time.perf_counter()-start
+  client = AsyncBackend(LocalService('mps', latency=latency), max_concurrency=16)
+  async def finish_time(p):
+    await run_point_async(*p, 200, client)
+    return(time.perf_counter()-start)
+  async def run_all():
+    return(await asyncio.gather(finish_time((heavy_M,3.0,1.2,0,1,0)), *[finish_time((4,3.0,1.2,0,1,e)) for e in range(3)]))
+  start = time.perf_counter()
+  done = asyncio.run(run_all())
+  print(f'classical {classical:.2f}s, latency {latency}s: small points done after {max(done[1:]):.2f}s, big one after {done[0]:.2f}s')
+  return(max(done[1:])<latency+classical/2)
+
+if __name__=='__main__':
+  check_states()
+  print('Follower on a partial file:', 'ok' if check_follow_partial() else 'FAILED')
+  print('Async points overlap:', 'ok' if check_async_overlap() else 'FAILED')
+  print('Pauli plan on both backends:', 'ok' if check_pauli_backends() else 'FAILED')
@@ -0,0 +1,127 @@
+# Multi-fidelity triage of random problems, for failure hunting.
+# mult_test3/mult_test4 spend the full shot budget on every problem just to print the few that look wrong. Here each
+# problem is first screened cheaply, either exactly (per-clique means and variances of the real measurement, from the
+# simulated clique statevectors) or with a few hundred shots, and only suspicious ones get a full-shot run with the
+# same diagnostic printout as those functions.
+# A problem is suspicious when
+#   'state': the unary amplitudes of the prepared statevector differ from the target state (as in mult_test3/4), or
+#            weight leaks out of the unary subspace,
+#   'bias':  the measured <H> does not match the eigenvalue (exactly, or at z_threshold standard errors when screening
+#            with shots), or
+#   'risk':  a full-shot run would miss the target by rel_tol percent with probability above p_flag, which is how
+#            targets close to zero show up in mult_test3.
+import time
+import random as ra
+import numpy as np
+from statistics import NormalDist
+from state_generator import state_finder_fock, angle_finder
+from analyzer import distr_from_bits
+from verify import verify_state
+
+
+def random_problem(level='random',max_M=5): # Drawn like mult_test4 (mult_test3 uses level 0)
+    M=ra.randint(1,max_M)
+    V=ra.uniform(0.1,10)
+    W=V*ra.random()*(-1)**ra.randint(0,1)
+    return({'M':M,'V':V,'W':W,'nua':ra.randint(0,1),'nub':ra.randint(0,1),
+            'level':ra.randint(0,M-1) if level=='random' else level})
+
+
+def exact_moments(V,W,nua,nub,angles): # Exact mean and single-shot standard deviation of the clique measurement
+    from energy_distribution import clique_spectra_exact
+    mean=0.0
+    var=0.0
+    for energies,probs in clique_spectra_exact(V,W,nua,nub,angles):
+        m=float(probs@energies)
+        mean+=m
+        var+=float(probs@(energies-m)**2) # The cliques are sampled independently, so variances add
+    return(mean,np.sqrt(var))
+
+
+def screen(problem,shots=10**4,mode='exact',screen_shots=300,rel_tol=5.0,z_threshold=3.0,p_flag=0.05,backend='numpy'):
+    '''
+    Cheap first look at one problem. Returns the problem dict extended with 'target', 'angles', 'target_state',
+    'verify', 'mean', 'sigma' (single-shot spread), 'reasons' (list of the flags above) and 'suspicious'.
+    shots is the budget of the full run the risk flag is computed for.
+    '''
+    out=dict(problem)
+    M,V,W,nua,nub=problem['M'],problem['V'],problem['W'],problem['nua'],problem['nub']
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,problem['level'])
+    angs=angle_finder(targ_state)
+    from backends import NumpyBackend
+    ver=verify_state(angs,targ_state,state=NumpyBackend(dtype=np.float64).statevector(angs)) # The circuit, not the formula
+    reasons=[]
+    if ver['max_dev']>=0.5e-5 or ver['leakage']>=1e-10:
+        reasons.append('state')
+    if mode=='exact':
+        mean,sigma=exact_moments(V,W,nua,nub,angs)
+        if abs(mean-targ_val)>1e-8*max(1.0,abs(targ_val)):
+            reasons.append('bias')
+    elif mode=='shots':
+        from backends import run_cliques
+        distr=distr_from_bits(V,W,nua,nub,run_cliques(angs,screen_shots,backend))
+        mean=float(np.mean(distr))
+        sigma=float(np.std(distr))
+        if abs(mean-targ_val)>z_threshold*sigma/np.sqrt(screen_shots):
+            reasons.append('bias')
+    else:
+        raise ValueError(f'Unknown screening mode {mode!r}, use exact or shots')
+    if targ_val==0 or 2*(1-NormalDist().cdf(rel_tol/100*abs(targ_val)/max(sigma/np.sqrt(shots),1e-300)))>p_flag:
+        reasons.append('risk')
+    out.update({'target':float(targ_val),'angles':angs,'target_state':targ_state,'verify':ver,'mean':mean,
+                'sigma':sigma,'reasons':reasons,'suspicious':len(reasons)>0})
+    return(out)
+
+
+def escalate(case,shots=10**4,verbose=True): # Full-shot run of a screened case with the mult_test3/4 printout
+    from pipeline import sample_cliques
+    M,V,W,nua,nub=case['M'],case['V'],case['W'],case['nua'],case['nub']
+    targ_val=case['target']
+    distr=distr_from_bits(V,W,nua,nub,sample_cliques(case['angles'],shots))
+    ver=verify_state(case['angles'],case['target_state'])
+    mean=float(np.mean(distr))
+    unc=float(np.std(distr)/np.sqrt(shots))
+    rel_error=abs(np.round(100*(mean-targ_val)/targ_val,2)) if targ_val!=0 else float('inf')
+    out=dict(case)
+    out.update({'full_mean':mean,'std_error':unc,'rel_error':rel_error,'within_se':bool(mean-unc<=targ_val<=mean+unc)})
+    if verbose:
+        print(f'\nFlagged by screening: {", ".join(case["reasons"])}')
+        print(f'Target value is {np.round(targ_val,5)}')
+        print(f'<H> estimate is {np.round(mean,5)}')
+        print(f'Error is {rel_error}%')
+        print(f'Standard error is {np.round(unc,3)}')
+        print(f'<H> estimate is {np.round(abs((mean-targ_val)/unc),1)} standard errors from target value ')
+        print(f'M= {M}')
+        print(f'V= {V}')
+        print(f'W= {W}')
+        print(f'nua= {nua}')
+        print(f'nub= {nub}')
+        if ver['max_dev']<0.5e-5:
+            print('Target state equals output state from circuit')
+        else:
+            print(list(case['target_state']))
+            print(list(ver['amplitudes']))
+        print()
+    return(out)
+
+
+def triage(num_tests,shots=10**4,mode='exact',screen_shots=300,level='random',max_M=5,rel_tol=5.0,z_threshold=3.0,
+           p_flag=0.05,verbose=True):
+    '''
+    Screens num_tests random problems and escalates only the suspicious ones to a full-shot run.
+    Returns {'screened','escalated','cases' (the escalated results),'screen_seconds','escalate_seconds',
+    'shots_used'} where shots_used counts shots per clique across both stages.
+    '''
+    start=time.perf_counter()
+    flagged=[]
+    for j in range(num_tests):
+        case=screen(random_problem(level,max_M),shots,mode,screen_shots,rel_tol,z_threshold,p_flag)
+        if case['suspicious']:
+            flagged.append(case)
+    mid=time.perf_counter()
+    cases=[escalate(case,shots,verbose) for case in flagged]
+    end=time.perf_counter()
+    if verbose:
+        print(f'Screened {num_tests} problems ({mode}), escalated {len(cases)} to {shots} shots.')
+    return({'screened':num_tests,'escalated':len(cases),'cases':cases,'screen_seconds':mid-start,
+            'escalate_seconds':end-mid,'shots_used':(num_tests*screen_shots if mode=='shots' else 0)+len(cases)*shots})
@@ -0,0 +1,102 @@
+# Sequential (early-stopping) validation of success rates.
+# mult_test and step_mult_test run a fixed number of trials and then report the fraction whose estimate landed within
+# one standard error of the known eigenvalue. That fraction is a binomial proportion, so a configuration can stop as soon
+# as the evidence is conclusive: either a Wald SPRT between a "good" and a "bad" rate, or a Wilson score interval that
+# is tight enough or lies clearly above/below the target.
+import numpy as np
+import random as ra
+from statistics import NormalDist
+from state_generator import state_finder_fock, angle_finder
+from pipeline import sample_cliques, run_batch
+from analyzer import distr_from_bits
+
+ONE_SE_RATE=0.6827 # Chance that a Gaussian estimate lands within one standard error of the truth
+
+
+def wilson_interval(successes,trials,confidence=0.95): # Wilson score interval for a binomial proportion
+    if trials==0:
+        return((0.0,1.0))
+    z=NormalDist().inv_cdf(0.5+confidence/2)
+    p=successes/trials
+    denom=1+z**2/trials
+    centre=(p+z**2/(2*trials))/denom
+    half=z*np.sqrt(p*(1-p)/trials+z**2/(4*trials**2))/denom
+    return((float(max(0.0,centre-half)),float(min(1.0,centre+half))))
+
+
+def sprt_llr(successes,trials,p0,p1): # Log likelihood ratio of rate p1 against rate p0
+    return(successes*np.log(p1/p0)+(trials-successes)*np.log((1-p1)/(1-p0)))
+
+
+def sprt_thresholds(alpha=0.05,beta=0.05): # Wald's (lower, upper) LLR thresholds
+    return((np.log(beta/(1-alpha)),np.log((1-beta)/alpha)))
+
+
+def sequential_rate(trial_fn,target=ONE_SE_RATE,method='wilson',tolerance=0.05,margin=0.1,confidence=0.95,
+                    alpha=0.05,beta=0.05,min_trials=10,max_trials=1000):
+    '''
+    Calls trial_fn() (which returns True for a success) until the success rate is settled.
+    method='wilson': 'fail' when the Wilson upper bound drops below target-margin, 'pass' when the lower bound
+        reaches target-margin and 'converged' when the interval half-width is at most tolerance.
+    method='sprt': Wald sequential test of p1=target against p0=target-margin with error rates alpha and beta;
+        stops with 'pass' (accept p1) or 'fail' (accept p0).
+    Either way it gives up with 'max_trials' after max_trials calls.
+    Returns {'successes','trials','rate','interval','decision','method'}.
+    '''
+    if method not in ('wilson','sprt'):
+        raise ValueError(f'Unknown method {method!r}, use wilson or sprt')
+    floor=target-margin
+    lo_thr,hi_thr=sprt_thresholds(alpha,beta)
+    successes=0
+    trials=0
+    decision='max_trials'
+    while trials<max_trials:
+        successes+=bool(trial_fn())
+        trials+=1
+        if trials<min_trials:
+            continue
+        if method=='sprt':
+            llr=sprt_llr(successes,trials,floor,target)
+            if llr>=hi_thr:
+                decision='pass'
+                break
+            if llr<=lo_thr:
+                decision='fail'
+                break
+        else:
+            lo,hi=wilson_interval(successes,trials,confidence)
+            if hi<floor:
+                decision='fail'
+                break
+            if lo>=floor:
+                decision='pass'
+                break
+            if (hi-lo)/2<=tolerance:
+                decision='converged'
+                break
+    return({'successes':successes,'trials':trials,'rate':successes/trials,
+            'interval':wilson_interval(successes,trials,confidence),'decision':decision,'method':method})
+
+
+def within_one_se_trial(M,shots=10**4,level=0): # One random problem at fixed M, scored like step_mult_test
+    V=ra.uniform(0.1,10)
+    W=V*ra.random()*(-1)**ra.randint(0,1)
+    nua=ra.randint(0,1)
+    nub=ra.randint(0,1)
+    if level=='random':
+        level=ra.randint(0,M-1)
+    targ_val,targ_state=state_finder_fock(M,V,W,nua,nub,level)
+    distr=distr_from_bits(V,W,nua,nub,sample_cliques(angle_finder(targ_state),shots))
+    mean=np.mean(distr)
+    se=np.std(distr)/np.sqrt(shots)
+    return(abs(mean)-se<=abs(targ_val)<=abs(mean)+se) # step_mult_test's criterion, on magnitudes
+
+
+def within_one_se_batch(M,num_trials,shots=10**4,level=0,backend='numpy'): # num_trials of within_one_se_trial in one batched run
+    problems=[]
+    for j in range(num_trials):
+        V=ra.uniform(0.1,10)
+        W=V*ra.random()*(-1)**ra.randint(0,1)
+        problems.append((V,W,ra.randint(0,1),ra.randint(0,1),ra.randint(0,M-1) if level=='random' else level))
+    res=run_batch(M,problems,shots,backend)
+    return(np.array([abs(r['mean'])-r['std_error']<=abs(r['target'])<=abs(r['mean'])+r['std_error'] for r in res]))
@@ -0,0 +1,127 @@
+# Variational mode: optimize the state_prep angles instead of taking them from angle_finder.
+# <H> is evaluated either exactly (the ansatz stays in the unary subspace, so <H> = a.H.a with a from
+# verify.unary_amplitudes and H from state_generator.ham_maker) or from shots through the usual 4-clique measurement.
+# Gradients use the parameter-shift rule. Qubit 0 carries a plain RY, whose generator has eigenvalues +-1/2, so the
+# two-term rule is exact. The other angles sit in CRY gates, whose generator also has a 0 eigenvalue, so they need the
+# four-term rule (shifts +-pi/2 and +-3pi/2). All shifted circuits of a step, plus the current point, are evaluated as
+# one batch.
+#
+# res=optimize(4,3.0,1.2,0,1,init='random',shots=None,seed=1)
+# print(res['energy'],res['reference'],res['converged'])
+import numpy as np
+from verify import unary_amplitudes
+from state_generator import ham_maker, state_finder_fock, angle_finder
+from analyzer import distr_from_bits
+
+CRY_PLUS=(np.sqrt(2)+1)/(4*np.sqrt(2)) # Four-term shift rule coefficients
+CRY_MINUS=(np.sqrt(2)-1)/(4*np.sqrt(2))
+
+
+def expectation_exact(angle_rows,ham): # <H> for every row of a (batch, M) angle array, no sampling noise
+    amps=unary_amplitudes(angle_rows)
+    return(np.einsum('bi,ij,bj->b',amps,ham,amps))
+
+
+def expectation_shots(angle_rows,V,W,nua,nub,shots,backend='numpy'): # Shot estimates of <H> (and their standard errors) per row
+    from backends import run_cliques_batch
+    clique_bits=run_cliques_batch(angle_rows,shots,backend)
+    means=np.empty(len(angle_rows))
+    errors=np.empty(len(angle_rows))
+    for j in range(len(angle_rows)):
+        distr=distr_from_bits(V,W,nua,nub,[cb[j] for cb in clique_bits])
+        means[j]=np.mean(distr)
+        errors[j]=np.std(distr)/np.sqrt(shots)
+    return(means,errors)
+
+
+def shift_batch(angles):
+    '''
+    Rows to evaluate for one gradient step and how to combine them.
+    Returns (rows, coef) where rows[0] is angles itself and grad = coef @ energies(rows).
+    '''
+    M=len(angles)
+    shifts=[] # (parameter, offset, weight)
+    shifts+=[(0,np.pi/2,0.5),(0,-np.pi/2,-0.5)]
+    for k in range(1,M):
+        shifts+=[(k,np.pi/2,CRY_PLUS),(k,-np.pi/2,-CRY_PLUS),(k,3*np.pi/2,-CRY_MINUS),(k,-3*np.pi/2,CRY_MINUS)]
+    rows=np.tile(np.asarray(angles,dtype=float),(len(shifts)+1,1))
+    coef=np.zeros((M,len(shifts)+1))
+    for j,(k,offset,weight) in enumerate(shifts):
+        rows[j+1,k]+=offset
+        coef[k,j+1]=weight
+    return(rows,coef)
+
+
+def start_angles(M,V,W,nua,nub,init='random',scale=0.3,energy_level=0,rng=None):
+    # 'random': uniform in [0, 2pi). 'perturbed': the angle_finder solution plus N(0, scale) noise. An array is used as is.
+    rng=np.random.default_rng() if rng is None else rng
+    if isinstance(init,str):
+        if init=='random':
+            return(rng.uniform(0,2*np.pi,M))
+        if init=='perturbed':
+            return(np.asarray(angle_finder(state_finder_fock(M,V,W,nua,nub,energy_level)[1]))+rng.normal(0,scale,M))
+        raise ValueError(f'Unknown init {init!r}, use random or perturbed')
+    return(np.array(init,dtype=float))
+
+
+def optimize(M,V,W,nua,nub,init='random',shots=None,steps=300,lr=0.1,method='adam',tol=1e-6,scale=0.3,seed=None,
+             backend='numpy',verbose=False,patience=3):
+    '''
+    Minimizes <H> over the state_prep angles by parameter-shift gradient descent (method 'adam' or 'gd').
+    shots=None evaluates <H> exactly; otherwise every circuit gets that many shots per clique.
+    Stops when the energy is within tol of the state_finder_fock ground state energy or after steps steps. With shots
+    the estimate must be within max(tol, its standard error) for patience steps in a row, so one lucky estimate
+    does not end the run.
+    Returns {'angles','energy','reference','error','noisy_error','converged','steps','circuits','history'}: energy and
+    error are exact for the final angles, noisy_error is the last estimate's. history holds per-step 'energy',
+    'std_error' (0 when exact), 'grad_norm', 'error' (of the estimate) and 'true_error' (exact) arrays.
+    '''
+    if method not in ('adam','gd'):
+        raise ValueError(f'Unknown method {method!r}, use adam or gd')
+    rng=np.random.default_rng(seed)
+    ham=ham_maker(M,V,W,nua,nub)
+    reference=float(np.linalg.eigvalsh(ham)[0])
+    angles=start_angles(M,V,W,nua,nub,init,scale,0,rng)
+    if shots is not None and isinstance(backend,str):
+        from backends import get_backend
+        backend=get_backend(backend)
+        backend.rng=np.random.default_rng(rng.integers(2**63))
+    m=np.zeros(M)
+    v=np.zeros(M)
+    hist={'energy':[],'std_error':[],'grad_norm':[],'error':[],'true_error':[]}
+    circuits=0
+    converged=False
+    streak=0 # Consecutive steps inside the convergence window
+    for step in range(1,steps+1):
+        rows,coef=shift_batch(angles)
+        if shots is None:
+            energies=expectation_exact(rows,ham)
+            err=0.0
+        else:
+            energies,errors=expectation_shots(rows,V,W,nua,nub,shots,backend)
+            err=float(errors[0])
+        circuits+=len(rows)
+        grad=coef@energies
+        energy=float(energies[0])
+        hist['energy'].append(energy)
+        hist['std_error'].append(err)
+        hist['grad_norm'].append(float(np.linalg.norm(grad)))
+        hist['error'].append(energy-reference)
+        true_energy=energy if shots is None else float(expectation_exact(angles[None],ham)[0]) # Free in simulation
+        hist['true_error'].append(true_energy-reference)
+        if verbose:
+            print(f'step {step}: <H> = {energy:.6f} (ref {reference:.6f}), |grad| = {hist["grad_norm"][-1]:.2e}')
+        streak=streak+1 if abs(energy-reference)<=max(tol,err) else 0
+        if streak>=(1 if shots is None else patience):
+            converged=True
+            break
+        if method=='adam':
+            m=0.9*m+0.1*grad
+            v=0.999*v+0.001*grad**2
+            angles=angles-lr*(m/(1-0.9**step))/(np.sqrt(v/(1-0.999**step))+1e-8)
+        else:
+            angles=angles-lr*grad
+    energy=float(expectation_exact(angles[None],ham)[0])
+    return({'angles':angles,'energy':energy,'reference':reference,'error':energy-reference,
+            'noisy_error':hist['error'][-1],'converged':converged,
+            'steps':step,'circuits':circuits,'history':{k:np.array(x) for k,x in hist.items()}})
@@ -0,0 +1,115 @@
+# Verification of prepared states in the unary subspace.
+# The state_prep ansatz only populates the M+1 "thermometer" basis states 1..10..0, so instead of scanning all 2^M
+# amplitudes we gather exactly those M+1 entries. With qubit 0 as the most significant bit (the simulator's ordering)
+# Fock component n of the state_finder_fock vector sits at index 2^M - 2^n.
+import numpy as np
+from lmg import state_prep
+from state_generator import state_finder_fock, angle_finder
+
+
+def unary_indices(M): # Statevector indices of Fock states n=0..M, in state_finder_fock order
+    return((1<<M)-(1<<np.arange(M+1,dtype=np.int64)))
+
+
+def simulated_state(angles): # Dense statevector of state_prep(angles)
+    import dwave.gate.simulator
+    circ=state_prep(angles)
+    st=dwave.gate.simulator.simulate(circ)
+    if st is None: # Newer dwave.gate keeps the state on the circuit instead of returning it
+        st=circ.state
+    return(np.asarray(st))
+
+
+def unary_amplitudes(angles):
+    '''
+    Amplitudes of the M+1 unary states produced by state_prep, computed directly from the angles in O(M).
+    angles may be (M,) or (batch, M). Returns (..., M+1) in state_finder_fock order.
+    The thermometer state with m leading ones has amplitude sin(t_0/2)...sin(t_(m-1)/2)cos(t_m/2), and is Fock n=M-m.
+    '''
+    angles=np.asarray(angles,dtype=float)
+    half=angles/2
+    ones=np.ones(angles.shape[:-1]+(1,))
+    run=np.concatenate([ones,np.cumprod(np.sin(half),axis=-1)],axis=-1) # product of sines over the first m qubits
+    stop=np.concatenate([np.cos(half),ones],axis=-1) # cos of the first qubit left at 0 (none when all are 1)
+    return((run*stop)[...,::-1])
+
+
+def compare(amps,targ_states,leakage=None): # Fidelity, max deviation and leakage for matched (..., M+1) arrays
+    amps=np.asarray(amps)
+    targ_states=np.asarray(targ_states)
+    overlap=np.sum(np.conj(targ_states)*amps,axis=-1)
+    out={'fidelity':np.abs(overlap)**2,'max_dev':np.max(np.abs(amps-targ_states),axis=-1)}
+    out['leakage']=np.clip(1-np.sum(np.abs(amps)**2,axis=-1),0,None) if leakage is None else leakage
+    return(out)
+
+
+def verify_state(angles,targ_state,state=None):
+    '''
+    Checks the circuit's output state against targ_state (a state_finder_fock vector).
+    state defaults to a fresh simulation of state_prep(angles). Returns {'fidelity','max_dev','leakage','amplitudes'},
+    where leakage is the weight outside the unary subspace.
+    '''
+    if state is None:
+        state=simulated_state(angles)
+    amps=state[unary_indices(len(angles))]
+    out=compare(amps,targ_state,leakage=max(0.0,float(np.sum(np.abs(state)**2)-np.sum(np.abs(amps)**2))))
+    out['fidelity']=float(out['fidelity'])
+    out['max_dev']=float(out['max_dev'])
+    out['amplitudes']=amps
+    return(out)
+
+
+def verify_batch(angle_rows,targ_states,method='statevector',max_bytes=1<<26):
+    '''
+    Verifies many problems at once. angle_rows and targ_states are lists (M may differ between entries).
+    method='statevector' prepares every problem sharing M as one batched backends.NumpyBackend state (in chunks of at
+    most max_bytes) and gathers the M+1 unary amplitudes of all of them with one fancy index; leakage is 1 minus the
+    gathered weight, so a faulty state_prep shows up. method='dwave' simulates each circuit with dwave.gate (slow).
+    method='formula' is the fast path that only evaluates unary_amplitudes, i.e. checks the angles, not the circuit.
+    Returns arrays 'fidelity', 'max_dev', 'leakage' in input order.
+    '''
+    if method not in ('statevector','dwave','formula'):
+        raise ValueError(f'Unknown method {method!r}, use statevector, dwave or formula')
+    n=len(angle_rows)
+    out={'fidelity':np.empty(n),'max_dev':np.empty(n),'leakage':np.empty(n)}
+    if method=='dwave':
+        for i in range(n):
+            res=verify_state(angle_rows[i],targ_states[i])
+            for k in out:
+                out[k][i]=res[k]
+        return(out)
+    if method=='statevector':
+        from backends import NumpyBackend
+        backend=NumpyBackend(dtype=np.float64) # Every state_prep gate is real
+    sizes=np.array([len(a) for a in angle_rows])
+    for M in np.unique(sizes):
+        sel=np.flatnonzero(sizes==M)
+        angles=np.array([angle_rows[i] for i in sel],dtype=float)
+        targs=np.array([targ_states[i] for i in sel])
+        if method=='formula':
+            res=compare(unary_amplitudes(angles),targs)
+        else:
+            idx=unary_indices(M)
+            step=max(1,max_bytes//(8<<M))
+            amps=np.empty((len(sel),M+1))
+            for s in range(0,len(sel),step):
+                amps[s:s+step]=backend.prepare(angles[s:s+step]).reshape(-1,1<<M)[:,idx]
+            res=compare(amps,targs,leakage=1-np.sum(amps**2,axis=-1))
+        for k in out:
+            out[k][sel]=res[k]
+    return(out)
+
+
+def random_problem_check(num_checks=1000,max_M=10,method='statevector',seed=None):
+    # Batch version of tester.check_states: random ground states, angles from angle_finder, all verified together.
+    rng=np.random.default_rng(seed)
+    angle_rows=[]
+    targ_states=[]
+    for j in range(num_checks):
+        M=int(rng.integers(1,max_M+1))
+        V=rng.uniform(0.1,10)
+        W=V*rng.random()*(-1)**rng.integers(0,2)
+        targ_val,targ_state=state_finder_fock(M,V,W,int(rng.integers(0,2)),int(rng.integers(0,2)),0)
+        angle_rows.append(angle_finder(targ_state))
+        targ_states.append(targ_state)
+    return(verify_batch(angle_rows,targ_states,method))